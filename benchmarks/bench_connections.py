@@ -0,0 +1,69 @@
+"""
+Compare per-request latency of the API endpoints with a new database
+connection per request (CONN_MAX_AGE=0) and with persistent connections.
+
+Connection setup is only significant for a networked database, so run
+this against PostgreSQL (SQL_ENGINE, SQL_HOST, ... as for the server):
+
+    SQL_ENGINE=django.db.backends.postgresql python -m benchmarks.bench_connections
+
+To measure a pooler, point SQL_HOST/SQL_PORT at pgbouncer instead.
+"""
+
+from benchmarks.common import (
+    argument_parser,
+    benchmark_database,
+    create_synthetic_results,
+    load_reference_data,
+    measure,
+    report,
+    setup_django,
+)
+
+ENDPOINTS = ["get_patients", "get_samples", "get_observations"]
+
+
+def main():
+    parser = argument_parser(__doc__)
+    parser.add_argument(
+        "--requests", type=int, default=200, help="Requests per timed run"
+    )
+    parser.set_defaults(samples=10)
+    args = parser.parse_args()
+    setup_django()
+
+    from django.db import close_old_connections, connection
+    from django.test import Client, override_settings
+    from django.urls import reverse
+
+    with benchmark_database(), override_settings(API_CACHE_TIMEOUT=0):
+        load_reference_data()
+        create_synthetic_results(args.samples)
+        if connection.vendor == "sqlite":
+            print("SQLite test databases are never closed - use PostgreSQL")
+
+        client = Client()
+        baseline = {}
+        for max_age, label in [(0, "new connection"), (600, "persistent")]:
+            connection.close()
+            connection.settings_dict["CONN_MAX_AGE"] = max_age
+            for endpoint in ENDPOINTS:
+                url = reverse(endpoint)
+
+                def run_requests():
+                    for _ in range(args.requests):
+                        # What the request handler does around each request
+                        close_old_connections()
+                        client.get(url)
+                        close_old_connections()
+
+                timings = [
+                    timing / args.requests
+                    for timing in measure(run_requests, args.repeat)
+                ]
+                report(f"{endpoint} - {label}", timings, baseline.get(endpoint))
+                baseline.setdefault(endpoint, timings)
+
+
+if __name__ == "__main__":
+    main()
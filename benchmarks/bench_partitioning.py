@@ -0,0 +1,102 @@
+"""
+Compare value table scans and upload writes with plain and with range
+partitioned value tables (see openfacstrack/apps/track/partitioning.py).
+
+Partitioning is PostgreSQL only, so run this against PostgreSQL:
+
+    SQL_ENGINE=django.db.backends.postgresql python -m benchmarks.bench_partitioning --samples 2000
+
+The same synthetic data is timed first with the plain tables, then after
+partitioning them in place.
+"""
+
+from benchmarks.common import (
+    argument_parser,
+    benchmark_database,
+    create_synthetic_results,
+    load_reference_data,
+    measure,
+    report,
+    setup_django,
+)
+
+
+def main():
+    parser = argument_parser(__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--partitions",
+        type=int,
+        default=8,
+        help="Number of partitions to spread the results over",
+    )
+    parser.add_argument(
+        "--upload-results",
+        type=int,
+        default=50,
+        help="Results rewritten by the timed upload",
+    )
+    parser.set_defaults(samples=2000)
+    args = parser.parse_args()
+    setup_django()
+
+    import pandas as pd
+    from django.db import connection
+    from django.db.models import Avg, Max
+    from django.test import override_settings
+
+    from openfacstrack.apps.track.models import NumericValue, Result
+    from openfacstrack.apps.track.partitioning import partition_value_tables
+    from openfacstrack.apps.track.staging import merge_values
+
+    if connection.vendor != "postgresql":
+        parser.exit(1, "Partitioning needs PostgreSQL - set SQL_ENGINE and SQL_*\n")
+
+    with benchmark_database():
+        load_reference_data()
+        n_values = create_synthetic_results(args.samples)
+        max_result_id = Result.objects.aggregate(Max("id"))["id__max"]
+        partition_size = max_result_id // args.partitions + 1
+        print(f"{n_values} values, partitions of {partition_size} results")
+
+        # The newest results, as read back and rewritten after an upload
+        recent = list(
+            Result.objects.order_by("-id").values_list("id", flat=True)[
+                : args.upload_results
+            ]
+        )
+        upload = pd.DataFrame(
+            NumericValue.objects.filter(result_id__in=recent).values(
+                "result_id", "parameter_id", "value"
+            )
+        )
+
+        cases = [
+            ("count all values", lambda: NumericValue.objects.count()),
+            (
+                "mean of the newest results",
+                lambda: NumericValue.objects.filter(result_id__in=recent).aggregate(
+                    Avg("value")
+                ),
+            ),
+            (
+                "values of one result",
+                lambda: list(NumericValue.objects.filter(result_id=recent[0])),
+            ),
+            ("rewrite an upload", lambda: merge_values(NumericValue, upload)),
+        ]
+
+        baseline = {}
+        for layout in ["plain", "partitioned"]:
+            if layout == "partitioned":
+                with override_settings(TRACK_VALUE_PARTITION_SIZE=partition_size):
+                    partition_value_tables(connection)
+            with connection.cursor() as cursor:
+                cursor.execute("VACUUM ANALYZE")
+            for name, function in cases:
+                timings = measure(function, args.repeat)
+                report(f"{name} ({layout})", timings, baseline.get(name))
+                baseline.setdefault(name, timings)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""
+Compare the standard ModelSerializer path with the fast values_list()
+path for the observation and all data serializers.
+"""
+
+from benchmarks.common import (
+    argument_parser,
+    benchmark_database,
+    create_synthetic_results,
+    load_reference_data,
+    measure,
+    report,
+    setup_django,
+)
+
+
+def main():
+    args = argument_parser(__doc__).parse_args()
+    setup_django()
+
+    from django.test import override_settings
+    from rest_framework.renderers import JSONRenderer
+
+    from openfacstrack.apps.track.models import Patient, Result
+    from openfacstrack.apps.track.serializers import (
+        AllDataSerializer,
+        ObservationSerializer,
+    )
+
+    with benchmark_database():
+        load_reference_data()
+        n_values = create_synthetic_results(args.samples)
+        print(
+            f"{args.samples} samples, {Result.objects.count()} results, "
+            + f"{n_values} values"
+        )
+
+        cases = [
+            ("observations", ObservationSerializer, Result),
+            ("all data", AllDataSerializer, Patient),
+        ]
+        for name, serializer_class, model in cases:
+
+            def serialize():
+                serializer = serializer_class(model.objects.all(), many=True)
+                return JSONRenderer().render(serializer.data)
+
+            with override_settings(TRACK_FAST_SERIALIZERS=False):
+                standard = measure(serialize, args.repeat)
+            fast = measure(serialize, args.repeat)
+            report(f"{name} - ModelSerializer", standard)
+            report(f"{name} - fast", fast, baseline=standard)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Time process start up - what each web worker, manage.py invocation and
+test run pays before doing any work - in fresh interpreters, and report
+whether pandas was imported on the way:
+
+    python -m benchmarks.bench_startup --repeat 10
+
+The upload case shows the cost deferred to the first upload a process
+handles.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+from benchmarks.common import report
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SETUP = """
+import os, sys, time
+start = time.perf_counter()
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "openfacstrack.settings")
+import django
+django.setup()
+"""
+REPORT = """
+print(time.perf_counter() - start, "pandas" in sys.modules)
+"""
+
+# (name, code run after django.setup())
+CASES = [
+    ("django.setup()", ""),
+    (
+        "web worker (URLconf and views)",
+        "from django.urls import get_resolver; get_resolver().url_patterns",
+    ),
+    (
+        "manage.py check",
+        "from django.core.management import call_command; call_command('check')",
+    ),
+    (
+        "first upload (upload classes)",
+        "from django.urls import get_resolver; get_resolver().url_patterns\n"
+        + "import openfacstrack.apps.track.utils",
+    ),
+]
+
+
+def run(code):
+    """Run code in a new interpreter, returning its time and if pandas loaded"""
+
+    output = subprocess.run(
+        [sys.executable, "-c", SETUP + code + REPORT],
+        capture_output=True,
+        check=True,
+        cwd=ROOT,
+        text=True,
+    ).stdout.split("\n")[-2]
+    duration, pandas_loaded = output.split()
+    return float(duration), pandas_loaded == "True"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--repeat", type=int, default=5, help="Number of timed runs per case"
+    )
+    args = parser.parse_args()
+
+    # Warm the file system cache and the bytecode caches
+    run(CASES[-1][1])
+    for name, code in CASES:
+        timings, pandas_loaded = [], False
+        for _ in range(args.repeat):
+            duration, pandas_loaded = run(code)
+            timings.append(duration)
+        report(f"{name} ({'with' if pandas_loaded else 'no'} pandas)", timings)
+
+
+if __name__ == "__main__":
+    main()
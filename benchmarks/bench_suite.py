@@ -0,0 +1,232 @@
+"""
+Time the upload pipeline, the export and every API endpoint against a
+synthetic cohort (see the generate_synthetic_data command) and store the
+results as JSON, to compare performance across commits:
+
+    python -m benchmarks.bench_suite --patients 200
+    git checkout other-branch
+    python -m benchmarks.bench_suite --patients 200 --compare benchmarks/results/<commit>.json
+
+Results are written to benchmarks/results/<commit>.json unless --output
+is given.
+"""
+
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+
+from benchmarks.common import (
+    benchmark_database,
+    load_reference_data,
+    measure,
+    report,
+    setup_django,
+)
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+# (name, url name, url kwargs)
+ENDPOINTS = [
+    ("export", "export", {}),
+    ("patients", "get_patients", {}),
+    ("patient", "get_patients", {"pk": "p0001"}),
+    ("samples", "get_samples", {}),
+    ("sample", "get_samples_by_clinical_sample_id", {"pk": "p0001n01"}),
+    ("observations", "get_observations", {}),
+    (
+        "observations of sample",
+        "get_observations_by_clinical_sample_id",
+        {"pk": "p0001n01"},
+    ),
+    ("all data", "get_all_data", {}),
+    ("all data of patient", "get_all_data", {"pk": "p0001"}),
+    ("changes", "get_changes", {}),
+]
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--patients", type=int, default=50)
+    parser.add_argument("--samples-per-patient", type=int, default=2)
+    parser.add_argument("--malformed-rate", type=float, default=0.01)
+    parser.add_argument("--derived-parameters", type=int, default=0)
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="Number of timed runs per case"
+    )
+    parser.add_argument("--output", help="Results file (JSON)")
+    parser.add_argument("--compare", help="Earlier results file to compare with")
+    args = parser.parse_args()
+    setup_django()
+
+    import django
+    from django.contrib.auth.models import User
+    from django.db import connection
+    from django.test import Client, override_settings
+    from django.urls import reverse
+
+    from openfacstrack.apps.track.export import export_json, write_export_snapshot
+    from openfacstrack.apps.track.models import (
+        GatingStrategy,
+        NumericValue,
+        Parameter,
+        Patient,
+        Result,
+        UploadedFile,
+        UploadTiming,
+    )
+    from openfacstrack.apps.track.synthetic import (
+        PATIENT_DATA_FILE,
+        cohort_files,
+        upload_file,
+    )
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+
+    results = {}
+
+    def record(name, timings):
+        results[name] = {
+            "timings": timings,
+            "best": min(timings),
+            "median": statistics.median(timings),
+        }
+        report(name, timings, baseline.get(name, {}).get("timings"))
+
+    settings_override = override_settings(
+        MEDIA_ROOT=tempfile.mkdtemp(),
+        # Snapshots are written in the background in production, so they
+        # are left out of the upload timings and written once below
+        EXPORT_SNAPSHOT_DIR="",
+        API_CACHE_TIMEOUT=0,
+        TRACK_METRICS=False,
+    )
+    with benchmark_database(), settings_override:
+        load_reference_data()
+        user = User.objects.create_user(username="benchmark")
+        gating_strategy = GatingStrategy.objects.create(strategy="manual")
+        files = cohort_files(
+            args.patients,
+            args.samples_per_patient,
+            malformed_rate=args.malformed_rate,
+            derived=args.derived_parameters,
+        )
+        patient_file = files.pop(PATIENT_DATA_FILE)
+
+        def upload(file_name, contents, gating_strategy, dry_run=False):
+            uploaded = upload_file(file_name, contents, user, gating_strategy, dry_run)
+            # A repeated upload is answered from the earlier one, so would
+            # time none of the pipeline
+            if uploaded.duplicate:
+                raise RuntimeError(f"{file_name} was skipped as a duplicate")
+
+        # Uploads - every run starts from an empty database. Each real
+        # upload is a new file, as on the upload page, so it is validated
+        # again rather than reusing the dry run's UploadedFile.
+        timings = {
+            "patient data": [],
+            "panel results (dry run)": [],
+            "panel results": [],
+        }
+        stage_timings = {}
+        for _ in range(args.repeat):
+            Patient.objects.all().delete()
+            UploadedFile.objects.all().delete()
+            Parameter.objects.filter(is_reference_parameter=False).delete()
+            timings["patient data"] += measure(
+                lambda: upload(PATIENT_DATA_FILE, patient_file, None), 1
+            )
+            for name, dry_run in [
+                ("panel results (dry run)", True),
+                ("panel results", False),
+            ]:
+                timings[name] += measure(
+                    lambda: [
+                        upload(file_name, contents, gating_strategy, dry_run)
+                        for file_name, contents in files.items()
+                    ],
+                    1,
+                )
+
+            # Time of each stage, over all panel results files of the run
+            for name, dry_run in [
+                ("panel results (dry run)", True),
+                ("panel results", False),
+            ]:
+                upload_timings = UploadTiming.objects.filter(
+                    uploaded_file__content_type="PANEL_RESULTS", dry_run=dry_run
+                )
+                if len(upload_timings) != len(files):
+                    raise RuntimeError(f"Missing stage timings for {name}")
+                for stage in UploadTiming.STAGES:
+                    stage_timings.setdefault(f"{name} {stage}", []).append(
+                        sum(getattr(timing, stage) for timing in upload_timings)
+                    )
+        for name, case_timings in timings.items():
+            record(f"upload {name}", case_timings)
+        for name, case_timings in stage_timings.items():
+            record(f"upload {name}", case_timings)
+
+        dataset = {
+            "patients": Patient.objects.count(),
+            "results": Result.objects.count(),
+            "numeric_values": NumericValue.objects.count(),
+        }
+
+        # Reads
+        with override_settings(EXPORT_SNAPSHOT_DIR=tempfile.mkdtemp()):
+            record("build export", measure(export_json, args.repeat))
+            record("write export snapshot", measure(write_export_snapshot, 1))
+            client = Client()
+            for name, url_name, kwargs in ENDPOINTS:
+                url = reverse(url_name, kwargs=kwargs)
+
+                def get():
+                    response = client.get(url)
+                    assert response.status_code == 200, (url, response.status_code)
+                    return response.getvalue()
+
+                record(f"GET {name}", measure(get, args.repeat))
+
+        output = args.output or os.path.join(RESULTS_DIR, f"{git_commit()}.json")
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        with open(output, "w") as f:
+            json.dump(
+                {
+                    "commit": git_commit(),
+                    "date": datetime.datetime.now().isoformat(timespec="seconds"),
+                    "python": platform.python_version(),
+                    "django": django.get_version(),
+                    "database": connection.vendor,
+                    "arguments": vars(args),
+                    "dataset": dataset,
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+        print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+"""
+Helpers shared by the benchmarks.
+
+Each benchmark runs against a throwaway test database created next to
+the configured one, so benchmarks never touch real data. Run them from
+the repository root, e.g.
+
+    python -m benchmarks.bench_serializers --samples 200
+"""
+
+import argparse
+import contextlib
+import datetime
+import io
+import os
+import random
+import statistics
+import time
+
+REFERENCE_DATA = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "openfacstrack",
+    "apps",
+    "track",
+    "tests",
+    "test_data",
+    "population_names_20200413.xlsx",
+)
+
+NUMERIC_TYPES = ("PanelNumeric", "SampleNumeric", "DerivedNumeric")
+
+
+def setup_django():
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "openfacstrack.settings")
+    import django
+
+    django.setup()
+
+
+def argument_parser(description):
+    """Argument parser with the options every benchmark takes"""
+
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument(
+        "--samples",
+        type=int,
+        default=100,
+        help="Number of synthetic samples to create (one result per panel)",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=5, help="Number of timed runs per case"
+    )
+    return parser
+
+
+@contextlib.contextmanager
+def benchmark_database():
+    """Create a test database for the duration of the benchmark"""
+
+    from django.db import connection
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+def load_reference_data():
+    from django.core.management import call_command
+
+    call_command(
+        "update_panel_parameter_reference_data", REFERENCE_DATA, stdout=io.StringIO()
+    )
+
+
+def create_synthetic_results(n_samples, seed=0):
+    """Create samples with one result per panel and a value per parameter
+
+    Returns the number of values created.
+    """
+
+    from openfacstrack.apps.track.models import (
+        DataProcessing,
+        DateValue,
+        GatingStrategy,
+        NumericValue,
+        Panel,
+        Parameter,
+        Patient,
+        ProcessedSample,
+        Result,
+        TextValue,
+    )
+
+    rng = random.Random(seed)
+    gating_strategy, _ = GatingStrategy.objects.get_or_create(
+        strategy="Automatically Gated"
+    )
+    panels = list(Panel.objects.all())
+    parameters = {panel.pk: [] for panel in panels}
+    for parameter in Parameter.objects.all():
+        parameters[parameter.panel_id].append(parameter)
+
+    patients = _bulk_create(
+        Patient, [Patient(patient_id=f"s{i:05d}") for i in range(n_samples)]
+    )
+    samples = _bulk_create(
+        ProcessedSample,
+        [
+            ProcessedSample(
+                clinical_sample_id=f"{patient.patient_id}n01",
+                patient=patient,
+                biobank_id=f"b{i:05d}",
+                comments="",
+            )
+            for i, patient in enumerate(patients)
+        ],
+    )
+    data_processings = _bulk_create(
+        DataProcessing,
+        [
+            DataProcessing(
+                panel=panel,
+                fcs_file_name=f"{sample.clinical_sample_id}_{panel.name}.fcs",
+                fcs_file_location="",
+            )
+            for sample in samples
+            for panel in panels
+        ],
+    )
+    results = _bulk_create(
+        Result,
+        [
+            Result(
+                processed_sample=sample,
+                panel=data_processing.panel,
+                gating_strategy=gating_strategy,
+                data_processing=data_processing,
+            )
+            for sample, data_processing in zip(
+                [sample for sample in samples for _ in panels], data_processings
+            )
+        ],
+    )
+    numeric_values, text_values, date_values = [], [], []
+    for result in results:
+        for parameter in parameters[result.panel_id]:
+            if parameter.data_type in NUMERIC_TYPES:
+                numeric_values.append(
+                    NumericValue(
+                        result=result,
+                        parameter=parameter,
+                        value=round(rng.uniform(0, 10000), 2),
+                    )
+                )
+            elif parameter.data_type == "Date":
+                date_values.append(
+                    DateValue(
+                        result=result,
+                        parameter=parameter,
+                        value=datetime.date(2020, 3, 1)
+                        + datetime.timedelta(days=rng.randrange(60)),
+                    )
+                )
+            else:
+                text_values.append(
+                    TextValue(
+                        result=result,
+                        parameter=parameter,
+                        value=rng.choice(["", "Test comments", "1", "2"]),
+                    )
+                )
+    NumericValue.objects.bulk_create(numeric_values, batch_size=5000)
+    TextValue.objects.bulk_create(text_values, batch_size=5000)
+    DateValue.objects.bulk_create(date_values, batch_size=5000)
+    return len(numeric_values) + len(text_values) + len(date_values)
+
+
+def _bulk_create(model, objects):
+    """bulk_create returning the objects with their primary keys set"""
+
+    created = model.objects.bulk_create(objects)
+    if created and created[0].pk is None:
+        # Only some databases return primary keys from bulk_create - the
+        # benchmark database is fresh, so the newest rows are these
+        created = list(model.objects.order_by("-pk")[: len(created)])[::-1]
+    return created
+
+
+def measure(function, repeat=5):
+    """Return the wall times in seconds of repeated calls to function"""
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def report(name, timings, baseline=None):
+    """Print the best and median time, and the speed up over a baseline"""
+
+    line = f"{name:<40} best {min(timings):8.4f}s  median {statistics.median(timings):8.4f}s"
+    if baseline is not None:
+        line += f"  x{min(baseline) / min(timings):.1f}"
+    print(line)
@@ -0,0 +1,110 @@
+"""
+Load test the REST API of a running server.
+
+Start the server the way it runs in production, e.g.
+
+    gunicorn -c gunicorn.conf.py
+    python -m benchmarks.load_test --url http://localhost:8000 --concurrency 16
+
+and compare with
+
+    python manage.py runserver
+    python -m benchmarks.load_test --url http://localhost:8000 --concurrency 16
+
+Each worker thread requests the endpoints in turn for the given duration.
+Throughput and latency percentiles are reported per endpoint.
+"""
+
+import argparse
+import statistics
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+ENDPOINTS = [
+    "/track/api/v1/patients/",
+    "/track/api/v1/samples/",
+    "/track/api/v1/observations/",
+    "/track/api/v1/alldata/",
+]
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def run_worker(base_url, endpoints, deadline, timings, errors, lock):
+    session = requests.Session()
+    i = 0
+    while time.monotonic() < deadline:
+        endpoint = endpoints[i % len(endpoints)]
+        i += 1
+        start = time.perf_counter()
+        try:
+            response = session.get(base_url + endpoint, timeout=60)
+            failed = response.status_code != 200
+        except requests.RequestException:
+            failed = True
+        elapsed = time.perf_counter() - start
+        with lock:
+            if failed:
+                errors[endpoint] += 1
+            else:
+                timings[endpoint].append(elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=30, help="Seconds")
+    parser.add_argument(
+        "--endpoint",
+        action="append",
+        help="Endpoint to request (repeatable). Default: the main API endpoints",
+    )
+    args = parser.parse_args()
+
+    endpoints = args.endpoint or ENDPOINTS
+    timings = defaultdict(list)
+    errors = defaultdict(int)
+    lock = threading.Lock()
+    deadline = time.monotonic() + args.duration
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        for _ in range(args.concurrency):
+            executor.submit(
+                run_worker,
+                args.url.rstrip("/"),
+                endpoints,
+                deadline,
+                timings,
+                errors,
+                lock,
+            )
+
+    print(
+        f"{'endpoint':<32} {'requests':>8} {'errors':>6} {'req/s':>8} "
+        + f"{'median':>8} {'p95':>8} {'p99':>8}"
+    )
+    for endpoint in endpoints:
+        times = timings[endpoint]
+        if not times:
+            print(f"{endpoint:<32} {0:>8} {errors[endpoint]:>6}")
+            continue
+        print(
+            f"{endpoint:<32} {len(times):>8} {errors[endpoint]:>6} "
+            + f"{len(times) / args.duration:>8.1f} "
+            + f"{statistics.median(times) * 1000:>6.0f}ms "
+            + f"{percentile(times, 0.95) * 1000:>6.0f}ms "
+            + f"{percentile(times, 0.99) * 1000:>6.0f}ms"
+        )
+    total = sum(len(times) for times in timings.values())
+    print(f"Total: {total / args.duration:.1f} requests/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -11,5 +11,6 @@ then
     echo "PostgreSQL started"
 fi
 python manage.py migrate
+python manage.py ensure_value_partitions
 python manage.py collectstatic --no-input --clear
 exec "$@"
\ No newline at end of file
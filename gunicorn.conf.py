@@ -0,0 +1,45 @@
+"""
+Gunicorn configuration for production, set from the environment.
+
+    gunicorn -c gunicorn.conf.py
+
+serves the WSGI application. To serve openfacstrack/asgi.py instead set
+GUNICORN_APP=openfacstrack.asgi:application and
+GUNICORN_WORKER_CLASS=uvicorn.workers.UvicornWorker (requires uvicorn).
+"""
+
+import multiprocessing
+import os
+
+wsgi_app = os.environ.get("GUNICORN_APP", "openfacstrack.wsgi:application")
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:8000")
+
+# Workers - the API is mostly database and serialization bound, so the
+# usual 2 x cores + 1 sync workers is a good start. Threaded workers
+# (gthread) help when requests wait on the database.
+workers = int(os.environ.get("GUNICORN_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "sync")
+threads = int(os.environ.get("GUNICORN_THREADS", 1))
+
+# Uploads of large panel files can take a while to validate
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 120))
+graceful_timeout = int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT", 30))
+keepalive = int(os.environ.get("GUNICORN_KEEPALIVE", 5))
+
+# Recycle workers to bound memory growth from pandas and large responses
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", 1000))
+max_requests_jitter = int(os.environ.get("GUNICORN_MAX_REQUESTS_JITTER", 100))
+
+# Load the application before forking so workers share its memory
+preload_app = os.environ.get("GUNICORN_PRELOAD", "1") == "1"
+
+accesslog = os.environ.get("GUNICORN_ACCESS_LOG", "-")
+errorlog = os.environ.get("GUNICORN_ERROR_LOG", "-")
+loglevel = os.environ.get("GUNICORN_LOG_LEVEL", "info")
+
+
+def post_fork(server, worker):
+    # Never share database connections opened while preloading
+    from django.db import connections
+
+    connections.close_all()
@@ -0,0 +1 @@
+default_app_config = "openfacstrack.apps.track.apps.TrackConfig"
@@ -15,6 +15,7 @@ from openfacstrack.apps.track.models import (
     TextValue,
     DateValue,
     UploadedFile,
+    UploadTiming,
     ValidationEntry,
 )
 
@@ -82,6 +83,13 @@ class DateValueAdmin(admin.ModelAdmin):
         return super().formfield_for_foreignkey(db_field, request, **kwargs)
 
 
+class UploadTimingAdmin(admin.ModelAdmin):
+    list_display = ["uploaded_file", "dry_run", "created", "rows", "cells"] + (
+        UploadTiming.STAGES
+    )
+    list_filter = ["dry_run"]
+
+
 admin.site.register(Patient)
 admin.site.register(PatientMetadataDict, PatientMetadataDictAdmin)
 # admin.site.register(PatientMetadata, PatientMetadataAdmin)
@@ -97,3 +105,4 @@ admin.site.register(TextValue, TextValueAdmin)
 admin.site.register(DateValue, DateValueAdmin)
 admin.site.register(UploadedFile)
 admin.site.register(ValidationEntry)
+admin.site.register(UploadTiming, UploadTimingAdmin)
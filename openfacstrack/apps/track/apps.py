@@ -2,4 +2,9 @@ from django.apps import AppConfig
 
 
 class TrackConfig(AppConfig):
-    name = "track"
+    name = "openfacstrack.apps.track"
+    label = "track"
+
+    def ready(self):
+        # Connect signal handlers
+        from openfacstrack.apps.track import signals  # noqa: F401
@@ -0,0 +1,49 @@
+"""
+Async versions of the read-heavy views, served when TRACK_ASYNC_VIEWS is
+set and the project runs under ASGI (openfacstrack/asgi.py).
+
+Django 3.1 has no async ORM, so each view runs the sync view - queries,
+serialization and rendering included - in a worker thread from a pool
+rather than on the thread shared by all sync code. The event loop then
+sends the rendered body, or streams the export snapshot, to the client,
+so slow clients downloading large payloads do not hold a thread each.
+"""
+
+import functools
+
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+
+from openfacstrack.apps.track import views
+
+
+def _run_view(view, request, *args, **kwargs):
+    """Run a sync view and render its response in the current thread"""
+
+    # Worker threads keep their own database connections, which the
+    # request_started/finished signals do not see
+    close_old_connections()
+    try:
+        response = view(request, *args, **kwargs)
+        if callable(getattr(response, "render", None)):
+            response.render()
+        return response
+    finally:
+        close_old_connections()
+
+
+def async_view(view):
+    """Return an async view that runs the sync view in a worker thread"""
+
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        return await sync_to_async(_run_view, thread_sensitive=False)(
+            view, request, *args, **kwargs
+        )
+
+    return wrapper
+
+
+get_observations = async_view(views.get_observations)
+get_all_data = async_view(views.get_all_data)
+export_view = async_view(views.export_view)
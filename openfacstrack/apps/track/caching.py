@@ -0,0 +1,218 @@
+"""
+Caching and conditional GET support for read-only responses.
+
+Cached data is keyed on a generation counter that is bumped whenever an
+upload or reference data update is committed, and after any other
+transaction that saves or deletes rows of the served models (e.g. admin
+edits). Entries from an earlier
+generation are never read again and simply expire. The same counter
+(and the time it was last bumped) provide ETag and Last-Modified
+headers, so unchanged responses can be answered with 304 Not Modified
+without touching the database.
+
+The counter is kept in the cache itself, so all processes serving the
+API must share a cache backend (e.g. file based or memcached) for a
+bump in one process to be seen by the others.
+"""
+
+import functools
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.cache import patch_vary_headers
+from django.views.decorators.http import condition
+from rest_framework.response import Response
+
+from openfacstrack.apps.track.models import (
+    Patient,
+    PatientMetadata,
+    PatientMetadataDict,
+    ProcessedSample,
+    Result,
+    DataProcessing,
+    GatingStrategy,
+    NumericValue,
+    TextValue,
+    DateValue,
+    Parameter,
+    Panel,
+    DeletionLog,
+)
+
+GENERATION_KEY = "track:generation"
+LAST_MODIFIED_KEY = "track:last_modified"
+
+# Models whose rows are served by the API, the export or the change feed.
+# Saving or deleting any of them bumps the generation (see signals.py).
+DATA_MODELS = [
+    Patient,
+    PatientMetadata,
+    PatientMetadataDict,
+    ProcessedSample,
+    Result,
+    DataProcessing,
+    GatingStrategy,
+    NumericValue,
+    TextValue,
+    DateValue,
+    Parameter,
+    Panel,
+    DeletionLog,
+]
+
+
+def get_generation():
+    """Return the current data generation"""
+
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        # Start from the current time (in ms) rather than 1 so that a
+        # counter lost from the cache never repeats an earlier generation
+        cache.add(GENERATION_KEY, int(time.time() * 1000), timeout=None)
+        generation = cache.get(GENERATION_KEY)
+    return generation
+
+
+def bump_generation():
+    """Invalidate all cached responses - call after committing new data"""
+
+    cache.set(LAST_MODIFIED_KEY, timezone.now(), timeout=None)
+    try:
+        return cache.incr(GENERATION_KEY)
+    except ValueError:
+        # Counter not in cache - starting a new one invalidates everything
+        return get_generation()
+
+
+def bump_generation_on_commit(using=None):
+    """Bump the generation once the current transaction is committed
+
+    Runs for every row saved or deleted, so the bump is only scheduled
+    once per transaction. Outside a transaction it happens immediately.
+    """
+
+    connection = transaction.get_connection(using)
+    if any(callback is bump_generation for _, callback in connection.run_on_commit):
+        return
+    transaction.on_commit(bump_generation, using=using)
+
+
+def get_last_modified():
+    """Return the time data was last changed
+
+    This is the time of the last generation bump. If that is not known
+    (e.g. the cache was cleared) it is computed once from the modified
+    timestamps of the tables served by the API.
+    """
+
+    last_modified = cache.get(LAST_MODIFIED_KEY)
+    if last_modified is None:
+        timestamps = [
+            model.objects.aggregate(last_modified=Max("modified"))["last_modified"]
+            for model in DATA_MODELS
+        ]
+        timestamps = [timestamp for timestamp in timestamps if timestamp]
+        last_modified = max(timestamps) if timestamps else timezone.now()
+        cache.add(LAST_MODIFIED_KEY, last_modified, timeout=None)
+    return last_modified
+
+
+def response_etag(request, vary=("Accept",)):
+    """Strong ETag for a response - changes whenever the data changes
+
+    The ETag depends on the generation, the full URL and the request
+    headers in vary (as those select the representation, e.g. Accept or
+    Accept-Encoding) but not on the data, so it is available before any
+    queries are made.
+    """
+
+    representation = repr(
+        (
+            get_generation(),
+            request.get_full_path(),
+            [
+                request.META.get("HTTP_" + header.upper().replace("-", "_"), "")
+                for header in vary
+            ],
+        )
+    )
+    return hashlib.sha1(representation.encode("utf-8")).hexdigest()
+
+
+def response_last_modified(request, *args, **kwargs):
+    return get_last_modified()
+
+
+def conditional_response(view=None, vary=("Accept",)):
+    """Answer conditional GETs with 304 Not Modified before calling the view
+
+    Adds ETag and Last-Modified headers to responses. vary lists the
+    request headers the representation depends on - they are part of the
+    ETag and the Vary header. Use below @api_view for REST framework views,
+    so authentication and permissions are checked before answering.
+    """
+
+    if view is None:
+        return functools.partial(conditional_response, vary=vary)
+
+    conditional_view = condition(
+        etag_func=lambda request, *args, **kwargs: response_etag(request, vary),
+        last_modified_func=response_last_modified,
+    )(view)
+
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        response = conditional_view(request, *args, **kwargs)
+        patch_vary_headers(response, vary)
+        return response
+
+    return wrapper
+
+
+def response_cache_key(request, view_name, kwargs):
+    """Key for the data returned by a view for a request
+
+    The key covers the endpoint, the URL arguments (e.g. pk) and all query
+    parameters except 'format', as the same data is cached for every
+    output format.
+    """
+
+    query = sorted(
+        (name, values)
+        for name, values in request.query_params.lists()
+        if name != "format"
+    )
+    arguments = repr((view_name, sorted(kwargs.items()), query))
+    digest = hashlib.md5(arguments.encode("utf-8")).hexdigest()
+    return f"track:api:{get_generation()}:{digest}"
+
+
+def cache_api_response(view):
+    """Cache the data of successful responses of a REST framework view
+
+    Use below @api_view so the view receives the REST framework request.
+    The data (not the rendered response) is cached, so content
+    negotiation still happens for every request.
+    """
+
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not settings.API_CACHE_TIMEOUT:
+            return view(request, *args, **kwargs)
+
+        key = response_cache_key(request, view.__name__, kwargs)
+        data = cache.get(key)
+        if data is not None:
+            return Response(data)
+
+        response = view(request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, response.data, settings.API_CACHE_TIMEOUT)
+        return response
+
+    return wrapper
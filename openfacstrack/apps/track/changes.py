@@ -0,0 +1,184 @@
+"""
+Change feed for incremental sync.
+
+Lists the rows of the feed models changed since a point in time, oldest
+first, so a consumer only has to fetch what changed since its last sync.
+Entries are ordered on (modified, model, id) and paged with a keyset
+cursor on that ordering, so every page is an index range scan however
+far into the feed it is. Each page returns an opaque cursor to fetch
+the next page from - and to poll for new changes once the feed is
+exhausted.
+
+Rows are stamped with their modified time when they are written, but an
+upload commits them later, so rows can become visible behind a cursor a
+consumer has already paged past. Rows modified within the last
+CHANGE_FEED_LAG_SECONDS are therefore held back until their transaction
+has long committed. For the same reason pages are not cached - they
+change as time passes, not only when data is committed.
+
+Deleted rows are listed as "delete" entries from the deletion log. The
+log is pruned after DELETION_LOG_RETENTION_DAYS, so a consumer that has
+not synced for longer than that must reload everything.
+"""
+
+import base64
+import datetime
+import heapq
+import itertools
+import json
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ValidationError
+
+from openfacstrack.apps.track.models import (
+    ProcessedSample,
+    PatientMetadata,
+    Result,
+    NumericValue,
+    TextValue,
+    DateValue,
+    DeletionLog,
+)
+
+# Models in the feed - the position breaks ties between rows of different
+# models with the same modified time, so it must not change
+FEED_MODELS = [
+    ProcessedSample,
+    PatientMetadata,
+    Result,
+    NumericValue,
+    TextValue,
+    DateValue,
+]
+
+DEFAULT_PAGE_SIZE = 1000
+MAX_PAGE_SIZE = 10000
+
+
+def encode_cursor(key):
+    modified, model_index, pk = key
+    text = json.dumps([modified.isoformat(), model_index, pk])
+    return base64.urlsafe_b64encode(text.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor):
+    try:
+        modified, model_index, pk = json.loads(base64.urlsafe_b64decode(cursor))
+        modified = parse_datetime(modified)
+        if modified is None:
+            raise ValueError
+        return modified, int(model_index), int(pk)
+    except (ValueError, TypeError):
+        raise ValidationError({"cursor": ["Invalid cursor"]})
+
+
+def _after(queryset, model_index, key, horizon):
+    """Rows of a model that come after a cursor key in the feed and were
+    modified before the horizon"""
+
+    queryset = queryset.filter(modified__lt=horizon)
+    if key is None:
+        return queryset
+    modified, key_model_index, pk = key
+    if model_index > key_model_index:
+        return queryset.filter(modified__gte=modified)
+    if model_index < key_model_index:
+        return queryset.filter(modified__gt=modified)
+    return queryset.filter(Q(modified__gt=modified) | Q(modified=modified, pk__gt=pk))
+
+
+def _entries(model_index, model, key, horizon, limit):
+    """Next changes of one model as (sort key, entry) pairs"""
+
+    fields = [field.attname for field in model._meta.concrete_fields]
+    rows = _after(model.objects.order_by("modified", "pk"), model_index, key, horizon)
+    for row in rows.values(*fields)[:limit]:
+        entry = {
+            "model": model._meta.model_name,
+            "id": row["id"],
+            "operation": "upsert",
+            "modified": row["modified"],
+            "data": row,
+        }
+        yield (row["modified"], model_index, row["id"]), entry
+
+
+def _deletions(model_index, key, horizon, limit):
+    """Next deletions as (sort key, entry) pairs"""
+
+    rows = _after(
+        DeletionLog.objects.order_by("modified", "pk"), model_index, key, horizon
+    )
+    for row in rows.values("id", "model", "object_id", "modified")[:limit]:
+        entry = {
+            "model": row["model"],
+            "id": row["object_id"],
+            "operation": "delete",
+            "modified": row["modified"],
+            "data": None,
+        }
+        yield (row["modified"], model_index, row["id"]), entry
+
+
+def get_changes(since=None, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """Return a page of the change feed
+
+    Parameters
+    ----------
+    since : datetime
+        Only list changes at or after this time. Ignored if a cursor is
+        given.
+    cursor : str
+        Cursor returned with the previous page
+    limit : int
+        Maximum number of changes to return
+
+    Returns
+    -------
+    page : dict
+        changes - list of changes, oldest first
+        next_cursor - cursor to continue from (None if nothing has been
+        listed yet)
+        has_more - whether more changes are available now
+
+    Changes made in the last CHANGE_FEED_LAG_SECONDS are not listed yet.
+    """
+
+    if cursor is not None:
+        key = decode_cursor(cursor)
+    elif since is not None:
+        # Before the first model at that time
+        key = (since, -1, 0)
+    else:
+        key = None
+
+    horizon = timezone.now() - datetime.timedelta(
+        seconds=settings.CHANGE_FEED_LAG_SECONDS
+    )
+
+    # Each model contributes at most limit + 1 rows, already in feed
+    # order, so merging them gives the page and whether there is more
+    streams = [
+        _entries(model_index, model, key, horizon, limit + 1)
+        for model_index, model in enumerate(FEED_MODELS)
+    ]
+    streams.append(_deletions(len(FEED_MODELS), key, horizon, limit + 1))
+    merged = list(
+        itertools.islice(heapq.merge(*streams, key=lambda item: item[0]), limit + 1)
+    )
+    page = merged[:limit]
+
+    if page:
+        next_cursor = encode_cursor(page[-1][0])
+    elif key is not None:
+        next_cursor = cursor if cursor is not None else encode_cursor(key)
+    else:
+        next_cursor = None
+    return {
+        "changes": [entry for _, entry in page],
+        "next_cursor": next_cursor,
+        "has_more": len(merged) > limit,
+    }
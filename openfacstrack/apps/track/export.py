@@ -0,0 +1,177 @@
+"""
+Export of all patient, sample and result data as JSON.
+
+Building the export is expensive, so after each committed upload or
+reference data change a snapshot (plain and gzip compressed) is written
+to EXPORT_SNAPSHOT_DIR in the background. Snapshots are named after the
+data generation they were built from, so only a snapshot of the current
+data is ever served.
+"""
+
+import glob
+import gzip
+import json
+import logging
+import os
+import threading
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.db.models import F
+
+from openfacstrack.apps.track.caching import get_generation
+from openfacstrack.apps.track.models import (
+    Patient,
+    PatientMetadata,
+    ProcessedSample,
+    Result,
+    NumericValue,
+    TextValue,
+    DateValue,
+)
+
+logger = logging.getLogger(__name__)
+
+# Only one snapshot is written at a time per process
+snapshot_lock = threading.Lock()
+
+
+def _group_by(rows, key):
+    """Return rows grouped by the value of key, in the order given"""
+
+    groups = {}
+    for row in rows:
+        groups.setdefault(row[key], []).append(row)
+    return groups
+
+
+def build_export():
+    """Return all patients with their metadata, samples and results
+
+    Each table is read in one query and the rows are nested in Python, so
+    the number of queries does not grow with the amount of data.
+    """
+
+    patients = list(Patient.objects.all().values("id", "patient_id"))
+    metadata = _group_by(
+        PatientMetadata.objects.annotate(column_name=F("metadata_key__name")).values(),
+        "patient_id",
+    )
+    samples = _group_by(ProcessedSample.objects.values(), "patient_id")
+    results = _group_by(
+        Result.objects.annotate(panel_name=F("panel__name"))
+        .annotate(gating_strategy_name=F("gating_strategy__strategy"))
+        .values(),
+        "processed_sample_id",
+    )
+    observations = {}
+    for value_model in [NumericValue, TextValue, DateValue]:
+        values = value_model.objects.annotate(
+            parameter_name=F("parameter__public_name")
+        ).values()
+        for result_id, rows in _group_by(values, "result_id").items():
+            observations.setdefault(result_id, []).extend(rows)
+
+    for patient in patients:
+        patient_id = patient["id"]
+        for metadata_item in metadata.get(patient_id, []):
+            patient[metadata_item["column_name"]] = metadata_item["metadata_value"]
+
+        patient["samples"] = samples.get(patient_id, [])
+        for sample in patient["samples"]:
+            sample["panels"] = results.get(sample["id"], [])
+            for result in sample["panels"]:
+                result["observations"] = observations.get(result["id"], [])
+    return patients
+
+
+def export_json():
+    """Return the export serialized as JSON"""
+
+    return json.dumps(build_export(), indent=1, cls=DjangoJSONEncoder)
+
+
+def snapshot_path(generation, compressed=False):
+    """Path of the snapshot for a data generation"""
+
+    file_name = f"export-{generation}.json" + (".gz" if compressed else "")
+    return os.path.join(settings.EXPORT_SNAPSHOT_DIR, file_name)
+
+
+def current_snapshot_path(compressed=False):
+    """Path of the snapshot of the current data, or None if not written yet"""
+
+    if not settings.EXPORT_SNAPSHOT_DIR:
+        return None
+    path = snapshot_path(get_generation(), compressed)
+    return path if os.path.exists(path) else None
+
+
+def write_export_snapshot():
+    """Write plain and gzip compressed snapshots of the current data
+
+    The generation is read before the export is built, so if new data is
+    committed meanwhile the snapshot is labelled with the older generation
+    and is never served.
+    """
+
+    with snapshot_lock:
+        generation = get_generation()
+        path = snapshot_path(generation)
+        if os.path.exists(path):
+            return path
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        content = export_json().encode("utf-8")
+
+        # Compressed variant first - a snapshot is only complete (and used)
+        # once the plain file exists. Files are moved into place so a
+        # partially written snapshot is never served.
+        partial = f"{path}.gz.{os.getpid()}.partial"
+        with gzip.open(partial, "wb") as outfile:
+            outfile.write(content)
+        os.replace(partial, f"{path}.gz")
+        partial = f"{path}.{os.getpid()}.partial"
+        with open(partial, "wb") as outfile:
+            outfile.write(content)
+        os.replace(partial, path)
+
+        # Remove snapshots of earlier generations
+        for old_path in glob.glob(snapshot_path("*")) + glob.glob(
+            snapshot_path("*", compressed=True)
+        ):
+            if not old_path.startswith(path):
+                try:
+                    os.remove(old_path)
+                except FileNotFoundError:
+                    # Already removed by another process
+                    pass
+        return path
+
+
+def _write_export_snapshot_in_background():
+    try:
+        write_export_snapshot()
+    except Exception:
+        logger.exception("Writing export snapshot failed")
+    finally:
+        # Thread has its own database connection - do not leave it open
+        connection.close()
+
+
+def schedule_export_snapshot():
+    """Regenerate the export snapshot after data has been committed"""
+
+    if not settings.EXPORT_SNAPSHOT_DIR:
+        return
+    if settings.EXPORT_SNAPSHOT_BACKGROUND:
+        # The thread uses its own connection, so it must only start once
+        # the data is committed
+        transaction.on_commit(
+            lambda: threading.Thread(
+                target=_write_export_snapshot_in_background, daemon=True
+            ).start()
+        )
+    else:
+        write_export_snapshot()
@@ -0,0 +1,143 @@
+"""
+Query string filters for the observation endpoints.
+
+All filters are applied in the database. Filters taking names accept a
+comma separated list, e.g. ?panel=p5,p6.
+
+    panel             panel name (case insensitive)
+    parameter         parameter public name or gating hierarchy - only
+                      results with a value for one of the parameters are
+                      returned, and only values for those parameters
+    date_processed_from, date_processed_to
+                      range (inclusive) of the date the panel was processed
+    uploaded_file     name or id of the file the results were uploaded in
+    gating_strategy   gating strategy
+    modified_since    only results changed (or with values changed) at or
+                      after this date/time
+"""
+
+import datetime
+
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.exceptions import ValidationError
+
+from openfacstrack.apps.track.models import (
+    DateValue,
+    NumericValue,
+    Parameter,
+    TextValue,
+)
+
+
+def _names(query_params, name):
+    value = query_params.get(name)
+    if value is None:
+        return None
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+def _parse_date(query_params, name):
+    value = query_params.get(name)
+    if value is None:
+        return None
+    date = parse_date(value)
+    if date is None:
+        raise ValidationError({name: [f"'{value}' is not a date (YYYY-MM-DD)"]})
+    return date
+
+
+def parse_datetime_param(query_params, name):
+    """Date/time given in the query string, or None if not given
+
+    A date alone means midnight and times without a time zone are UTC.
+    """
+
+    value = query_params.get(name)
+    if value is None:
+        return None
+    try:
+        moment = parse_datetime(value)
+    except ValueError:
+        moment = None
+    if moment is None:
+        date = parse_date(value)
+        if date is None:
+            raise ValidationError({name: [f"'{value}' is not a date/time (ISO 8601)"]})
+        moment = datetime.datetime.combine(date, datetime.time.min)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment, timezone.utc)
+    return moment
+
+
+def selected_parameters(query_params):
+    """Parameters selected with ?parameter=, or None if not filtered"""
+
+    names = _names(query_params, "parameter")
+    if names is None:
+        return None
+    return Parameter.objects.filter(
+        Q(public_name__in=names) | Q(gating_hierarchy__in=names)
+    ).values("pk")
+
+
+def filter_results(results, query_params):
+    """Apply the observation filters in the query string to a Result queryset"""
+
+    panels = _names(query_params, "panel")
+    if panels is not None:
+        # Panel names in the reference data are not consistently cased
+        any_panel = Q(pk__in=[])
+        for panel in panels:
+            any_panel |= Q(panel__name__iexact=panel)
+        results = results.filter(any_panel)
+
+    gating_strategies = _names(query_params, "gating_strategy")
+    if gating_strategies is not None:
+        results = results.filter(gating_strategy__strategy__in=gating_strategies)
+
+    uploaded_files = _names(query_params, "uploaded_file")
+    if uploaded_files is not None:
+        ids = [int(name) for name in uploaded_files if name.isdigit()]
+        results = results.filter(
+            Q(uploaded_file__name__in=uploaded_files) | Q(uploaded_file_id__in=ids)
+        )
+
+    parameters = selected_parameters(query_params)
+    if parameters is not None:
+        with_values = Q()
+        for model in [NumericValue, TextValue, DateValue]:
+            with_values |= Q(
+                pk__in=model.objects.filter(parameter__in=parameters).values(
+                    "result_id"
+                )
+            )
+        results = results.filter(with_values)
+
+    date_from = _parse_date(query_params, "date_processed_from")
+    date_to = _parse_date(query_params, "date_processed_to")
+    if date_from is not None or date_to is not None:
+        dates = DateValue.objects.filter(
+            parameter__in=Parameter.objects.filter(
+                gating_hierarchy__endswith="_date_processed", data_type="Date"
+            ).values("pk")
+        )
+        if date_from is not None:
+            dates = dates.filter(value__gte=date_from)
+        if date_to is not None:
+            dates = dates.filter(value__lte=date_to)
+        results = results.filter(pk__in=dates.values("result_id"))
+
+    modified_since = parse_datetime_param(query_params, "modified_since")
+    if modified_since is not None:
+        changed = Q(modified__gte=modified_since)
+        for model in [NumericValue, TextValue, DateValue]:
+            changed |= Q(
+                pk__in=model.objects.filter(modified__gte=modified_since).values(
+                    "result_id"
+                )
+            )
+        results = results.filter(changed)
+
+    return results
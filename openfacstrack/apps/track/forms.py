@@ -3,3 +3,5 @@ from django import forms
 
 class ConfirmFileForm(forms.Form):
     file_id = forms.CharField(max_length=255)
+    # Only write the values that differ from those stored (panel results)
+    diff = forms.BooleanField(required=False)
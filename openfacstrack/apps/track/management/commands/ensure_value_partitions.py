@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from openfacstrack.apps.track.partitioning import (
+    partition_value_tables,
+    partitioning_enabled,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Partition the value tables by result id if TRACK_PARTITION_VALUES "
+        + "is set (PostgreSQL only) and add partitions ahead of the data"
+    )
+
+    def handle(self, *args, **options):
+        if not partitioning_enabled(connection):
+            self.stdout.write(
+                "Value tables are not partitioned - partitioning needs "
+                + "PostgreSQL and TRACK_PARTITION_VALUES=1."
+            )
+            return
+
+        with transaction.atomic():
+            created = partition_value_tables(connection)
+        if created:
+            self.stdout.write(f"Created partitions {', '.join(created)}.")
+        else:
+            self.stdout.write("All partitions exist.")
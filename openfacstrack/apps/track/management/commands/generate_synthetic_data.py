@@ -0,0 +1,113 @@
+import contextlib
+import os
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+from openfacstrack.apps.track.models import GatingStrategy, Parameter
+from openfacstrack.apps.track.profiling import Profile
+from openfacstrack.apps.track.synthetic import cohort_files, upload_file
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate a synthetic cohort - a patient data file and a panel "
+        + "results file per panel - and write it to a directory or upload it"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--patients", type=int, default=100)
+        parser.add_argument("--samples-per-patient", type=int, default=2)
+        parser.add_argument(
+            "--malformed-rate",
+            type=float,
+            default=0.01,
+            help="Fraction of numeric cells that are not numbers",
+        )
+        parser.add_argument(
+            "--derived-parameters",
+            type=int,
+            default=0,
+            help="Unregistered derived parameters to add to each panel",
+        )
+        parser.add_argument(
+            "--panels", nargs="*", help="Panels to generate results for (all)"
+        )
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--reference-data",
+            help="Load this reference data spreadsheet first "
+            + "(see update_panel_parameter_reference_data)",
+        )
+        parser.add_argument("--output-dir", help="Write the files to this directory")
+        parser.add_argument(
+            "--upload",
+            metavar="USERNAME",
+            help="Upload the files as this user, as through the upload page",
+        )
+        parser.add_argument(
+            "--profile",
+            action="store_true",
+            help="Profile each upload (written to TRACK_PROFILE_DIR)",
+        )
+
+    def handle(self, *args, **options):
+        if not options["output_dir"] and not options["upload"]:
+            raise CommandError("Give --output-dir and/or --upload")
+        if not 0 <= options["malformed_rate"] <= 1:
+            raise CommandError("--malformed-rate must be between 0 and 1")
+        if options["upload"]:
+            try:
+                user = User.objects.get(username=options["upload"])
+            except User.DoesNotExist:
+                raise CommandError(f"No user {options['upload']}")
+
+        if options["reference_data"]:
+            call_command(
+                "update_panel_parameter_reference_data",
+                options["reference_data"],
+                stdout=self.stdout,
+            )
+        if not Parameter.objects.exists():
+            raise CommandError(
+                "No parameters - load the reference data first (--reference-data)"
+            )
+
+        files = cohort_files(
+            options["patients"],
+            options["samples_per_patient"],
+            malformed_rate=options["malformed_rate"],
+            derived=options["derived_parameters"],
+            panels=options["panels"],
+            seed=options["seed"],
+        )
+
+        if options["output_dir"]:
+            os.makedirs(options["output_dir"], exist_ok=True)
+            for file_name, contents in files.items():
+                with open(os.path.join(options["output_dir"], file_name), "w") as f:
+                    f.write(contents)
+            self.stdout.write(f"Wrote {len(files)} files to {options['output_dir']}")
+
+        if options["upload"]:
+            gating_strategy = GatingStrategy.objects.get_or_create(strategy="manual")[0]
+            for file_name, contents in files.items():
+                profile = Profile() if options["profile"] else contextlib.nullcontext()
+                with profile:
+                    uploaded = upload_file(file_name, contents, user, gating_strategy)
+                if uploaded.duplicate:
+                    # Nothing was uploaded, so there are no timings to report
+                    self.stdout.write(
+                        f"Skipped {file_name}: same contents as the latest "
+                        + "upload (use another --seed to upload new data)"
+                    )
+                    continue
+                timing = uploaded.upload_file.timings.latest("id")
+                self.stdout.write(
+                    f"Uploaded {file_name}: {timing.rows} rows, "
+                    + f"{timing.cells} values in {timing.total:.2f}s"
+                )
+                if options["profile"]:
+                    name = profile.save(f"upload-{file_name}")
+                    self.stdout.write(f"Profile written as {name}")
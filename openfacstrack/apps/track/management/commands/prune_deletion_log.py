@@ -0,0 +1,33 @@
+import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from openfacstrack.apps.track.models import DeletionLog
+
+
+class Command(BaseCommand):
+    help = "Remove deletion log entries older than the retention period"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=None,
+            help="Keep entries for this many days. "
+            + "Default: settings.DELETION_LOG_RETENTION_DAYS",
+        )
+
+    def handle(self, *args, **options):
+        days = options["days"]
+        if days is None:
+            days = settings.DELETION_LOG_RETENTION_DAYS
+        if days < 0:
+            raise CommandError("--days must not be negative")
+
+        cutoff = timezone.now() - datetime.timedelta(days=days)
+        n_deleted, _ = DeletionLog.objects.filter(modified__lt=cutoff).delete()
+        self.stdout.write(
+            f"Deleted {n_deleted} deletion log entries older than {days} days."
+        )
@@ -1,10 +1,53 @@
-import numbers
+import io
+import os
+from django.conf import settings
+from django.core.files import File
 from django.core.management.base import BaseCommand, CommandError
 from django.db import transaction
+from django.utils import timezone
 
 import pandas as pd
 
+from openfacstrack.apps.track.caching import bump_generation
+from openfacstrack.apps.track.export import schedule_export_snapshot
 from openfacstrack.apps.track.models import Parameter, Panel
+from openfacstrack.apps.track.utils import hash_file_contents
+
+# Parameters created for every panel to hold values computed from the data
+PSEUDO_PARAMETERS = {
+    "batch": {
+        "data_type": "SampleNumeric",
+        "description": "Batch panel processed under",
+    },
+    "date_processed": {
+        "data_type": "Date",
+        "description": "Date panel processed",
+    },
+    "operator_1": {
+        "data_type": "SampleNumeric",
+        "description": "Code for primary operator during processing",
+    },
+    "operator_2": {
+        "data_type": "SampleNumeric",
+        "description": "Code for second operator during processing",
+    },
+    "comments": {
+        "data_type": "Text",
+        "description": "Comments associated with processing the panel",
+    },
+}
+
+# Parameter fields set from the reference file
+PARAMETER_FIELDS = [
+    "panel_id",
+    "internal_name",
+    "public_name",
+    "is_reference_parameter",
+    "unit",
+    "ancestral_population",
+    "population_for_counts",
+    "data_type",
+]
 
 
 class Command(BaseCommand):
@@ -13,12 +56,30 @@ class Command(BaseCommand):
     def add_arguments(self, parser):
         parser.add_argument("filename")
         # parser.add_argument('skiprows')
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Report the changes that would be made without saving them",
+        )
+        parser.add_argument(
+            "--engine",
+            default=None,
+            help="Engine used by pandas to read the spreadsheet "
+            + "(e.g. openpyxl or xlrd). Default: chosen by pandas",
+        )
+        parser.add_argument(
+            "--no-cache",
+            action="store_true",
+            help="Always parse the spreadsheet instead of using a cached snapshot",
+        )
 
     def handle(self, *args, **options):
         filename = options["filename"]
         # skiprows = options['skiprows']
         try:
-            df_panels = pd.read_excel(filename, skiprows=1)
+            df_panels = self._read_reference_file(
+                filename, options["engine"], not options["no_cache"]
+            )
         except Exception as e:
             print(f"There was a problem loading {filename}. Error was: ")
             raise CommandError(str(e))
@@ -27,69 +88,146 @@ class Command(BaseCommand):
             # Store panel names in Panel table
             panel_names = [p.upper() for p in df_panels.panel.unique().tolist()]
             panel_names.sort()
-
-            pseudo_parameters = {
-                "batch": {
-                    "data_type": "SampleNumeric",
-                    "description": "Batch panel processed under",
-                },
-                "date_processed": {
-                    "data_type": "Date",
-                    "description": "Date panel processed",
-                },
-                "operator_1": {
-                    "data_type": "SampleNumeric",
-                    "description": "Code for primary operator during processing",
-                },
-                "operator_2": {
-                    "data_type": "SampleNumeric",
-                    "description": "Code for second operator during processing",
-                },
-                "comments": {
-                    "data_type": "Text",
-                    "description": "Comments associated with processing the panel",
-                },
-            }
+            panel_ids = dict(Panel.objects.values_list("name", "id"))
+            new_panels = [
+                Panel(name=panel_name)
+                for panel_name in panel_names
+                if panel_name not in panel_ids
+            ]
+            Panel.objects.bulk_create(new_panels)
+            if new_panels:
+                panel_ids = dict(Panel.objects.values_list("name", "id"))
+
+            # Parameter details as given in the reference file. If a gating
+            # hierarchy is given more than once the last row is used.
+            reference = pd.DataFrame(
+                {
+                    "gating_hierarchy": df_panels["gating hierarchy"].astype(str),
+                    "panel_id": df_panels["panel"].str.upper().map(panel_ids),
+                    "internal_name": df_panels["marker string"].astype(str),
+                    "public_name": df_panels["public_population_name"].astype(str),
+                    # Where do we get this ???
+                    "is_reference_parameter": False,
+                    "unit": df_panels["presented on webpage as"].astype(str),
+                    "ancestral_population": df_panels["ancestral population"].astype(
+                        str
+                    ),
+                    "population_for_counts": df_panels["population for counts"].astype(
+                        str
+                    ),
+                    # Datatype is PanelNumeric - numeric from panel results
+                    "data_type": "PanelNumeric",
+                }
+            ).drop_duplicates(subset="gating_hierarchy", keep="last")
+
+            # Compare with the parameters currently stored
+            existing = pd.DataFrame.from_records(
+                Parameter.objects.values("id", "gating_hierarchy", *PARAMETER_FIELDS),
+                columns=["id", "gating_hierarchy"] + PARAMETER_FIELDS,
+            )
+            merged = reference.merge(
+                existing,
+                on="gating_hierarchy",
+                how="left",
+                suffixes=("", "_existing"),
+            )
+            is_new = merged["id"].isna()
+            is_changed = pd.Series(False, index=merged.index)
+            for field in PARAMETER_FIELDS:
+                is_changed |= merged[field] != merged[f"{field}_existing"]
+            to_create = merged[is_new]
+            to_update = merged[~is_new & is_changed]
+
+            new_parameters = [
+                Parameter(
+                    gating_hierarchy=row["gating_hierarchy"], **row[PARAMETER_FIELDS]
+                )
+                for index, row in to_create.iterrows()
+            ]
+
+            # Pseudo parameters are created for each panel but never
+            # overwritten once they exist
+            known = set(existing["gating_hierarchy"]) | set(
+                reference["gating_hierarchy"]
+            )
             for panel_name in panel_names:
-                panel, created = Panel.objects.get_or_create(name=panel_name)
-
-                # Create the pseudoparameters for panel
-                for param_name, param_values in pseudo_parameters.items():
+                for param_name, param_values in PSEUDO_PARAMETERS.items():
                     # Name of the pseudoparameter is stored in gating hierarchy
                     gating_hierarchy = f"{panel_name}_{param_name}"
-                    parameter, created = Parameter.objects.get_or_create(
-                        gating_hierarchy=gating_hierarchy, panel=panel
-                    )
-                    if created:
-                        parameter.data_type = param_values["data_type"]
-                        parameter.description = param_values["description"]
-                        parameter.internal_name = gating_hierarchy
-                        parameter.public_name = gating_hierarchy
-                    parameter.save()
-
-            # Store parameter details
-            for index, row in df_panels.iterrows():
-                panel = Panel.objects.get(name=row["panel"].upper())
-                parameter = Parameter.objects.get_or_create(
-                    gating_hierarchy=row["gating hierarchy"], panel=panel
-                )[0]
-
-                parameter.internal_name = row["marker string"]
-                parameter.public_name = row["public_population_name"]
-                # parameter.display_name = row['presented on webpage as'] - unit?
-                # parameter.excel_column_name = ???
-                # parameter.description = ???
-                parameter.is_reference_parameter = False  # Where do we get this ???
-                parameter.unit = row["presented on webpage as"]
-
-                parameter.ancestral_population = row["ancestral population"]
-                parameter.population_for_counts = row["population for counts"]
-
-                # Datatype is PanelNumeric - numeric from panel results
-                parameter.data_type = "PanelNumeric"
-                # What is 'ancestral population when preseneted as fraction' ?
-                parameter.save()
-                # print(parameter)
+                    if gating_hierarchy not in known:
+                        new_parameters.append(
+                            Parameter(
+                                gating_hierarchy=gating_hierarchy,
+                                panel_id=panel_ids[panel_name],
+                                data_type=param_values["data_type"],
+                                description=param_values["description"],
+                                internal_name=gating_hierarchy,
+                                public_name=gating_hierarchy,
+                            )
+                        )
+            Parameter.objects.bulk_create(new_parameters)
+
+            # bulk_update does not set the modified timestamp itself
+            now = timezone.now()
+            parameters = Parameter.objects.in_bulk(to_update["id"].astype(int).tolist())
+            for index, row in to_update.iterrows():
+                parameter = parameters[int(row["id"])]
+                for field in PARAMETER_FIELDS:
+                    setattr(parameter, field, row[field])
+                parameter.modified = now
+            Parameter.objects.bulk_update(
+                parameters.values(), PARAMETER_FIELDS + ["modified"], batch_size=500
+            )
+
+            if options["dry_run"]:
+                transaction.set_rollback(True)
+        if not options["dry_run"]:
+            bump_generation()
+            schedule_export_snapshot()
+
+        self.stdout.write(
+            ("Dry run - no changes saved. " if options["dry_run"] else "")
+            + f"Panels: {len(new_panels)} created, "
+            + f"{len(panel_names) - len(new_panels)} unchanged. "
+            + f"Parameters: {len(new_parameters)} created, "
+            + f"{len(to_update)} updated, "
+            + f"{len(reference) - len(to_create) - len(to_update)} unchanged."
+        )
+
+    def _read_reference_file(self, filename, engine=None, use_cache=True):
+        """Read the reference spreadsheet into a data frame
+
+        Parsing Excel files is slow, so the parsed data frame is stored
+        in REFERENCE_DATA_CACHE_DIR as JSON (in the "table" layout, which
+        keeps the column types) named after the SHA-256 of the spreadsheet,
+        the engine and the pandas version. Later runs on an identical file
+        with the same engine load the snapshot instead of parsing the
+        spreadsheet again. JSON rather than pickle, as loading a pickle
+        from a writable directory could run arbitrary code.
+        """
+
+        if not use_cache:
+            return pd.read_excel(filename, skiprows=1, engine=engine)
+
+        with open(filename, "rb") as infile:
+            content_hash = hash_file_contents(File(infile))
+        cache_dir = settings.REFERENCE_DATA_CACHE_DIR
+        snapshot = os.path.join(
+            cache_dir,
+            f"{content_hash}-{engine or 'default'}-pandas{pd.__version__}.json",
+        )
+        if os.path.exists(snapshot):
+            with open(snapshot) as infile:
+                return pd.read_json(io.StringIO(infile.read()), orient="table")
+
+        df_panels = pd.read_excel(filename, skiprows=1, engine=engine)
+        os.makedirs(cache_dir, exist_ok=True)
+        # Write to a temporary file first so concurrent runs never read
+        # a partially written snapshot
+        partial = f"{snapshot}.{os.getpid()}.partial"
+        df_panels.to_json(partial, orient="table")
+        os.replace(partial, snapshot)
+        return df_panels
 
     def _valid(self, value):
         """Check if a value is valid - not empty, nan or NA"""
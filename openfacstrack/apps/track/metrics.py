@@ -0,0 +1,307 @@
+"""
+Request metrics, exposed in the Prometheus text format at /track/metrics/.
+
+Each process keeps its own counters in memory - incrementing them costs
+no I/O and no counts are lost to concurrent updates. As prometheus_client
+does in multiprocess mode, every process writes its counters to a file of
+its own in TRACK_METRICS_DIR (at most every FLUSH_SECONDS and when it
+exits), and the metrics view adds up the files of all processes. The
+counters of processes that have exited are folded into one file, so
+totals do not drop when workers are restarted. Without TRACK_METRICS_DIR
+only the counters of the process serving the metrics are reported.
+
+Under ASGI views run in threads other than the middleware's, so queries
+cannot be counted and requests only add to the request, serialization
+and size totals (see MetricsMiddleware).
+"""
+
+import atexit
+import contextlib
+import fcntl
+import glob
+import json
+import os
+import threading
+import time
+import uuid
+
+from django.conf import settings
+
+FLUSH_SECONDS = 5
+EXITED_FILE_NAME = "metrics-exited.json"
+
+# name -> (type, help text)
+METRICS = {
+    "track_requests_total": ("counter", "Requests served"),
+    "track_request_duration_seconds_total": (
+        "counter",
+        "Time spent handling requests",
+    ),
+    "track_db_queries_total": (
+        "counter",
+        "SQL queries run by requests (not counted under ASGI)",
+    ),
+    "track_db_duration_seconds_total": (
+        "counter",
+        "Time spent on SQL queries (not counted under ASGI)",
+    ),
+    "track_serialization_duration_seconds_total": (
+        "counter",
+        "Time spent serializing response data and rendering it (JSON, NDJSON, ...)",
+    ),
+    "track_response_bytes_total": ("counter", "Response bytes sent"),
+    "track_slow_requests_total": (
+        "counter",
+        "Requests over the time or query count thresholds",
+    ),
+    "track_uploads_total": ("counter", "Upload runs (dry or not)"),
+    "track_upload_stage_seconds_total": (
+        "counter",
+        "Time spent in each stage of uploads",
+    ),
+    "track_upload_rows_total": ("counter", "Rows of uploaded files processed"),
+    "track_upload_cells_total": ("counter", "Values written by uploads"),
+}
+
+# (name, labels) -> value for this process
+counters = {}
+counters_lock = threading.Lock()
+last_flush = 0.0
+process_file_names = {}
+
+
+def increment(name, labels, amount=1):
+    """Add amount to the counter name with the given labels
+
+    Parameters
+    ----------
+    name : str
+        Metric name, one of METRICS. Names ending in _seconds_total
+        take amount in seconds.
+    labels : dict
+        Label names and values
+    amount : int or float
+        Amount to add
+    """
+
+    key = (name, tuple(sorted(labels.items())))
+    with counters_lock:
+        counters[key] = counters.get(key, 0) + amount
+    if time.monotonic() - last_flush > FLUSH_SECONDS:
+        flush_metrics()
+
+
+def record_request(view, duration, n_queries, db_duration, serialization, size):
+    """Add the measurements of one request to the totals
+
+    n_queries and db_duration are None if the queries were not counted.
+    """
+
+    labels = {"view": view}
+    increment("track_requests_total", labels)
+    increment("track_request_duration_seconds_total", labels, duration)
+    if n_queries is not None:
+        increment("track_db_queries_total", labels, n_queries)
+        increment("track_db_duration_seconds_total", labels, db_duration)
+    if serialization:
+        increment("track_serialization_duration_seconds_total", labels, serialization)
+    if size is not None:
+        increment("track_response_bytes_total", labels, size)
+
+
+def record_upload(content_type, timing):
+    """Add the stage timings of one upload run to the totals
+
+    Parameters
+    ----------
+    content_type : str
+        content type of the UploadedFile, e.g. PANEL_RESULTS
+    timing : UploadTiming
+        the timings of the run
+    """
+
+    labels = {"content_type": content_type, "dry_run": str(timing.dry_run).lower()}
+    increment("track_uploads_total", labels)
+    increment("track_upload_rows_total", labels, timing.rows)
+    increment("track_upload_cells_total", labels, timing.cells)
+    for stage in timing.STAGES:
+        increment(
+            "track_upload_stage_seconds_total",
+            dict(labels, stage=stage),
+            getattr(timing, stage),
+        )
+
+
+def add_serialization_time(request, seconds):
+    """Add to the serialization time recorded for a request
+
+    Parameters
+    ----------
+    request : HttpRequest or rest_framework Request
+        the request being served
+    seconds : float
+        time spent serializing data for its response
+    """
+
+    # DRF's Request wraps the HttpRequest the middleware sees
+    request = getattr(request, "_request", request)
+    if hasattr(request, "_metrics_serialization"):
+        request._metrics_serialization += seconds
+
+
+def flush_metrics():
+    """Write the counters of this process to its file in TRACK_METRICS_DIR"""
+
+    global last_flush
+
+    last_flush = time.monotonic()
+    if not settings.TRACK_METRICS_DIR:
+        return
+    with counters_lock:
+        samples = [[name, labels, value] for (name, labels), value in counters.items()]
+    path = os.path.join(settings.TRACK_METRICS_DIR, _process_file_name())
+    os.makedirs(settings.TRACK_METRICS_DIR, exist_ok=True)
+    _write_samples(path, samples)
+
+
+def clear_metrics():
+    """Reset the counters of this process and of exited processes"""
+
+    with counters_lock:
+        counters.clear()
+    if settings.TRACK_METRICS_DIR:
+        for path in glob.glob(os.path.join(settings.TRACK_METRICS_DIR, "metrics-*")):
+            os.remove(path)
+
+
+def collect_metrics():
+    """Return {(name, labels): value} added up over all processes"""
+
+    if not settings.TRACK_METRICS_DIR:
+        with counters_lock:
+            return dict(counters)
+
+    flush_metrics()
+    totals = {}
+    with _directory_lock():
+        _fold_exited_processes()
+        for path in glob.glob(
+            os.path.join(settings.TRACK_METRICS_DIR, "metrics-*.json")
+        ):
+            _add_samples(totals, path)
+    return totals
+
+
+def render_metrics():
+    """Return all metrics in the Prometheus text exposition format"""
+
+    totals = collect_metrics()
+    lines = []
+    for name, (metric_type, help_text) in METRICS.items():
+        samples = []
+        for (series_name, labels), value in totals.items():
+            if series_name != name:
+                continue
+            label_text = ",".join(
+                '{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"'))
+                for k, v in labels
+            )
+            samples.append(f"{name}{{{label_text}}} {value}")
+        if samples:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            lines.extend(sorted(samples))
+    return "\n".join(lines) + "\n"
+
+
+def _fold_exited_processes():
+    """Add the counters of processes that have exited to the exited file"""
+
+    exited_path = os.path.join(settings.TRACK_METRICS_DIR, EXITED_FILE_NAME)
+    exited = {}
+    paths = []
+    for path in glob.glob(os.path.join(settings.TRACK_METRICS_DIR, "metrics-*-*.json")):
+        pid = int(os.path.basename(path).split("-")[1])
+        if pid == os.getpid() or _process_running(pid):
+            continue
+        paths.append(path)
+        _add_samples(exited, path)
+    if not paths:
+        return
+
+    _add_samples(exited, exited_path)
+    _write_samples(
+        exited_path, [[name, labels, value] for (name, labels), value in exited.items()]
+    )
+    for path in paths:
+        os.remove(path)
+
+
+def _process_file_name():
+    """Name of the file of this process
+
+    Looked up by pid, as workers forked after this module was imported
+    each need a file of their own. The random part tells the file apart
+    from one left by an earlier process with the same pid.
+    """
+
+    pid = os.getpid()
+    if pid not in process_file_names:
+        process_file_names[pid] = f"metrics-{pid}-{uuid.uuid4().hex[:8]}.json"
+    return process_file_names[pid]
+
+
+def _process_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _add_samples(totals, path):
+    """Add the counters written to path to totals"""
+
+    try:
+        with open(path) as infile:
+            samples = json.load(infile)
+    except FileNotFoundError:
+        return
+    for name, labels, value in samples:
+        key = (name, tuple(tuple(label) for label in labels))
+        totals[key] = totals.get(key, 0) + value
+
+
+def _write_samples(path, samples):
+    # Written aside and moved into place, so readers never see part of it
+    partial = f"{path}.{os.getpid()}.{threading.get_ident()}.partial"
+    with open(partial, "w") as outfile:
+        json.dump(samples, outfile)
+    os.replace(partial, path)
+
+
+@contextlib.contextmanager
+def _directory_lock():
+    """Hold an exclusive lock on TRACK_METRICS_DIR while the files of
+    processes are added up and folded"""
+
+    os.makedirs(settings.TRACK_METRICS_DIR, exist_ok=True)
+    with open(os.path.join(settings.TRACK_METRICS_DIR, ".lock"), "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _flush_at_exit():
+    if counters:
+        try:
+            flush_metrics()
+        except Exception:
+            pass
+
+
+atexit.register(_flush_at_exit)
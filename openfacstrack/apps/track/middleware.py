@@ -0,0 +1,237 @@
+"""
+Middleware for the track app.
+"""
+
+import asyncio
+import contextlib
+import logging
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.middleware.gzip import GZipMiddleware
+from django.utils.cache import patch_vary_headers
+from django.utils.regex_helper import _lazy_re_compile
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from openfacstrack.apps.track.metrics import record_request, increment
+from openfacstrack.apps.track.profiling import (
+    PROFILE_HEADER,
+    Profile,
+    profile_requested,
+)
+
+logger = logging.getLogger(__name__)
+
+re_accepts_brotli = _lazy_re_compile(r"\bbr\b")
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """Compress responses with brotli if the client accepts it, else gzip
+
+    API payloads repeat the same parameter names for every value, so they
+    compress very well. Brotli is only used when the brotli package
+    is installed and the response is not streamed.
+
+    Only the API and the export are compressed. HTML pages carry CSRF
+    tokens, and compressing secrets alongside content an attacker can
+    reflect into the page exposes them to BREACH.
+    """
+
+    compressed_paths = ("/track/api/", "/track/export/")
+
+    def process_response(self, request, response):
+        if not request.path.startswith(self.compressed_paths):
+            return response
+
+        accept_encoding = request.META.get("HTTP_ACCEPT_ENCODING", "")
+        if (
+            brotli is None
+            or response.streaming
+            or not re_accepts_brotli.search(accept_encoding)
+            or len(response.content) < 200
+            or response.has_header("Content-Encoding")
+        ):
+            return super().process_response(request, response)
+
+        patch_vary_headers(response, ("Accept-Encoding",))
+        compressed_content = brotli.compress(response.content)
+        if len(compressed_content) >= len(response.content):
+            return response
+        response.content = compressed_content
+        response["Content-Length"] = str(len(response.content))
+
+        # Content changed, so a strong ETag no longer matches it
+        etag = response.get("ETag")
+        if etag and etag.startswith('"'):
+            response["ETag"] = "W/" + etag
+        response["Content-Encoding"] = "br"
+        return response
+
+
+class QueryTimer:
+    """Database execute wrapper counting queries and the time spent on them"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+
+
+class MetricsMiddleware:
+    """Record query count, database time, serialization time and response
+    size of each request
+
+    Serialization time covers the serializer data of the API views (see
+    serializers.response_data) and the rendering of the response. The
+    totals per view are served by the metrics view. Requests taking
+    longer than TRACK_SLOW_REQUEST_SECONDS or running more than
+    TRACK_SLOW_REQUEST_QUERIES queries are logged as warnings.
+
+    Works under ASGI without adapting the rest of the stack to sync code,
+    but there every view runs in a thread other than the middleware's.
+    Queries are then not counted at all - they are left out of the query
+    totals and the query threshold - and the rendering done by the async
+    views in their worker thread is not timed.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(self.get_response):
+            # Mark the instance as a coroutine function for Django, as
+            # MiddlewareMixin does
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        if not settings.TRACK_METRICS:
+            return self.get_response(request)
+
+        timer = QueryTimer()
+        request._metrics_serialization = 0.0
+        start = time.perf_counter()
+        with contextlib.ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(timer))
+            response = self.get_response(request)
+        self.record(request, response, time.perf_counter() - start, timer)
+        return response
+
+    async def __acall__(self, request):
+        if not settings.TRACK_METRICS:
+            return await self.get_response(request)
+
+        request._metrics_serialization = 0.0
+        start = time.perf_counter()
+        response = await self.get_response(request)
+        self.record(request, response, time.perf_counter() - start, None)
+        return response
+
+    def record(self, request, response, duration, timer):
+        """Add the request to the metrics and log it if it was slow
+
+        timer is None if the queries of the request were not counted.
+        """
+
+        match = request.resolver_match
+        view = match.view_name if match is not None else "unresolved"
+        if response.streaming:
+            size = response.get("Content-Length")
+            size = int(size) if size is not None else None
+        else:
+            size = len(response.content)
+        record_request(
+            view,
+            duration,
+            timer.count if timer is not None else None,
+            timer.duration if timer is not None else None,
+            request._metrics_serialization,
+            size,
+        )
+
+        if duration > settings.TRACK_SLOW_REQUEST_SECONDS or (
+            timer is not None and timer.count > settings.TRACK_SLOW_REQUEST_QUERIES
+        ):
+            increment("track_slow_requests_total", {"view": view})
+            if timer is not None:
+                queries = f"{timer.count} queries in {timer.duration:.3f}s"
+            else:
+                queries = "queries not counted"
+            logger.warning(
+                "Slow request %s %s (%s): %.3fs, %s, %.3fs serializing, %s bytes",
+                request.method,
+                request.get_full_path(),
+                view,
+                duration,
+                queries,
+                request._metrics_serialization,
+                size,
+            )
+
+    def process_template_response(self, request, response):
+        if not hasattr(request, "_metrics_serialization"):
+            return response
+
+        # Time the rendering of the response (e.g. DRF's JSON encoding),
+        # which happens after this hook returns. Serializer data is timed
+        # by the views.
+        start = time.perf_counter()
+
+        def record_serialization(rendered_response):
+            request._metrics_serialization += time.perf_counter() - start
+
+        response.add_post_render_callback(record_serialization)
+        return response
+
+
+class ProfilingMiddleware:
+    """Profile requests of staff users asking for it
+
+    Runs the view, and the rendering of its response, under cProfile with
+    a log of the queries run (see profiling.py). Must come after the
+    authentication middleware. The body of streamed responses is sent
+    after the profile ends, so is not covered.
+
+    Only requests served under WSGI are profiled. Under ASGI views run in
+    threads other than the middleware's, which cProfile does not follow,
+    so requests are passed on unprofiled - without adapting the rest of
+    the stack to sync code.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(self.get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.get_response(request)
+        if not profile_requested(request):
+            return self.get_response(request)
+
+        with Profile() as profile:
+            response = self.get_response(request)
+        match = request.resolver_match
+        view = match.view_name if match is not None else "unresolved"
+        name = profile.save(f"{request.method}-{view}")
+        logger.info("Profiled %s %s as %s", request.method, request.path, name)
+        response[PROFILE_HEADER] = name
+        return response
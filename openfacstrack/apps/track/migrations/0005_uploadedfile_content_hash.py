@@ -0,0 +1,45 @@
+# Generated by Django 3.1.14 on 2026-10-19 06:21
+
+import hashlib
+
+from django.db import migrations, models
+
+
+def hash_uploaded_files(apps, schema_editor):
+    """Store the content hash of files uploaded before hashing was added"""
+
+    UploadedFile = apps.get_model("track", "UploadedFile")
+    for uploaded_file in UploadedFile.objects.filter(content_hash=""):
+        try:
+            sha256 = hashlib.sha256()
+            with uploaded_file.content.open("rb") as content:
+                for chunk in content.chunks():
+                    sha256.update(chunk)
+        except (OSError, ValueError):
+            # File no longer on disk (or never stored)
+            continue
+        uploaded_file.content_hash = sha256.hexdigest()
+        uploaded_file.save(update_fields=["content_hash"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("track", "0004_auto_20200603_1615"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="uploadedfile",
+            name="committed",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name="uploadedfile",
+            name="content_hash",
+            field=models.CharField(
+                blank=True, db_index=True, default="", max_length=64
+            ),
+        ),
+        migrations.RunPython(hash_uploaded_files, migrations.RunPython.noop),
+    ]
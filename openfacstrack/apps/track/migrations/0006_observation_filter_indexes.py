@@ -0,0 +1,28 @@
+# Generated by Django 3.1.14 on 2026-10-19 06:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("track", "0005_uploadedfile_content_hash"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="parameter",
+            name="public_name",
+            field=models.CharField(db_index=True, max_length=255),
+        ),
+        migrations.AddIndex(
+            model_name="datevalue",
+            index=models.Index(
+                fields=["parameter", "value"], name="track_dateval_param_value_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="result",
+            index=models.Index(fields=["modified"], name="track_result_modified_idx"),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 3.1.14 on 2026-10-19 06:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("track", "0006_observation_filter_indexes"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="result",
+            name="track_result_modified_idx",
+        ),
+        migrations.AddIndex(
+            model_name="datevalue",
+            index=models.Index(
+                fields=["modified", "id"], name="track_dateval_modified_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="numericvalue",
+            index=models.Index(
+                fields=["modified", "id"], name="track_numval_modified_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="patientmetadata",
+            index=models.Index(
+                fields=["modified", "id"], name="track_patmeta_modified_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="processedsample",
+            index=models.Index(
+                fields=["modified", "id"], name="track_sample_modified_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="result",
+            index=models.Index(
+                fields=["modified", "id"], name="track_result_modified_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="textvalue",
+            index=models.Index(
+                fields=["modified", "id"], name="track_textval_modified_idx"
+            ),
+        ),
+    ]
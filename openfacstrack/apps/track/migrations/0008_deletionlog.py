@@ -0,0 +1,48 @@
+# Generated by Django 3.1.14 on 2026-10-19 06:38
+
+from django.db import migrations, models
+import openfacstrack.apps.core.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("track", "0007_change_feed_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DeletionLog",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "created",
+                    openfacstrack.apps.core.models.CreationDateTimeField(
+                        auto_now_add=True, verbose_name="created"
+                    ),
+                ),
+                (
+                    "modified",
+                    openfacstrack.apps.core.models.ModificationDateTimeField(
+                        auto_now=True, verbose_name="modified"
+                    ),
+                ),
+                ("model", models.CharField(max_length=100)),
+                ("object_id", models.IntegerField()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="deletionlog",
+            index=models.Index(
+                fields=["modified", "id"], name="track_dellog_modified_idx"
+            ),
+        ),
+    ]
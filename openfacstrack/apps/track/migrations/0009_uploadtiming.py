@@ -0,0 +1,64 @@
+# Generated by Django 3.1.14 on 2026-10-19 06:46
+
+from django.db import migrations, models
+import django.db.models.deletion
+import openfacstrack.apps.core.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("track", "0008_deletionlog"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="UploadTiming",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "created",
+                    openfacstrack.apps.core.models.CreationDateTimeField(
+                        auto_now_add=True, verbose_name="created"
+                    ),
+                ),
+                (
+                    "modified",
+                    openfacstrack.apps.core.models.ModificationDateTimeField(
+                        auto_now=True, verbose_name="modified"
+                    ),
+                ),
+                ("dry_run", models.BooleanField(default=False)),
+                ("parse", models.FloatField(default=0)),
+                ("header_validation", models.FloatField(default=0)),
+                ("parameter_resolution", models.FloatField(default=0)),
+                ("sample_resolution", models.FloatField(default=0)),
+                ("value_writes", models.FloatField(default=0)),
+                ("validation_entry_writes", models.FloatField(default=0)),
+                ("commit", models.FloatField(default=0)),
+                ("rows", models.IntegerField(default=0)),
+                ("cells", models.IntegerField(default=0)),
+                (
+                    "uploaded_file",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="timings",
+                        to="track.uploadedfile",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ("-modified", "-created"),
+                "get_latest_by": "modified",
+                "abstract": False,
+            },
+        ),
+    ]
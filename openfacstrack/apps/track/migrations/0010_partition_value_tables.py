@@ -0,0 +1,129 @@
+# Generated by Django 3.1.14 on 2026-10-19 09:12
+
+from django.conf import settings
+from django.db import migrations
+
+# Range partition the value tables by result id if TRACK_PARTITION_VALUES
+# is set (PostgreSQL only) - see partitioning.py. The SQL is kept here
+# rather than imported from the app, so this migration does not change
+# when the app code does.
+
+VALUE_TABLES = ["track_numericvalue", "track_textvalue", "track_datevalue"]
+PARTITION_KEY = "result_id"
+RESULT_TABLE = "track_result"
+
+
+def is_partitioned(cursor, table):
+    cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", [table])
+    row = cursor.fetchone()
+    return row is not None and row[0] == "p"
+
+
+def create_partitions(connection, cursor, table, parent):
+    """Create the default partition and range partitions up to one range
+    past the highest result id, before any rows are copied in"""
+
+    quote = connection.ops.quote_name
+    size = settings.TRACK_VALUE_PARTITION_SIZE
+    cursor.execute(
+        f"CREATE TABLE {quote(table + '_default')} "
+        + f"PARTITION OF {quote(parent)} DEFAULT"
+    )
+    cursor.execute(f"SELECT coalesce(max(id), 0) FROM {quote(RESULT_TABLE)}")
+    max_result_id = cursor.fetchone()[0]
+    lower = 0
+    while lower <= max_result_id + size:
+        cursor.execute(
+            f"CREATE TABLE {quote(f'{table}_p{lower}')} PARTITION OF {quote(parent)} "
+            + f"FOR VALUES FROM ({lower}) TO ({lower + size})"
+        )
+        lower += size
+
+
+def rebuild_table(connection, cursor, table, partitioned):
+    """Copy a table into a new (partitioned or plain) table of the same name
+
+    Columns, defaults, the id sequence, constraints and indexes are kept.
+    """
+
+    quote = connection.ops.quote_name
+    new_table = f"{table}_rebuild"
+
+    # Constraints and the indexes not backing a constraint
+    cursor.execute(
+        "SELECT conname, contype, pg_get_constraintdef(oid) FROM pg_constraint "
+        + "WHERE conrelid = %s::regclass AND contype IN ('p', 'u', 'f') "
+        + "ORDER BY contype <> 'p', conname",
+        [table],
+    )
+    constraints = cursor.fetchall()
+    cursor.execute(
+        "SELECT pg_get_indexdef(i.indexrelid) FROM pg_index i "
+        + "WHERE i.indrelid = %s::regclass AND NOT EXISTS ("
+        + "SELECT 1 FROM pg_constraint c "
+        + "WHERE c.conrelid = i.indrelid AND c.conindid = i.indexrelid)",
+        [table],
+    )
+    indexes = [row[0] for row in cursor.fetchall()]
+    cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [table])
+    sequence = cursor.fetchone()[0]
+
+    cursor.execute(f"LOCK TABLE {quote(table)} IN ACCESS EXCLUSIVE MODE")
+    cursor.execute(
+        f"CREATE TABLE {quote(new_table)} (LIKE {quote(table)} INCLUDING DEFAULTS)"
+        + (f" PARTITION BY RANGE ({PARTITION_KEY})" if partitioned else "")
+    )
+    if partitioned:
+        create_partitions(connection, cursor, table, new_table)
+    cursor.execute(f"INSERT INTO {quote(new_table)} SELECT * FROM {quote(table)}")
+    if sequence:
+        # The sequence would otherwise be dropped with the old table
+        cursor.execute(f"ALTER SEQUENCE {sequence} OWNED BY {quote(new_table)}.id")
+    cursor.execute(f"DROP TABLE {quote(table)}")
+    cursor.execute(f"ALTER TABLE {quote(new_table)} RENAME TO {quote(table)}")
+
+    for name, constraint_type, definition in constraints:
+        if constraint_type == "p":
+            # Unique constraints of a partitioned table must include the
+            # partition key
+            columns = f"id, {PARTITION_KEY}" if partitioned else "id"
+            definition = f"PRIMARY KEY ({columns})"
+        cursor.execute(
+            f"ALTER TABLE {quote(table)} ADD CONSTRAINT {quote(name)} {definition}"
+        )
+    for definition in indexes:
+        # Indexes of partitioned tables are defined ON ONLY the parent
+        cursor.execute(definition.replace(" ON ONLY ", " ON ", 1))
+
+
+def partition(apps, schema_editor):
+    """Partition the value tables if enabled (PostgreSQL only)"""
+
+    connection = schema_editor.connection
+    if connection.vendor != "postgresql" or not settings.TRACK_PARTITION_VALUES:
+        return
+    with connection.cursor() as cursor:
+        for table in VALUE_TABLES:
+            if not is_partitioned(cursor, table):
+                rebuild_table(connection, cursor, table, partitioned=True)
+
+
+def unpartition(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != "postgresql":
+        return
+    with connection.cursor() as cursor:
+        for table in VALUE_TABLES:
+            if is_partitioned(cursor, table):
+                rebuild_table(connection, cursor, table, partitioned=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("track", "0009_uploadtiming"),
+    ]
+
+    operations = [
+        migrations.RunPython(partition, unpartition),
+    ]
@@ -37,6 +37,10 @@ class PatientMetadata(TimeStampedModel):
         ordering = [
             "metadata_key__name",
         ]
+        # Change feed paging
+        indexes = [
+            models.Index(fields=["modified", "id"], name="track_patmeta_modified_idx")
+        ]
 
     patient = models.ForeignKey(
         Patient, related_name="patient_metadata", on_delete=models.CASCADE
@@ -67,6 +71,12 @@ class UploadedFile(TimeStampedModel):
     valid_model = models.BooleanField(default=True)
     notes = models.TextField(blank=True, default=None)
     content_type = models.CharField(max_length=20, choices=CONTENT_TYPE)
+    # SHA-256 of the file contents - used to detect repeated uploads
+    content_hash = models.CharField(
+        max_length=64, blank=True, default="", db_index=True
+    )
+    # Set once the contents have been uploaded (not just dry run)
+    committed = models.BooleanField(default=False)
 
     def __str__(self):
         return ", ".join(
@@ -104,6 +114,58 @@ class ValidationEntry(TimeStampedModel):
         )
 
 
+class UploadTiming(TimeStampedModel):
+    """Time spent in each stage of one run (dry or not) of an upload
+
+    Stage times are in seconds. Written at the end of ClinicalSampleFile and
+    PatientFile upload().
+    """
+
+    STAGES = [
+        "parse",
+        "header_validation",
+        "parameter_resolution",
+        "sample_resolution",
+        "value_writes",
+        "validation_entry_writes",
+        "commit",
+    ]
+
+    uploaded_file = models.ForeignKey(
+        UploadedFile, related_name="timings", on_delete=models.CASCADE
+    )
+    dry_run = models.BooleanField(default=False)
+    parse = models.FloatField(default=0)
+    header_validation = models.FloatField(default=0)
+    parameter_resolution = models.FloatField(default=0)
+    # Patients, samples and results for the rows
+    sample_resolution = models.FloatField(default=0)
+    value_writes = models.FloatField(default=0)
+    validation_entry_writes = models.FloatField(default=0)
+    commit = models.FloatField(default=0)
+    rows = models.IntegerField(default=0)
+    # Values written
+    cells = models.IntegerField(default=0)
+
+    @property
+    def total(self):
+        return sum(getattr(self, stage) for stage in self.STAGES)
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.total if self.total else 0.0
+
+    @property
+    def cells_per_second(self):
+        return self.cells / self.value_writes if self.value_writes else 0.0
+
+    def __str__(self):
+        return ", ".join(
+            ["File ID:" + str(self.uploaded_file_id)]
+            + [f"{stage}:{getattr(self, stage):.3f}s" for stage in self.STAGES]
+        )
+
+
 class ProcessedSample(TimeStampedModel):
 
     clinical_sample_id = models.CharField(max_length=12, unique=True)
@@ -134,6 +196,10 @@ class ProcessedSample(TimeStampedModel):
             "patient__patient_id",
             "clinical_sample_id",
         ]
+        # Change feed paging
+        indexes = [
+            models.Index(fields=["modified", "id"], name="track_sample_modified_idx")
+        ]
 
     def __str__(self):
         return ", ".join(
@@ -206,6 +272,10 @@ class Result(TimeStampedModel):
             "panel__name",
             "gating_strategy__strategy",
         ]
+        # Change feed paging
+        indexes = [
+            models.Index(fields=["modified", "id"], name="track_result_modified_idx")
+        ]
 
     def __str__(self):
         return ", ".join(
@@ -251,7 +321,7 @@ class Parameter(TimeStampedModel):
 
     data_type = models.CharField(max_length=20, choices=DATA_TYPE)
     internal_name = models.CharField(max_length=255)
-    public_name = models.CharField(max_length=255)
+    public_name = models.CharField(max_length=255, db_index=True)
     display_name = models.CharField(max_length=255)
     excel_column_name = models.CharField(max_length=255)
     description = models.TextField()
@@ -302,6 +372,10 @@ class NumericValue(TimeStampedModel):
             "parameter__data_type",
             "parameter__public_name",
         ]
+        # Change feed paging
+        indexes = [
+            models.Index(fields=["modified", "id"], name="track_numval_modified_idx")
+        ]
 
     result = models.ForeignKey(Result, on_delete=models.CASCADE)
     parameter = models.ForeignKey(Parameter, on_delete=models.CASCADE)
@@ -324,6 +398,10 @@ class TextValue(TimeStampedModel):
         ordering = [
             "parameter__public_name",
         ]
+        # Change feed paging
+        indexes = [
+            models.Index(fields=["modified", "id"], name="track_textval_modified_idx")
+        ]
 
     result = models.ForeignKey(Result, on_delete=models.CASCADE)
     parameter = models.ForeignKey(Parameter, on_delete=models.CASCADE)
@@ -345,6 +423,14 @@ class DateValue(TimeStampedModel):
         ordering = [
             "parameter__public_name",
         ]
+        indexes = [
+            # Filtering results on date processed
+            models.Index(
+                fields=["parameter", "value"], name="track_dateval_param_value_idx"
+            ),
+            # Change feed paging
+            models.Index(fields=["modified", "id"], name="track_dateval_modified_idx"),
+        ]
 
     result = models.ForeignKey(Result, on_delete=models.CASCADE)
     parameter = models.ForeignKey(Parameter, on_delete=models.CASCADE)
@@ -362,3 +448,23 @@ class DateValue(TimeStampedModel):
 
 class GatingStrategy(TimeStampedModel):
     strategy = models.CharField(max_length=100)
+
+
+class DeletionLog(TimeStampedModel):
+    """Record of a deleted row, so incremental consumers see deletions
+
+    Written by the post_delete signal handlers in signals.py. Pruned after
+    DELETION_LOG_RETENTION_DAYS by the prune_deletion_log command.
+    """
+
+    class Meta:
+        # Change feed paging
+        indexes = [
+            models.Index(fields=["modified", "id"], name="track_dellog_modified_idx")
+        ]
+
+    model = models.CharField(max_length=100)
+    object_id = models.IntegerField()
+
+    def __str__(self):
+        return ", ".join(["Model:" + self.model, "ID:" + str(self.object_id)])
@@ -0,0 +1,200 @@
+"""
+Range partitioning of the value tables by result id on PostgreSQL.
+
+With TRACK_PARTITION_VALUES set, the NumericValue, TextValue and
+DateValue tables are declaratively partitioned on result_id, in ranges of
+TRACK_VALUE_PARTITION_SIZE results. The values of an upload land in one
+or two partitions, which keeps indexes small and lets VACUUM and scans of
+a range of results skip the rest of the table. A DEFAULT partition takes
+any values beyond the last range, so uploads never fail for want of a
+partition. ensure_value_partitions (run after migrate) adds ranges ahead
+of the data and moves values out of the default partition.
+
+Ranges are only added when ensure_value_partitions runs, so it also has
+to run on a schedule (e.g. a daily cron job). Between runs, results past
+the last range go to the default partition, which is not pruned and has
+to be emptied, under lock, by the next run. Schedule it so that fewer
+than TRACK_VALUE_PARTITION_SIZE results are added between runs.
+
+The models are unchanged - PostgreSQL requires the primary key to include
+the partition key, so it becomes (id, result_id), but ids still come from
+the one sequence and are unique. SQLite databases keep the plain tables.
+Migration 0010 has its own copy of the SQL, so changes here do not alter
+what it does.
+"""
+
+import re
+
+from django.conf import settings
+
+VALUE_TABLES = ["track_numericvalue", "track_textvalue", "track_datevalue"]
+PARTITION_KEY = "result_id"
+RESULT_TABLE = "track_result"
+
+re_range_bound = re.compile(r"FROM \('?(-?\d+)'?\) TO \('?(-?\d+)'?\)")
+
+
+def partitioning_enabled(connection):
+    """Whether the value tables should be partitioned on this database"""
+
+    return connection.vendor == "postgresql" and settings.TRACK_PARTITION_VALUES
+
+
+def is_partitioned(cursor, table):
+    """Whether table is a partitioned table"""
+
+    cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", [table])
+    row = cursor.fetchone()
+    return row is not None and row[0] == "p"
+
+
+def partition_ranges(cursor, table):
+    """Return the (name, lower bound, upper bound) of the range partitions"""
+
+    cursor.execute(
+        "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) "
+        + "FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        + "WHERE i.inhparent = %s::regclass",
+        [table],
+    )
+    ranges = []
+    for name, bound in cursor.fetchall():
+        match = re_range_bound.search(bound)
+        if match:
+            ranges.append((name, int(match.group(1)), int(match.group(2))))
+    return sorted(ranges, key=lambda item: item[1])
+
+
+def partition_value_tables(connection):
+    """Partition the value tables if they are not yet, and add partitions
+    up to one range past the highest result id
+
+    Returns
+    -------
+    created : list
+        names of the partitions created
+    """
+
+    created = []
+    with connection.cursor() as cursor:
+        for table in VALUE_TABLES:
+            if not is_partitioned(cursor, table):
+                _rebuild_table(connection, cursor, table, partitioned=True)
+            created += ensure_partitions(connection, cursor, table)
+    return created
+
+
+def unpartition_value_tables(connection):
+    """Turn partitioned value tables back into plain tables"""
+
+    with connection.cursor() as cursor:
+        for table in VALUE_TABLES:
+            if is_partitioned(cursor, table):
+                _rebuild_table(connection, cursor, table, partitioned=False)
+
+
+def ensure_partitions(connection, cursor, table):
+    """Add range partitions up to one range past the highest result id
+
+    Values already in the default partition for a new range are moved to
+    it. Returns the names of the partitions created.
+    """
+
+    quote = connection.ops.quote_name
+    size = settings.TRACK_VALUE_PARTITION_SIZE
+    default = quote(f"{table}_default")
+    cursor.execute(f"SELECT coalesce(max(id), 0) FROM {quote(RESULT_TABLE)}")
+    max_result_id = cursor.fetchone()[0]
+    ranges = partition_ranges(cursor, table)
+    lower = ranges[-1][2] if ranges else 0
+
+    created = []
+    while lower <= max_result_id + size:
+        upper = lower + size
+        name = f"{table}_p{lower}"
+        cursor.execute(
+            f"SELECT EXISTS (SELECT 1 FROM {default} "
+            + f"WHERE {PARTITION_KEY} >= %s AND {PARTITION_KEY} < %s)",
+            [lower, upper],
+        )
+        in_default = cursor.fetchone()[0]
+        if in_default:
+            # A range cannot be added while the default partition has rows
+            # in it
+            cursor.execute(f"ALTER TABLE {quote(table)} DETACH PARTITION {default}")
+        cursor.execute(
+            f"CREATE TABLE {quote(name)} PARTITION OF {quote(table)} "
+            + f"FOR VALUES FROM ({lower}) TO ({upper})"
+        )
+        if in_default:
+            in_range = f"{PARTITION_KEY} >= {lower} AND {PARTITION_KEY} < {upper}"
+            cursor.execute(
+                f"INSERT INTO {quote(name)} SELECT * FROM {default} WHERE {in_range}"
+            )
+            cursor.execute(f"DELETE FROM {default} WHERE {in_range}")
+            cursor.execute(
+                f"ALTER TABLE {quote(table)} ATTACH PARTITION {default} DEFAULT"
+            )
+        created.append(name)
+        lower = upper
+    return created
+
+
+def _rebuild_table(connection, cursor, table, partitioned):
+    """Copy a table into a new (partitioned or plain) table of the same name
+
+    Columns, defaults, the id sequence, constraints and indexes are kept.
+    The table is locked for the duration of the copy.
+    """
+
+    quote = connection.ops.quote_name
+    new_table = f"{table}_rebuild"
+
+    # Constraints and the indexes not backing a constraint
+    cursor.execute(
+        "SELECT conname, contype, pg_get_constraintdef(oid) FROM pg_constraint "
+        + "WHERE conrelid = %s::regclass AND contype IN ('p', 'u', 'f') "
+        + "ORDER BY contype <> 'p', conname",
+        [table],
+    )
+    constraints = cursor.fetchall()
+    cursor.execute(
+        "SELECT pg_get_indexdef(i.indexrelid) FROM pg_index i "
+        + "WHERE i.indrelid = %s::regclass AND NOT EXISTS ("
+        + "SELECT 1 FROM pg_constraint c "
+        + "WHERE c.conrelid = i.indrelid AND c.conindid = i.indexrelid)",
+        [table],
+    )
+    indexes = [row[0] for row in cursor.fetchall()]
+    cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [table])
+    sequence = cursor.fetchone()[0]
+
+    cursor.execute(f"LOCK TABLE {quote(table)} IN ACCESS EXCLUSIVE MODE")
+    cursor.execute(
+        f"CREATE TABLE {quote(new_table)} (LIKE {quote(table)} INCLUDING DEFAULTS)"
+        + (f" PARTITION BY RANGE ({PARTITION_KEY})" if partitioned else "")
+    )
+    if partitioned:
+        cursor.execute(
+            f"CREATE TABLE {quote(table + '_default')} "
+            + f"PARTITION OF {quote(new_table)} DEFAULT"
+        )
+    cursor.execute(f"INSERT INTO {quote(new_table)} SELECT * FROM {quote(table)}")
+    if sequence:
+        # The sequence would otherwise be dropped with the old table
+        cursor.execute(f"ALTER SEQUENCE {sequence} OWNED BY {quote(new_table)}.id")
+    cursor.execute(f"DROP TABLE {quote(table)}")
+    cursor.execute(f"ALTER TABLE {quote(new_table)} RENAME TO {quote(table)}")
+
+    for name, constraint_type, definition in constraints:
+        if constraint_type == "p":
+            # Unique constraints of a partitioned table must include the
+            # partition key
+            columns = f"id, {PARTITION_KEY}" if partitioned else "id"
+            definition = f"PRIMARY KEY ({columns})"
+        cursor.execute(
+            f"ALTER TABLE {quote(table)} ADD CONSTRAINT {quote(name)} {definition}"
+        )
+    for definition in indexes:
+        # Indexes of partitioned tables are defined ON ONLY the parent
+        cursor.execute(definition.replace(" ON ONLY ", " ON ", 1))
@@ -0,0 +1,117 @@
+"""
+On-demand profiles of single requests and uploads.
+
+A profile is a cProfile run of the code (load the .prof file with
+pstats, snakeviz or `python -m pstats`) together with a log of the SQL
+queries it ran, their parameters and durations (.sql.json). Both are
+written to TRACK_PROFILE_DIR.
+
+Staff users profile a request by adding ?profile=1 or the header
+X-Track-Profile: 1 - see ProfilingMiddleware. The name of the profile is
+returned in the X-Track-Profile response header and its files are
+served at /track/profiles/<file name>.
+"""
+
+import contextlib
+import cProfile
+import datetime
+import json
+import os
+import re
+import time
+
+from django.conf import settings
+from django.db import connections
+
+PROFILE_HEADER = "X-Track-Profile"
+
+
+class SQLLog:
+    """Database execute wrapper logging every query run"""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append(
+                {
+                    "sql": sql,
+                    "params": None if many else [str(p) for p in params or []],
+                    "many": many,
+                    "duration": time.perf_counter() - start,
+                }
+            )
+
+
+class Profile:
+    """Profile the code run in a with block, then save() the results"""
+
+    def __init__(self):
+        self.profiler = cProfile.Profile()
+        self.sql_log = SQLLog()
+        self.duration = None
+        self._stack = None
+
+    def __enter__(self):
+        self._stack = contextlib.ExitStack()
+        for connection in connections.all():
+            self._stack.enter_context(connection.execute_wrapper(self.sql_log))
+        self._start = time.perf_counter()
+        self.profiler.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.disable()
+        self.duration = time.perf_counter() - self._start
+        self._stack.close()
+
+    def save(self, label):
+        """Write the profile and SQL log to TRACK_PROFILE_DIR
+
+        Parameters
+        ----------
+        label : str
+            describes what was profiled, e.g. the view name. It is made
+            part of the file names.
+
+        Returns
+        -------
+        name : str
+            name of the profile - the file names without the extensions
+        """
+
+        timestamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        name = timestamp + "-" + re.sub(r"[^\w.-]+", "_", label)
+        os.makedirs(settings.TRACK_PROFILE_DIR, exist_ok=True)
+        path = os.path.join(settings.TRACK_PROFILE_DIR, name)
+        self.profiler.dump_stats(path + ".prof")
+        with open(path + ".sql.json", "w") as f:
+            json.dump(
+                {
+                    "label": label,
+                    "duration": self.duration,
+                    "query_count": len(self.sql_log.queries),
+                    "query_duration": sum(
+                        query["duration"] for query in self.sql_log.queries
+                    ),
+                    "queries": self.sql_log.queries,
+                },
+                f,
+                indent=1,
+            )
+        return name
+
+
+def profile_requested(request):
+    """Whether a request asks to be profiled and is allowed to"""
+
+    if not settings.TRACK_PROFILING:
+        return False
+    if request.GET.get("profile") != "1" and request.headers.get(PROFILE_HEADER) != "1":
+        return False
+    user = getattr(request, "user", None)
+    return user is not None and user.is_staff
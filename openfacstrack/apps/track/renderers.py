@@ -0,0 +1,61 @@
+"""
+Additional response formats for the REST API.
+
+Besides JSON and the browsable API, clients can ask for newline-delimited
+JSON (one object per line, so large lists can be processed as they are
+read) and, when the msgpack package is installed, MessagePack.
+The format is negotiated from the Accept header or the ?format= query
+parameter, e.g. ?format=ndjson or Accept: application/msgpack.
+"""
+
+import json
+
+from rest_framework.renderers import (
+    BaseRenderer,
+    BrowsableAPIRenderer,
+    JSONRenderer,
+)
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class NDJSONRenderer(BaseRenderer):
+    """Render a list as one JSON document per line"""
+
+    media_type = "application/x-ndjson"
+    format = "ndjson"
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        if not isinstance(data, list):
+            data = [data]
+        lines = [
+            json.dumps(item, cls=JSONEncoder, ensure_ascii=False, separators=(",", ":"))
+            for item in data
+        ]
+        return "".join(line + "\n" for line in lines).encode("utf-8")
+
+
+class MessagePackRenderer(BaseRenderer):
+    """Render data as MessagePack"""
+
+    media_type = "application/msgpack"
+    format = "msgpack"
+    charset = None
+    render_style = "binary"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        return msgpack.packb(data, default=JSONEncoder().default, use_bin_type=True)
+
+
+API_RENDERER_CLASSES = [JSONRenderer, BrowsableAPIRenderer, NDJSONRenderer]
+if msgpack is not None:
+    API_RENDERER_CLASSES.append(MessagePackRenderer)
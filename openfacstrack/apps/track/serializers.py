@@ -1,6 +1,14 @@
+import time
+
+from django.conf import settings
+from django.db import models
 from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
+from .metrics import add_serialization_time
 from .models import (
+    Parameter,
     Patient,
+    PatientMetadata,
     ProcessedSample,
     Result,
     NumericValue,
@@ -8,16 +16,69 @@ from .models import (
     DateValue,
 )
 
+# Value types that can be selected with ?include=
+VALUE_TYPES = {
+    "numeric": "numeric_values",
+    "text": "text_values",
+    "date": "date_values",
+}
+
+
+class SparseFieldsMixin:
+    """Leave out fields a request did not ask for
+
+    context["fields"] restricts the fields of the top level objects (the
+    serializer itself, or its items when many=True) and context["include"]
+    restricts the value types of observations at any level. Fields that
+    are left out are never read, so their queries are never made.
+    """
+
+    def get_fields(self):
+        fields = super().get_fields()
+
+        requested = self.context.get("fields")
+        top_level = self.parent is None or (
+            isinstance(self.parent, serializers.ListSerializer)
+            and self.parent.parent is None
+        )
+        if requested and top_level:
+            unknown = set(requested) - set(fields)
+            if unknown:
+                raise ValidationError(
+                    {"fields": [f"Unknown field(s): {', '.join(sorted(unknown))}"]}
+                )
+            fields = {
+                name: field for name, field in fields.items() if name in requested
+            }
+
+        include = self.context.get("include")
+        if include is not None:
+            excluded = set(VALUE_TYPES.values()) - {
+                VALUE_TYPES[name] for name in include
+            }
+            fields = {
+                name: field for name, field in fields.items() if name not in excluded
+            }
+        return fields
+
 
-class PatientSerializer(serializers.ModelSerializer):
+class PatientSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     patient_metadata = serializers.StringRelatedField(many=True)
 
+    # Related objects of fields loaded up front by sparse_queryset()
+    prefetch = {
+        "patient_metadata": models.Prefetch(
+            "patient_metadata",
+            queryset=PatientMetadata.objects.select_related("metadata_key"),
+        )
+    }
+
     class Meta:
         model = Patient
         fields = ("patient_id", "created", "modified", "patient_metadata")
 
 
-class ProcessedSampleSerializer(serializers.ModelSerializer):
+class ProcessedSampleSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     patient_id = serializers.CharField(source="patient.patient_id", read_only=True)
 
     class Meta:
@@ -67,7 +128,151 @@ class DateValueSerializer(serializers.ModelSerializer):
         )
 
 
-class ObservationSerializer(serializers.ModelSerializer):
+class FastObservationListSerializer(serializers.ListSerializer):
+    """Serialize many results straight from values_list() rows
+
+    Gives the same output as the ObservationSerializer fields, but reads
+    the results and all their numeric, text and date values in four
+    queries and builds the output without model instances or a serializer
+    per value. Used when settings.TRACK_FAST_SERIALIZERS is set.
+
+    With "normalized" set in the serializer context each value is output
+    as a [parameter id, value] pair instead of repeating the parameter
+    names, and the ids used are collected in context["parameter_ids"].
+    See normalized_response().
+    """
+
+    # Output field name and column read for it
+    result_columns = (
+        ("patient_id", "processed_sample__patient__patient_id"),
+        ("clinical_sample_id", "processed_sample__clinical_sample_id"),
+        ("uploaded_file", "uploaded_file__name"),
+        ("panel", "panel__name"),
+        ("gating_strategy", "gating_strategy__strategy"),
+        ("fcs_file_name", "data_processing__fcs_file_name"),
+        ("created", "created"),
+        ("modified", "modified"),
+    )
+    value_columns = (
+        ("numeric_values", NumericValue, NumericValueSerializer),
+        ("text_values", TextValue, TextValueSerializer),
+        ("date_values", DateValue, DateValueSerializer),
+    )
+
+    def to_representation(self, data):
+        normalized = self.context.get("normalized", False)
+        if not settings.TRACK_FAST_SERIALIZERS and not normalized:
+            return super().to_representation(data)
+
+        if isinstance(data, models.Manager):
+            if self.context.get("results") is not None:
+                # Results of one sample of many - see _results_by_sample()
+                return self._results_by_sample().get(data.instance.pk, [])
+            data = data.all()
+        if isinstance(data, models.QuerySet):
+            results = data
+            # Values are selected with a subquery rather than a list of ids
+            result_filter = data.values("pk")
+        else:
+            result_filter = [result.pk for result in data]
+            results = Result.objects.filter(pk__in=result_filter)
+
+        fields = self.child.fields
+        result_columns = [
+            (name, column) for name, column in self.result_columns if name in fields
+        ]
+        columns = [column for _, column in result_columns]
+        rows = {
+            row[0]: row[1:] for row in results.values_list("pk", *columns).iterator()
+        }
+        result_ids = list(rows) if isinstance(data, models.QuerySet) else result_filter
+
+        # Values of all results, grouped by result
+        values = {result_id: {} for result_id in rows}
+        for field_name, model, serializer_class in self.value_columns:
+            if field_name not in fields:
+                continue
+            for result_values in values.values():
+                result_values[field_name] = []
+            value_fields = serializer_class().fields
+            value_columns = [
+                (name, value_fields[name].source.replace(".", "__"))
+                for name in serializer_class.Meta.fields
+            ]
+            queryset = model.objects.filter(result__in=result_filter).order_by(
+                *model._meta.ordering
+            )
+            if self.context.get("value_parameters") is not None:
+                queryset = queryset.filter(
+                    parameter__in=self.context["value_parameters"]
+                )
+            if normalized:
+                parameter_ids = self.context.setdefault("parameter_ids", set())
+                value_rows = queryset.values_list(
+                    "result_id", "parameter_id", "value"
+                ).iterator()
+                to_representation = value_fields["value"].to_representation
+                for result_id, parameter_id, value in value_rows:
+                    parameter_ids.add(parameter_id)
+                    values[result_id][field_name].append(
+                        [
+                            parameter_id,
+                            None if value is None else to_representation(value),
+                        ]
+                    )
+                continue
+
+            value_rows = queryset.values_list(
+                "result_id", *[column for _, column in value_columns]
+            ).iterator()
+            for value_row in value_rows:
+                values[value_row[0]][field_name].append(
+                    self._build(value_fields, value_columns, value_row[1:])
+                )
+
+        output = []
+        for result_id in result_ids:
+            item = self._build(fields, result_columns, rows[result_id])
+            item.update(values[result_id])
+            output.append(item)
+        self._result_ids = result_ids
+        return output
+
+    def _results_by_sample(self):
+        """Serialize context["results"] once, grouped by sample
+
+        Nested under samples (e.g. AllDataSerializer) this serializer gets
+        the results of one sample at a time. With all the results being
+        serialized given as context["results"] they are serialized in one
+        go on the first call instead of in four queries per sample.
+        """
+
+        by_sample = self.context.get("results_by_sample")
+        if by_sample is None:
+            results = self.context["results"]
+            samples = dict(results.values_list("pk", "processed_sample_id"))
+            by_sample = self.context["results_by_sample"] = {}
+            output = self.to_representation(results)
+            for result_id, item in zip(self._result_ids, output):
+                by_sample.setdefault(samples[result_id], []).append(item)
+        return by_sample
+
+    @staticmethod
+    def _build(fields, columns, row):
+        """Build one output dict the way Serializer.to_representation does"""
+
+        item = {}
+        for (name, column), value in zip(columns, row):
+            if value is None:
+                # Unset relations are left out, null column values kept
+                if "__" not in column:
+                    item[name] = None
+                continue
+            item[name] = fields[name].to_representation(value)
+        return item
+
+
+class ObservationSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     patient_id = serializers.CharField(
         source="processed_sample.patient.patient_id", read_only=True
     )
@@ -87,17 +292,23 @@ class ObservationSerializer(serializers.ModelSerializer):
     text_values = serializers.SerializerMethodField("get_text_values")
 
     def get_numeric_values(self, result):
-        numeric_values = NumericValue.objects.filter(result=result)
+        numeric_values = self._filter_values(NumericValue.objects.filter(result=result))
         return NumericValueSerializer(numeric_values, many=True).data
 
     def get_text_values(self, result):
-        text_values = TextValue.objects.filter(result=result)
+        text_values = self._filter_values(TextValue.objects.filter(result=result))
         return TextValueSerializer(text_values, many=True).data
 
     def get_date_values(self, result):
-        date_values = DateValue.objects.filter(result=result)
+        date_values = self._filter_values(DateValue.objects.filter(result=result))
         return DateValueSerializer(date_values, many=True).data
 
+    def _filter_values(self, values):
+        # Only values of the parameters selected with ?parameter=
+        if self.context.get("value_parameters") is not None:
+            values = values.filter(parameter__in=self.context["value_parameters"])
+        return values
+
     class Meta:
         model = Result
         fields = (
@@ -113,6 +324,7 @@ class ObservationSerializer(serializers.ModelSerializer):
             "text_values",
             "date_values",
         )
+        list_serializer_class = FastObservationListSerializer
 
         # exclude = ("id", "processed_sample", "data_processing",)
 
@@ -147,6 +359,8 @@ class SampleObservationSerializer(ProcessedSampleSerializer):
 class AllDataSerializer(PatientSerializer):
     samples = SampleObservationSerializer(many=True, read_only=True)
 
+    prefetch = dict(PatientSerializer.prefetch, samples="samples")
+
     class Meta:
         model = Patient
         fields = (
@@ -156,3 +370,106 @@ class AllDataSerializer(PatientSerializer):
             "patient_metadata",
             "samples",
         )
+
+
+def serializer_context(request):
+    """Serializer context for the output options given in the query string
+
+    ?fields=a,b selects the fields of the top level objects, ?include=
+    the value types of observations (numeric, text and/or date) and
+    ?layout=normalized the normalized observation layout.
+    """
+
+    context = {"normalized": request.query_params.get("layout") == "normalized"}
+
+    fields = request.query_params.get("fields")
+    if fields:
+        context["fields"] = [name.strip() for name in fields.split(",") if name.strip()]
+
+    include = request.query_params.get("include")
+    if include is not None:
+        include = [name.strip() for name in include.split(",") if name.strip()]
+        unknown = set(include) - set(VALUE_TYPES)
+        if unknown:
+            raise ValidationError(
+                {
+                    "include": [
+                        f"Unknown value type(s): {', '.join(sorted(unknown))}. "
+                        + f"Choose from {', '.join(VALUE_TYPES)}"
+                    ]
+                }
+            )
+        context["include"] = include
+    return context
+
+
+def sparse_queryset(queryset, serializer_class, context):
+    """Load only the model fields the requested serializer fields need
+
+    Related objects the fields read are loaded up front - with a join for
+    foreign keys and the serializer's prefetch for many related fields -
+    so the number of queries does not grow with the number of objects.
+    """
+
+    fields = serializer_class(context=context).fields
+    concrete_fields = {
+        field.name: field for field in queryset.model._meta.concrete_fields
+    }
+    only = {"pk"}
+    for field in fields.values():
+        name = field.source.split(".")[0]
+        if name in concrete_fields:
+            only.add(name)
+            if "." in field.source and concrete_fields[name].is_relation:
+                queryset = queryset.select_related(name)
+
+    prefetch = getattr(serializer_class, "prefetch", {})
+    queryset = queryset.prefetch_related(
+        *[prefetch[name] for name in fields if name in prefetch]
+    )
+    if context.get("fields"):
+        queryset = queryset.only(*only)
+    return queryset
+
+
+def normalized_response(serializer):
+    """Data of a serializer in the normalized layout
+
+    Values are given as [parameter id, value] pairs and the parameters
+    are described once in a dictionary keyed on their id:
+
+        {"parameters": {id: {"public_name", "data_type", "unit"}},
+         "data": <serializer data>}
+
+    The serializer must have been created with {"normalized": True} in
+    its context.
+    """
+
+    data = serializer.data
+    parameter_ids = serializer.context.get("parameter_ids", set())
+    parameters = {
+        parameter_id: {"public_name": public_name, "data_type": data_type, "unit": unit}
+        for parameter_id, public_name, data_type, unit in Parameter.objects.filter(
+            pk__in=parameter_ids
+        )
+        .order_by("pk")
+        .values_list("pk", "public_name", "data_type", "unit")
+    }
+    return {"parameters": parameters, "data": data}
+
+
+def response_data(request, serializer, normalized=False):
+    """Data of a serializer for the response to request, in the normalized
+    layout if asked for (see normalized_response)
+
+    The time taken is added to the serialization time of the request in
+    the metrics, with the rendering of the data timed by MetricsMiddleware.
+    """
+
+    start = time.perf_counter()
+    if normalized:
+        data = normalized_response(serializer)
+    else:
+        data = serializer.data
+    add_serialization_time(request, time.perf_counter() - start)
+    return data
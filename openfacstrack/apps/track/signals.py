@@ -0,0 +1,69 @@
+"""
+Signal handlers for the track app.
+"""
+
+import django
+from django.core.signals import request_started
+from django.db import connections
+from django.db.models.signals import post_delete, post_save
+
+from openfacstrack.apps.track.caching import DATA_MODELS, bump_generation_on_commit
+from openfacstrack.apps.track.changes import FEED_MODELS
+from openfacstrack.apps.track.models import DeletionLog
+
+
+def log_deletion(sender, instance, **kwargs):
+    """Record deleted rows of the change feed models
+
+    Runs for cascaded deletes too, e.g. the values of a deleted result.
+    """
+
+    DeletionLog.objects.create(model=sender._meta.model_name, object_id=instance.pk)
+
+
+for model in FEED_MODELS:
+    post_delete.connect(
+        log_deletion, sender=model, dispatch_uid=f"log_deletion_{model.__name__}"
+    )
+
+
+def invalidate_cached_responses(sender, using=None, **kwargs):
+    """Invalidate cached responses and ETags once a change is committed
+
+    Uploads bump the generation themselves - this covers every other
+    write through the ORM, e.g. admin edits and deletes. Bulk writes
+    (bulk_create, update(), raw SQL) send no signals.
+    """
+
+    bump_generation_on_commit(using)
+
+
+for model in DATA_MODELS:
+    for signal in [post_save, post_delete]:
+        signal.connect(
+            invalidate_cached_responses,
+            sender=model,
+            dispatch_uid=f"invalidate_cached_responses_{model.__name__}",
+        )
+
+
+def check_database_connections(**kwargs):
+    """Close persistent connections that no longer work
+
+    Django only supports the CONN_HEALTH_CHECKS database setting from 4.1,
+    so check reused connections at the start of each request here.
+    """
+
+    for connection in connections.all():
+        if (
+            connection.connection is not None
+            and connection.settings_dict.get("CONN_HEALTH_CHECKS")
+            and not connection.is_usable()
+        ):
+            connection.close()
+
+
+if django.VERSION < (4, 1):
+    request_started.connect(
+        check_database_connections, dispatch_uid="check_database_connections"
+    )
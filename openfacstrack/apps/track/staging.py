@@ -0,0 +1,187 @@
+"""
+Set-based loading of values into the NumericValue, TextValue and
+DateValue tables.
+
+Values are first streamed into a temporary staging table (with COPY on
+PostgreSQL and executemany elsewhere) and then merged into the value
+table with a single INSERT ... SELECT ... ON CONFLICT DO UPDATE, so no
+per-cell ORM calls are needed. Re-uploads can instead be diffed against
+the stored values so that only changed values are written.
+"""
+
+import io
+
+from django.db import connection
+from django.utils import timezone
+import pandas as pd
+
+
+def merge_values(model, values):
+    """Insert or update values for (result, parameter) pairs in one statement
+
+    Parameters
+    ----------
+    model : Model
+        One of the value models - NumericValue, TextValue or DateValue
+    values : DataFrame
+        Long form values with columns result_id, parameter_id and value.
+        If a (result_id, parameter_id) pair occurs more than once the
+        last occurrence is stored.
+
+    Returns
+    -------
+    n_merged : int
+        Number of rows inserted or updated
+    """
+
+    values = values.drop_duplicates(subset=["result_id", "parameter_id"], keep="last")
+    if len(values) == 0:
+        return 0
+
+    quote = connection.ops.quote_name
+    opts = model._meta
+    table = quote(opts.db_table)
+    staging = quote(f"{opts.db_table}_staging")
+    result_column = quote(opts.get_field("result").column)
+    parameter_column = quote(opts.get_field("parameter").column)
+    value_column = quote(opts.get_field("value").column)
+    created_column = quote(opts.get_field("created").column)
+    modified_column = quote(opts.get_field("modified").column)
+
+    with connection.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {staging}")
+        cursor.execute(
+            f"CREATE TEMPORARY TABLE {staging} ("
+            + f"result_id {opts.get_field('result').db_type(connection)} NOT NULL, "
+            + f"parameter_id {opts.get_field('parameter').db_type(connection)} NOT NULL, "
+            + f"value {opts.get_field('value').db_type(connection)})"
+        )
+
+        if connection.vendor == "postgresql":
+            buffer = io.StringIO()
+            values.to_csv(
+                buffer,
+                columns=["result_id", "parameter_id", "value"],
+                header=False,
+                index=False,
+            )
+            buffer.seek(0)
+            cursor.copy_expert(
+                f"COPY {staging} (result_id, parameter_id, value) "
+                + "FROM STDIN WITH (FORMAT csv)",
+                buffer,
+            )
+        else:
+            cursor.executemany(
+                f"INSERT INTO {staging} (result_id, parameter_id, value) "
+                + "VALUES (%s, %s, %s)",
+                list(
+                    zip(
+                        values["result_id"].tolist(),
+                        values["parameter_id"].tolist(),
+                        values["value"].tolist(),
+                    )
+                ),
+            )
+
+        # 'WHERE true' is needed by SQLite to parse an upsert that
+        # selects from another table
+        now = connection.ops.adapt_datetimefield_value(timezone.now())
+        cursor.execute(
+            f"INSERT INTO {table} ({created_column}, {modified_column}, "
+            + f"{result_column}, {parameter_column}, {value_column}) "
+            + f"SELECT %s, %s, result_id, parameter_id, value FROM {staging} "
+            + f"WHERE true ON CONFLICT ({result_column}, {parameter_column}) "
+            + f"DO UPDATE SET {value_column} = excluded.{value_column}, "
+            + f"{modified_column} = excluded.{modified_column}",
+            [now, now],
+        )
+        n_merged = cursor.rowcount
+        cursor.execute(f"DROP TABLE {staging}")
+
+    return n_merged
+
+
+def sync_values(model, values, result_ids, parameter_ids, invalid=None):
+    """Write only the values that differ from those already stored
+
+    The values stored for the given results and parameters are fetched in
+    one query and compared with the incoming values. New values are
+    inserted, changed values updated and stored values that are no longer
+    present deleted. Unchanged rows are not touched, so their modified
+    timestamps are kept.
+
+    Parameters
+    ----------
+    model : Model
+        One of the value models - NumericValue, TextValue or DateValue
+    values : DataFrame
+        Long form values with columns result_id, parameter_id and value
+    result_ids : list
+        Primary keys of all results the values were uploaded for
+    parameter_ids : list
+        Primary keys of all parameters the values were uploaded for. Only
+        stored values for these parameters are considered for deletion.
+    invalid : DataFrame, optional
+        Columns result_id and parameter_id of uploaded cells that failed
+        validation. Their stored values are kept rather than deleted, as
+        only empty cells remove a value.
+
+    Returns
+    -------
+    summary : dict
+        Number of values inserted, updated, deleted and unchanged
+    changed_result_ids : set
+        Primary keys of results that had at least one value written
+    """
+
+    key_types = {"result_id": "int64", "parameter_id": "int64"}
+    values = values.drop_duplicates(
+        subset=["result_id", "parameter_id"], keep="last"
+    ).astype(key_types)
+    existing = pd.DataFrame.from_records(
+        model.objects.filter(
+            result_id__in=list(result_ids), parameter_id__in=list(parameter_ids)
+        ).values_list("id", "result_id", "parameter_id", "value"),
+        columns=["id", "result_id", "parameter_id", "value"],
+    ).astype(key_types)
+    merged = values[["result_id", "parameter_id", "value"]].merge(
+        existing,
+        on=["result_id", "parameter_id"],
+        how="outer",
+        suffixes=("", "_existing"),
+        indicator=True,
+    )
+
+    in_both = merged["_merge"] == "both"
+    same_value = (merged["value"] == merged["value_existing"]) | (
+        merged["value"].isna() & merged["value_existing"].isna()
+    )
+    inserts = merged[merged["_merge"] == "left_only"]
+    updates = merged[in_both & ~same_value]
+    deletes = merged[merged["_merge"] == "right_only"]
+    kept = pd.DataFrame(columns=deletes.columns)
+    if invalid is not None and len(invalid) > 0:
+        invalid_keys = pd.MultiIndex.from_frame(
+            invalid[["result_id", "parameter_id"]].astype(key_types)
+        )
+        is_invalid = pd.MultiIndex.from_frame(
+            deletes[["result_id", "parameter_id"]]
+        ).isin(invalid_keys)
+        kept = deletes[is_invalid]
+        deletes = deletes[~is_invalid]
+
+    merge_values(model, pd.concat([inserts, updates]))
+    if len(deletes) > 0:
+        model.objects.filter(pk__in=deletes["id"].astype(int).tolist()).delete()
+
+    summary = {
+        "inserted": len(inserts),
+        "updated": len(updates),
+        "deleted": len(deletes),
+        "unchanged": int((in_both & same_value).sum()) + len(kept),
+    }
+    changed_result_ids = set(
+        pd.concat([inserts, updates, deletes])["result_id"].astype(int).tolist()
+    )
+    return summary, changed_result_ids
@@ -0,0 +1,176 @@
+"""
+Synthetic cohorts for benchmarks and load tests.
+
+Files are generated in the same CSV layouts as real uploads - one panel
+results file per panel and one patient data file - using the panels and
+parameters of the reference data already loaded into the database, so
+they exercise the whole upload pipeline.
+"""
+
+import csv
+import datetime
+import io
+import random
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+
+from openfacstrack.apps.track.models import Panel, Parameter
+from openfacstrack.apps.track.utils import ClinicalSampleFile, PatientFile
+
+# Cell contents seen in real files that are not numbers
+MALFORMED_NUMBERS = ["#DIV/0!", "n.d.", "12,5", "<10", "-"]
+
+PATIENT_DATA_FILE = "synthetic_patient_data.csv"
+
+PATIENT_COLUMNS = {
+    "group": ["Hospitalised", "Healthy", "Community"],
+    "covid19_status": ["Confirmed", "Suspected", "Unknown"],
+    "sex": ["Male", "Female"],
+    "ethnicity": ["white", "black", "asian", "mixed", "other"],
+    "age": ["18-24", "25-35", "36-45", "46-55", "56-65", "66-75", "76-85"],
+    "comorbidities": ["None", "T2D", "heart,T2D", "asthma"],
+    "symptoms": ["Healthy", "Paucisymptomatic", "Mild", "Severe"],
+}
+
+
+def patient_ids(n_patients):
+    """Return the ids of a synthetic cohort of n_patients"""
+
+    return [f"p{i:04d}" for i in range(1, n_patients + 1)]
+
+
+def panel_results_csv(
+    panel, n_patients, samples_per_patient, malformed_rate=0.0, derived=0, seed=0
+):
+    """Return a panel results file for all samples of a cohort
+
+    Parameters
+    ----------
+    panel : Panel
+        panel whose parameters are the value columns
+    n_patients : int
+        number of patients in the cohort
+    samples_per_patient : int
+        number of clinical samples per patient
+    malformed_rate : float
+        fraction of numeric cells replaced by text that is not a number
+    derived : int
+        number of unregistered derived (frequency) columns to add, which
+        the upload registers as new parameters
+    seed : int
+        seed for the random values
+
+    Returns
+    -------
+    contents : str
+        CSV contents of the file
+    """
+
+    rng = random.Random(f"{seed}-{panel.name}")
+    parameters = list(
+        Parameter.objects.filter(panel=panel, data_type="PanelNumeric")
+        .order_by("gating_hierarchy")
+        .values_list("gating_hierarchy", flat=True)
+    )
+    parameters += [f"{panel.name}_synthetic_{i}_freq" for i in range(derived)]
+
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(
+        ["batch", "filename"]
+        + parameters
+        + ["Operator name", "Comments", "Date", "Panel", "Clinical_sample"]
+    )
+    for patient_id in patient_ids(n_patients):
+        for sample in range(1, samples_per_patient + 1):
+            sample_id = f"{patient_id}n{sample:02d}"
+            date = datetime.date(2020, 3, 1) + datetime.timedelta(
+                days=rng.randrange(120)
+            )
+            values = [
+                (
+                    rng.choice(MALFORMED_NUMBERS)
+                    if rng.random() < malformed_rate
+                    else round(rng.uniform(0, 10000), 2)
+                )
+                for parameter in parameters
+            ]
+            writer.writerow(
+                [rng.randrange(1, 20), f"{date:%Y%m%d}{panel.name}_{sample_id}.fcs"]
+                + values
+                + [
+                    rng.randrange(1, 6),
+                    rng.choice(["", "", "Test comments"]),
+                    f"{date:%Y%m%d}",
+                    panel.name.lower(),
+                    sample_id,
+                ]
+            )
+    return output.getvalue()
+
+
+def patient_data_csv(n_patients, seed=0):
+    """Return a patient data file for a cohort of n_patients"""
+
+    rng = random.Random(seed)
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(["patient"] + list(PATIENT_COLUMNS))
+    for patient_id in patient_ids(n_patients):
+        writer.writerow(
+            [patient_id] + [rng.choice(choices) for choices in PATIENT_COLUMNS.values()]
+        )
+    return output.getvalue()
+
+
+def cohort_files(
+    n_patients,
+    samples_per_patient,
+    malformed_rate=0.0,
+    derived=0,
+    panels=None,
+    seed=0,
+):
+    """Return the files of a synthetic cohort
+
+    Takes the arguments of panel_results_csv and optionally the names of
+    the panels to generate results for (default all).
+
+    Returns
+    -------
+    files : dict
+        file name -> CSV contents. The patient data file comes first.
+    """
+
+    files = {PATIENT_DATA_FILE: patient_data_csv(n_patients, seed)}
+    queryset = Panel.objects.order_by("name")
+    if panels:
+        queryset = queryset.filter(name__in=[panel.upper() for panel in panels])
+    for panel in queryset:
+        files[f"synthetic_panel_{panel.name}.csv"] = panel_results_csv(
+            panel, n_patients, samples_per_patient, malformed_rate, derived, seed
+        )
+    return files
+
+
+def upload_file(file_name, contents, user, gating_strategy, dry_run=False):
+    """Validate and upload a file of cohort_files() as the upload view does
+
+    Returns
+    -------
+    upload_file : ClinicalSampleFile or PatientFile
+        the uploaded file, whose upload_file has the stored UploadedFile
+    """
+
+    file_contents = SimpleUploadedFile(
+        file_name, contents.encode("utf-8"), content_type="text/csv"
+    )
+    if file_name == PATIENT_DATA_FILE:
+        upload_file = PatientFile(file_name, file_contents, user=user)
+    else:
+        upload_file = ClinicalSampleFile(
+            file_name, file_contents, user=user, gating_strategy=gating_strategy
+        )
+    upload_file.validate()
+    upload_file.upload(dry_run=dry_run)
+    return upload_file
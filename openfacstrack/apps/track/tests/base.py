@@ -0,0 +1,96 @@
+import os
+from django.core.management import call_command
+from django.contrib.auth.models import User
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+
+from openfacstrack.apps.track.utils import ClinicalSampleFile, PatientFile
+from openfacstrack.apps.track.models import GatingStrategy
+
+# Shared set up of the tests that need reference data and uploaded test
+# files
+
+
+class UploadTestMixin:
+    """Create the reference data, user and gating strategy uploads need,
+    upload the test files and remove the uploaded copies afterwards
+
+    Put it before TestCase or TransactionTestCase in the bases.
+    """
+
+    # Get the base directory
+    base_dir = os.path.dirname(os.path.realpath(__file__))
+
+    # Uploaded copies removed by tearDownClass
+    uploaded_files_pattern = "test_pa*.csv"
+
+    @classmethod
+    def setUpReferenceData(cls):
+        # Create gating strategy
+        gating_strategy = GatingStrategy(strategy="Automatically Gated")
+        gating_strategy.save()
+        cls.gating_strategy = gating_strategy
+
+        # Create user needed for tests
+        user = User.objects.create_user(
+            username="test", email="test@test.com", password="test"
+        )
+        user.save()
+        cls.user = user
+
+        # Populate reference data table
+        fpath = os.path.join(
+            cls.base_dir, "test_data", "population_names_20200413.xlsx"
+        )
+        call_command("update_panel_parameter_reference_data", fpath)
+
+    @classmethod
+    def upload_patients(cls):
+        patient_file = PatientFile(
+            file_name="test_patient_data.csv",
+            file_contents=cls._get_uploaded_file("test_patient_data.csv"),
+            user=cls.user,
+        )
+        return patient_file.upload()
+
+    @classmethod
+    def upload_panel_results(cls):
+        fname = "test_panel_data_complete.csv"
+        clinical_sample_file = ClinicalSampleFile(
+            file_name=fname,
+            file_contents=cls._get_uploaded_file(fname),
+            user=cls.user,
+            gating_strategy=cls.gating_strategy,
+        )
+        return clinical_sample_file.upload()
+
+    @classmethod
+    def _get_uploaded_file(cls, fname):
+        """Return django object representing an uploaded file"""
+
+        fpath = os.path.join(cls.base_dir, "test_data", fname)
+        with open(fpath, "rb") as infile:
+            uploaded_file = SimpleUploadedFile(
+                fpath, infile.read(), content_type="text/csv"
+            )
+        return uploaded_file
+
+    @classmethod
+    def tearDownClass(cls):
+        """Remove all files uploaded during tests"""
+
+        fpath = os.path.join(cls.base_dir, "..", "..", "..", "..", "uploads")
+        command = (
+            f'find {fpath} -type f -name "{cls.uploaded_files_pattern}" '
+            + "-exec rm {} \\;"
+        )
+        retval = os.system(command)
+        if retval != 0:
+            message = (
+                "Test files uploaded have not been deleted. "
+                + "Please manually delete. They are located in "
+                + "a subdirectory of the 'uploads' directory"
+            )
+            print("\n\n" + message)
+
+        super().tearDownClass()
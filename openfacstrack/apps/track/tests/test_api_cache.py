@@ -0,0 +1,170 @@
+from unittest import mock
+from django.core.cache import cache
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase, Client
+from django.urls import reverse
+from rest_framework.permissions import IsAuthenticated
+
+from openfacstrack.apps.track import views
+
+from openfacstrack.apps.track.utils import PatientFile
+from openfacstrack.apps.track.caching import get_generation
+from openfacstrack.apps.track.models import Patient
+from openfacstrack.apps.track.tests.base import UploadTestMixin
+
+# Test caching of REST API responses
+
+
+class ApiCacheTest(UploadTestMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.setUpReferenceData()
+
+        cls.upload_panel_results()
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+
+    def test_repeated_request_served_from_cache(self):
+        """A repeated request is answered without querying the database"""
+
+        response = self.client.get(reverse("get_observations"))
+        self.assertEqual(response.status_code, 200)
+
+        with self.assertNumQueries(0):
+            cached_response = self.client.get(reverse("get_observations"))
+        self.assertEqual(cached_response.status_code, 200)
+        self.assertEqual(cached_response.json(), response.json())
+
+    def test_query_parameters_are_part_of_key(self):
+        """Requests with different arguments are cached separately"""
+
+        self.client.get(reverse("get_patients"))
+        with self.assertNumQueries(0):
+            self.client.get(reverse("get_patients"), {"format": "json"})
+        response = self.client.get(
+            reverse("get_patients", kwargs={"pk": "p005"}), {"format": "json"}
+        )
+        self.assertEqual(response.json()["patient_id"], "p005")
+
+    def test_upload_invalidates_cache(self):
+        """Committing an upload means cached responses are no longer used"""
+
+        response = self.client.get(reverse("get_patients"))
+        self.assertEqual(len(response.json()), 2)
+
+        # A dry run does not change the data
+        patient_file = PatientFile(
+            file_name="test_patient_data.csv",
+            file_contents=self._get_uploaded_file("test_patient_data.csv"),
+            user=self.user,
+        )
+        patient_file.upload(dry_run=True)
+        with self.assertNumQueries(0):
+            self.client.get(reverse("get_patients"))
+
+        patient_file.upload()
+        response = self.client.get(reverse("get_patients"))
+        self.assertEqual(len(response.json()), 3)
+
+    def test_conditional_get_not_modified(self):
+        """A request with a current ETag gets 304 without any queries"""
+
+        for url in [reverse("get_all_data"), reverse("export")]:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertIn("Last-Modified", response)
+            etag = response["ETag"]
+            self.assertFalse(etag.startswith("W/"))
+
+            with self.assertNumQueries(0):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+
+            response = self.client.get(
+                url, HTTP_IF_MODIFIED_SINCE=response["Last-Modified"]
+            )
+            self.assertEqual(response.status_code, 304)
+
+    def test_not_modified_checks_permissions(self):
+        """Conditional requests are authenticated before a 304 is sent"""
+
+        etag = self.client.get(reverse("get_patients"))["ETag"]
+        with mock.patch.object(
+            views.get_patients.cls, "permission_classes", [IsAuthenticated]
+        ):
+            response = self.client.get(reverse("get_patients"), HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 403)
+            self.client.force_login(self.user)
+            response = self.client.get(reverse("get_patients"), HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+
+    def test_export_etag_depends_on_encoding(self):
+        """The plain and gzip exports have different ETags"""
+
+        response = self.client.get(reverse("export"))
+        self.assertIn("Accept-Encoding", response["Vary"])
+        etag = response["ETag"]
+        response = self.client.get(
+            reverse("export"), HTTP_ACCEPT_ENCODING="gzip", HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_etag_changes_after_upload(self):
+        """A committed upload changes the ETag so clients fetch the new data"""
+
+        etag = self.client.get(reverse("get_patients"))["ETag"]
+        patient_file = PatientFile(
+            file_name="test_patient_data.csv",
+            file_contents=self._get_uploaded_file("test_patient_data.csv"),
+            user=self.user,
+        )
+        patient_file.upload()
+
+        response = self.client.get(reverse("get_patients"), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+
+class ApiCacheInvalidationTest(TransactionTestCase):
+    """Writes outside the upload pipeline (e.g. admin edits) must also
+    invalidate cached responses - on commit, so TestCase cannot be used"""
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+
+    def test_orm_writes_invalidate_cache(self):
+        """Saving or deleting rows changes cached responses and ETags"""
+
+        patient = Patient.objects.create(patient_id="p001")
+        response = self.client.get(reverse("get_patients"))
+        self.assertEqual(len(response.json()), 1)
+        etag = response["ETag"]
+
+        Patient.objects.create(patient_id="p002")
+        response = self.client.get(reverse("get_patients"), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 2)
+
+        patient.delete()
+        response = self.client.get(reverse("get_patients"))
+        self.assertEqual(len(response.json()), 1)
+
+    def test_one_bump_per_transaction(self):
+        """The generation is bumped once, when the transaction commits"""
+
+        generation = get_generation()
+        with transaction.atomic():
+            for i in range(3):
+                Patient.objects.create(patient_id=f"p00{i}")
+            self.assertEqual(get_generation(), generation)
+        self.assertEqual(get_generation(), generation + 1)
+
+        # Nothing is bumped for a rolled back transaction
+        with transaction.atomic():
+            Patient.objects.create(patient_id="p010")
+            transaction.set_rollback(True)
+        self.assertEqual(get_generation(), generation + 1)
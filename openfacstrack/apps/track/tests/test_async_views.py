@@ -0,0 +1,66 @@
+import shutil
+import tempfile
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.test import TransactionTestCase, AsyncClient, Client, override_settings
+from django.urls import path
+
+from openfacstrack.apps.track import async_views, views
+from openfacstrack.apps.track.tests.base import UploadTestMixin
+
+# Test the async versions of the read-heavy views. These run the views in
+# worker threads with database connections of their own, so the uploaded
+# data has to be committed - hence TransactionTestCase.
+
+urlpatterns = [
+    path("sync/observations/", views.get_observations),
+    path("sync/alldata/", views.get_all_data),
+    path("sync/export/", views.export_view),
+    path("async/observations/", async_views.get_observations),
+    path("async/alldata/", async_views.get_all_data),
+    path("async/export/", async_views.export_view),
+]
+
+
+@override_settings(ROOT_URLCONF=__name__)
+class AsyncViewsTest(UploadTestMixin, TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.snapshot_dir = tempfile.mkdtemp()
+        self.settings_override = override_settings(
+            EXPORT_SNAPSHOT_DIR=self.snapshot_dir, EXPORT_SNAPSHOT_BACKGROUND=False
+        )
+        self.settings_override.enable()
+
+        self.setUpReferenceData()
+        self.upload_panel_results()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.snapshot_dir)
+
+    def test_async_api_views_match_sync_views(self):
+        """The async API views return the same data as the sync views"""
+
+        for endpoint in ["observations/", "alldata/", "observations/?format=ndjson"]:
+            async_response = self._async_get("/async/" + endpoint)
+            self.assertEqual(async_response.status_code, 200)
+            self.assertIn("ETag", async_response)
+            sync_response = Client().get("/sync/" + endpoint)
+            self.assertEqual(async_response.content, sync_response.content)
+
+    def test_async_export_streams_snapshot(self):
+        """The async export streams the snapshot written by the upload"""
+
+        response = self._async_get("/async/export/")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        content = b"".join(response.streaming_content)
+        sync_response = Client().get("/sync/export/")
+        self.assertEqual(content, b"".join(sync_response.streaming_content))
+
+    @async_to_sync
+    async def _async_get(self, path):
+        """Request path from the async views as an ASGI server would"""
+
+        return await AsyncClient().get(path)
@@ -0,0 +1,187 @@
+import datetime
+import io
+from unittest import mock
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase, Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from openfacstrack.apps.track.changes import FEED_MODELS
+from openfacstrack.apps.track.models import (
+    DeletionLog,
+    NumericValue,
+    Patient,
+    ProcessedSample,
+    Result,
+)
+from openfacstrack.apps.track.tests.base import UploadTestMixin
+
+# Test the change feed used for incremental sync
+
+
+@override_settings(CHANGE_FEED_LAG_SECONDS=0)
+class ChangeFeedTest(UploadTestMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.setUpReferenceData()
+
+        cls.upload_patients()
+        cls.upload_panel_results()
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+
+    def test_pages_cover_all_rows_once(self):
+        """Paging through the feed lists every row exactly once, in order"""
+
+        changes, cursor = self._read_feed({"limit": 7})
+        expected = {
+            (model._meta.model_name, pk)
+            for model in FEED_MODELS
+            for pk in model.objects.values_list("pk", flat=True)
+        }
+        listed = [(change["model"], change["id"]) for change in changes]
+        self.assertEqual(len(listed), len(expected))
+        self.assertEqual(set(listed), expected)
+        modified = [change["modified"] for change in changes]
+        self.assertEqual(modified, sorted(modified))
+
+        # Nothing new since the last page
+        response = self.client.get(reverse("get_changes"), {"cursor": cursor})
+        self.assertEqual(response.json()["changes"], [])
+        self.assertEqual(response.json()["next_cursor"], cursor)
+
+    def test_only_changes_after_cursor(self):
+        """Polling with the last cursor lists only rows changed since"""
+
+        _, cursor = self._read_feed({"limit": 1000})
+        value = NumericValue.objects.first()
+        value.value = 1234.5
+        value.save()
+
+        cache.clear()
+        changes, _ = self._read_feed({"cursor": cursor})
+        self.assertEqual(len(changes), 1)
+        self.assertEqual(changes[0]["model"], "numericvalue")
+        self.assertEqual(changes[0]["id"], value.pk)
+        self.assertEqual(changes[0]["data"]["value"], 1234.5)
+
+        response = self.client.get(
+            reverse("get_changes"), {"since": "2100-01-01T00:00:00Z"}
+        )
+        self.assertEqual(response.json()["changes"], [])
+
+    @override_settings(CHANGE_FEED_LAG_SECONDS=60)
+    def test_late_commit_not_skipped(self):
+        """A row committed after a poll with an earlier modified time than
+        rows written before the poll is still listed"""
+
+        now = timezone.now()
+        for model in FEED_MODELS:
+            model.objects.update(modified=now - datetime.timedelta(hours=1))
+        first, second = NumericValue.objects.order_by("pk")[:2]
+        NumericValue.objects.filter(pk=second.pk).update(
+            modified=now - datetime.timedelta(seconds=5)
+        )
+        changes, cursor = self._read_feed({"limit": 1000})
+        listed = [(change["model"], change["id"]) for change in changes]
+        self.assertNotIn(("numericvalue", second.pk), listed)
+
+        # Written by an upload that started earlier but commits after the poll
+        NumericValue.objects.filter(pk=first.pk).update(
+            modified=now - datetime.timedelta(seconds=10)
+        )
+        with mock.patch(
+            "django.utils.timezone.now",
+            return_value=now + datetime.timedelta(seconds=60),
+        ):
+            changes, _ = self._read_feed({"cursor": cursor})
+        self.assertEqual(
+            [(change["model"], change["id"]) for change in changes],
+            [("numericvalue", first.pk), ("numericvalue", second.pk)],
+        )
+
+    def test_deletions_listed(self):
+        """Deleted rows, including cascaded deletes, are listed as deletions"""
+
+        _, cursor = self._read_feed({"limit": 1000})
+        result = Result.objects.first()
+        value_ids = set(
+            NumericValue.objects.filter(result=result).values_list("pk", flat=True)
+        )
+        result_id = result.pk
+        result.delete()
+
+        cache.clear()
+        changes, _ = self._read_feed({"cursor": cursor})
+        self.assertTrue(all(change["operation"] == "delete" for change in changes))
+        deleted = {(change["model"], change["id"]) for change in changes}
+        self.assertIn(("result", result_id), deleted)
+        self.assertTrue({("numericvalue", pk) for pk in value_ids} <= deleted)
+
+    def test_prune_deletion_log(self):
+        """Entries older than the retention period are pruned"""
+
+        NumericValue.objects.first().delete()
+        NumericValue.objects.last().delete()
+        DeletionLog.objects.filter(pk=DeletionLog.objects.first().pk).update(
+            modified=timezone.now() - datetime.timedelta(days=100)
+        )
+        out = io.StringIO()
+        call_command("prune_deletion_log", "--days", "90", stdout=out)
+        self.assertEqual(DeletionLog.objects.count(), 1)
+        self.assertIn("Deleted 1 deletion log entries", out.getvalue())
+
+    def test_invalid_arguments(self):
+        """Bad cursors and page sizes are rejected"""
+
+        for params in [{"cursor": "abc"}, {"limit": 0}, {"since": "today"}]:
+            response = self.client.get(reverse("get_changes"), params)
+            self.assertEqual(response.status_code, 400)
+
+    def _read_feed(self, params):
+        """Return all changes in the feed and the final cursor"""
+
+        changes = []
+        while True:
+            response = self.client.get(reverse("get_changes"), params)
+            self.assertEqual(response.status_code, 200)
+            page = response.json()
+            changes += page["changes"]
+            params = dict(params, cursor=page["next_cursor"])
+            if not page["has_more"]:
+                return changes, page["next_cursor"]
+
+
+@override_settings(CHANGE_FEED_LAG_SECONDS=0)
+class ChangeFeedPollingTest(TransactionTestCase):
+    """Polling must see deletes and edits made outside uploads"""
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+
+    def test_deletion_reaches_poll(self):
+        """A poll with an unchanged cursor lists a row deleted since"""
+
+        patient = Patient.objects.create(patient_id="p001")
+        sample = ProcessedSample.objects.create(
+            clinical_sample_id="s001", patient=patient, biobank_id="b001"
+        )
+        response = self.client.get(reverse("get_changes"))
+        cursor = response.json()["next_cursor"]
+        response = self.client.get(reverse("get_changes"), {"cursor": cursor})
+        self.assertEqual(response.json()["changes"], [])
+
+        sample_id = sample.pk
+        sample.delete()
+        response = self.client.get(reverse("get_changes"), {"cursor": cursor})
+        self.assertEqual(response.status_code, 200)
+        changes = response.json()["changes"]
+        self.assertEqual(len(changes), 1)
+        self.assertEqual(changes[0]["operation"], "delete")
+        self.assertEqual(
+            (changes[0]["model"], changes[0]["id"]), ("processedsample", sample_id)
+        )
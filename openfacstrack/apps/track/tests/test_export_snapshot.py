@@ -0,0 +1,100 @@
+import gzip
+import os
+import shutil
+import tempfile
+from unittest import mock
+from django.core.cache import cache
+from django.test import TestCase, Client, override_settings
+from django.urls import reverse
+
+from openfacstrack.apps.track.export import current_snapshot_path, export_json
+from openfacstrack.apps.track.tests.base import UploadTestMixin
+
+# Test precomputed export snapshots
+
+
+class ExportSnapshotTest(UploadTestMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.setUpReferenceData()
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.snapshot_dir = tempfile.mkdtemp()
+        self.settings_override = override_settings(
+            EXPORT_SNAPSHOT_DIR=self.snapshot_dir, EXPORT_SNAPSHOT_BACKGROUND=False
+        )
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.snapshot_dir)
+
+    def test_snapshot_written_after_upload(self):
+        """A committed upload writes a snapshot which the export serves"""
+
+        self.assertIsNone(current_snapshot_path())
+        self.upload_panel_results()
+        snapshot = current_snapshot_path()
+        self.assertIsNotNone(snapshot)
+        self.assertEqual(len(os.listdir(self.snapshot_dir)), 2)
+
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse("export"))
+        self.assertEqual(response.status_code, 200)
+        content = b"".join(response.streaming_content)
+        self.assertEqual(content.decode("utf-8"), export_json())
+
+        # Clients accepting gzip get the compressed snapshot
+        response = self.client.get(reverse("export"), HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(b"".join(response.streaming_content)), content)
+
+        # The next upload replaces the snapshot
+        self.upload_patients()
+        self.assertNotEqual(current_snapshot_path(), snapshot)
+        self.assertEqual(len(os.listdir(self.snapshot_dir)), 2)
+
+    def test_export_without_snapshot(self):
+        """Without a snapshot the export is built and a snapshot scheduled"""
+
+        response = self.client.get(reverse("export"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content.decode("utf-8"), export_json())
+        self.assertIsNotNone(current_snapshot_path())
+
+    def test_snapshot_removed_before_opened(self):
+        """A snapshot removed after it was found is built instead"""
+
+        removed = os.path.join(self.snapshot_dir, "export-0.json")
+        with mock.patch(
+            "openfacstrack.apps.track.views.current_snapshot_path",
+            return_value=removed,
+        ):
+            response = self.client.get(reverse("export"), HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("Content-Encoding", response)
+        self.assertEqual(response.content.decode("utf-8"), export_json())
+
+    @override_settings(EXPORT_SNAPSHOT_ACCEL_REDIRECT="/protected/exports/")
+    def test_snapshot_sent_by_nginx(self):
+        """With X-Accel-Redirect configured the snapshot is left to nginx"""
+
+        self.upload_panel_results()
+        response = self.client.get(reverse("export"))
+        self.assertEqual(
+            response["X-Accel-Redirect"],
+            "/protected/exports/" + os.path.basename(current_snapshot_path()),
+        )
+        self.assertEqual(response.content, b"")
+
+        # Compression is left to nginx's gzip_static, as nginx would drop a
+        # Content-Encoding header set here
+        self.assertIsNotNone(current_snapshot_path(compressed=True))
+        response = self.client.get(reverse("export"), HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(
+            response["X-Accel-Redirect"],
+            "/protected/exports/" + os.path.basename(current_snapshot_path()),
+        )
+        self.assertNotIn("Content-Encoding", response)
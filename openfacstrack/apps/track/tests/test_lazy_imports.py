@@ -0,0 +1,35 @@
+import os
+import subprocess
+import sys
+from django.conf import settings
+from django.test import SimpleTestCase
+
+# Test that pandas is only imported when an upload needs it
+
+
+class LazyImportTest(SimpleTestCase):
+    def test_startup_does_not_import_pandas(self):
+        """Loading the URLconf, views, middleware and admin leaves pandas out"""
+
+        code = "\n".join(
+            [
+                "import os, sys",
+                "import django",
+                "django.setup()",
+                "from django.urls import get_resolver",
+                "get_resolver().url_patterns",
+                "import django.contrib.admin",
+                "import openfacstrack.apps.track.async_views",
+                "import openfacstrack.apps.track.middleware",
+                "print(sorted(m for m in ('pandas', 'numpy') if m in sys.modules))",
+            ]
+        )
+        output = subprocess.run(
+            [sys.executable, "-c", code],
+            capture_output=True,
+            check=True,
+            cwd=settings.BASE_DIR,
+            env=dict(os.environ, DJANGO_SETTINGS_MODULE="openfacstrack.settings"),
+            text=True,
+        ).stdout
+        self.assertEqual(output.strip(), "[]")
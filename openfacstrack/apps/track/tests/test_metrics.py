@@ -0,0 +1,164 @@
+import json
+import os
+import re
+import subprocess
+import sys
+from unittest import mock
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.test import TestCase, AsyncClient, Client, override_settings
+from django.urls import reverse
+
+from openfacstrack.apps.track.metrics import (
+    clear_metrics,
+    increment,
+    render_metrics,
+)
+
+# Test the request metrics middleware and metrics endpoint
+
+
+class MetricsTest(TestCase):
+    def setUp(self):
+        clear_metrics()
+        self.client = Client()
+
+    def test_requests_recorded_per_view(self):
+        """Requests add to the totals of their view"""
+
+        self.client.get(reverse("get_patients"))
+        self.client.get(reverse("get_patients") + "?fields=patient_id")
+        with self.settings(TRACK_METRICS_TOKEN="secret"):
+            response = self.client.get(
+                reverse("metrics"), HTTP_AUTHORIZATION="Bearer secret"
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+
+        metrics = self._parse(response.content.decode("utf-8"))
+        labels = '{view="get_patients"}'
+        self.assertEqual(metrics["track_requests_total" + labels], 2)
+        self.assertGreater(metrics["track_db_queries_total" + labels], 0)
+        self.assertGreater(metrics["track_db_duration_seconds_total" + labels], 0)
+        self.assertGreater(
+            metrics["track_serialization_duration_seconds_total" + labels], 0
+        )
+        self.assertGreater(metrics["track_response_bytes_total" + labels], 0)
+        self.assertNotIn("track_slow_requests_total" + labels, metrics)
+
+    @override_settings(TRACK_SLOW_REQUEST_QUERIES=0)
+    def test_slow_requests_logged(self):
+        """Requests over a threshold are logged and counted"""
+
+        with self.assertLogs("openfacstrack.apps.track.middleware", "WARNING") as logs:
+            self.client.get(reverse("get_samples"))
+        self.assertIn("Slow request GET /track/api/v1/samples/", logs.output[0])
+        metrics = self._parse(render_metrics())
+        self.assertEqual(metrics['track_slow_requests_total{view="get_samples"}'], 1)
+
+    @override_settings(DEBUG=True)
+    def test_asgi_requests_recorded(self):
+        """Under ASGI requests are recorded without adapting the middleware,
+        with the serializer data timed and queries left uncounted"""
+
+        with mock.patch("django.core.handlers.base.logger") as handler_logger:
+            response = async_to_sync(AsyncClient().get)(reverse("get_patients"))
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(
+            any("MetricsMiddleware" in str(call) for call in handler_logger.mock_calls)
+        )
+        metrics = self._parse(render_metrics())
+        labels = '{view="get_patients"}'
+        self.assertEqual(metrics["track_requests_total" + labels], 1)
+        self.assertGreater(
+            metrics["track_serialization_duration_seconds_total" + labels], 0
+        )
+        self.assertNotIn("track_db_queries_total" + labels, metrics)
+
+    def test_serializer_data_timed(self):
+        """Serialization time includes the serializer data built by the view,
+        not only the rendering"""
+
+        with mock.patch(
+            "openfacstrack.apps.track.serializers.add_serialization_time"
+        ) as add_serialization_time:
+            self.client.get(reverse("get_observations"))
+        add_serialization_time.assert_called_once()
+
+    @override_settings(TRACK_METRICS=False)
+    def test_metrics_disabled(self):
+        """Nothing is recorded when metrics are disabled"""
+
+        self.client.get(reverse("get_patients"))
+        self.assertEqual(render_metrics(), "\n")
+
+    def test_label_values_escaped(self):
+        """Label values are escaped in the text format"""
+
+        increment("track_requests_total", {"view": 'a"b'})
+        self.assertIn('track_requests_total{view="a\\"b"} 1', render_metrics())
+
+    def test_exited_processes_counted(self):
+        """Counters written by processes that have exited are kept"""
+
+        process = subprocess.Popen([sys.executable, "-c", "pass"])
+        process.wait()
+        path = os.path.join(
+            settings.TRACK_METRICS_DIR, f"metrics-{process.pid}-test.json"
+        )
+        with open(path, "w") as outfile:
+            json.dump([["track_requests_total", [["view", "home"]], 3]], outfile)
+        increment("track_requests_total", {"view": "home"})
+
+        metrics = self._parse(render_metrics())
+        self.assertEqual(metrics['track_requests_total{view="home"}'], 4)
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(self._parse(render_metrics()), metrics)
+
+    @override_settings(TRACK_METRICS_DIR="")
+    def test_process_counters_without_directory(self):
+        """Without a metrics directory the process's own counters are served"""
+
+        increment("track_requests_total", {"view": "home"}, 2)
+        metrics = self._parse(render_metrics())
+        self.assertEqual(metrics['track_requests_total{view="home"}'], 2)
+
+    def test_local_requests_not_trusted(self):
+        """Requests proxied by nginx come from 127.0.0.1, so that address
+        gets no access by default"""
+
+        response = self.client.get(reverse("metrics"), REMOTE_ADDR="127.0.0.1")
+        self.assertEqual(response.status_code, 403)
+
+    @override_settings(TRACK_METRICS_ALLOWED_IPS=["10.0.0.1"])
+    def test_metrics_restricted(self):
+        """Only staff users, the token and allowed addresses can fetch the
+        metrics"""
+
+        response = self.client.get(reverse("metrics"))
+        self.assertEqual(response.status_code, 403)
+        response = self.client.get(reverse("metrics"), REMOTE_ADDR="10.0.0.1")
+        self.assertEqual(response.status_code, 200)
+        with self.settings(TRACK_METRICS_TOKEN="secret"):
+            response = self.client.get(
+                reverse("metrics"), HTTP_AUTHORIZATION="Bearer wrong"
+            )
+            self.assertEqual(response.status_code, 403)
+            response = self.client.get(
+                reverse("metrics"), HTTP_AUTHORIZATION="Bearer secret"
+            )
+            self.assertEqual(response.status_code, 200)
+        self.client.force_login(
+            User.objects.create_user(username="staff", password="test", is_staff=True)
+        )
+        response = self.client.get(reverse("metrics"))
+        self.assertEqual(response.status_code, 200)
+
+    def _parse(self, text):
+        """Return {series: value} of the samples in the text format"""
+
+        return {
+            series: float(value)
+            for series, value in re.findall(r"^([^#\s]\S*) (\S+)$", text, re.M)
+        }
@@ -0,0 +1,105 @@
+import datetime
+from django.core.cache import cache
+from django.test import TestCase, Client
+from django.urls import reverse
+
+from openfacstrack.apps.track.models import (
+    DateValue,
+    NumericValue,
+    Result,
+    TextValue,
+)
+from openfacstrack.apps.track.tests.base import UploadTestMixin
+
+# Test filtering observations in the REST API
+
+
+class ObservationFilterTest(UploadTestMixin, TestCase):
+    uploaded_files_pattern = "test_panel*.csv"
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.setUpReferenceData()
+
+        cls.upload_panel_results()
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+
+    def test_filter_by_panel_and_upload(self):
+        """Results can be selected by panel, gating strategy and upload"""
+
+        n_results = Result.objects.count()
+        self.assertEqual(len(self._get({"panel": "p5"})), n_results)
+        self.assertEqual(self._get({"panel": "p1,p2"}), [])
+        self.assertEqual(
+            len(self._get({"gating_strategy": "Automatically Gated"})), n_results
+        )
+        uploaded_file = Result.objects.first().uploaded_file
+        for name in [uploaded_file.name, str(uploaded_file.pk)]:
+            self.assertEqual(len(self._get({"uploaded_file": name})), n_results)
+        self.assertEqual(self._get({"uploaded_file": "other.csv"}), [])
+
+    def test_filter_by_date_processed(self):
+        """Results can be selected by the date the panel was processed"""
+
+        results = self._get({"date_processed_from": "2020-04-01"})
+        self.assertEqual(
+            [result["fcs_file_name"] for result in results],
+            ["20200410p5_p033n01_002.fcs"],
+        )
+        results = self._get(
+            {"date_processed_from": "2020-03-01", "date_processed_to": "2020-03-31"}
+        )
+        self.assertEqual(
+            [result["fcs_file_name"] for result in results],
+            ["20200327p5_p005n01_020.fcs"],
+        )
+
+        response = self.client.get(
+            reverse("get_observations"), {"date_processed_from": "March"}
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_filter_by_parameter(self):
+        """Only values of the selected parameter are returned"""
+
+        parameter = NumericValue.objects.first().parameter
+        for name in [parameter.public_name, parameter.gating_hierarchy]:
+            results = self._get({"parameter": name})
+            self.assertGreater(len(results), 0)
+            for result in results:
+                self.assertEqual(
+                    {value["parameter"] for value in result["numeric_values"]},
+                    {parameter.public_name},
+                )
+                self.assertEqual(result["text_values"], [])
+
+    def test_filter_by_modified_since(self):
+        """Only results changed since the given time are returned"""
+
+        yesterday = datetime.date.today() - datetime.timedelta(days=1)
+        results = self._get({"modified_since": yesterday.isoformat()})
+        self.assertEqual(len(results), Result.objects.count())
+        self.assertEqual(self._get({"modified_since": "2100-01-01T00:00:00Z"}), [])
+
+        # A changed value marks its result as changed
+        long_ago = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+        value = NumericValue.objects.first()
+        for model in [Result, NumericValue, TextValue, DateValue]:
+            model.objects.exclude(
+                pk=value.pk if model is NumericValue else None
+            ).update(modified=long_ago)
+        cache.clear()
+        results = self._get({"modified_since": "2020-06-01"})
+        self.assertEqual(len(results), 1)
+        self.assertEqual(
+            results[0]["clinical_sample_id"],
+            value.result.processed_sample.clinical_sample_id,
+        )
+
+    def _get(self, params):
+        response = self.client.get(reverse("get_observations"), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
@@ -0,0 +1,192 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from django.core.management import call_command
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.contrib.auth.models import User
+
+from openfacstrack.apps.track.models import (
+    DateValue,
+    NumericValue,
+    Result,
+    TextValue,
+)
+from openfacstrack.apps.track.partitioning import (
+    VALUE_TABLES,
+    is_partitioned,
+    partition_ranges,
+    partition_value_tables,
+    unpartition_value_tables,
+)
+
+# Test range partitioning of the value tables
+
+
+class PartitioningTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        # Create user needed for tests
+        user = User.objects.create_user(
+            username="test", email="test@test.com", password="test"
+        )
+        user.save()
+
+        # Populate reference data table
+        fpath = os.path.join(
+            os.path.dirname(os.path.realpath(__file__)),
+            "test_data",
+            "population_names_20200413.xlsx",
+        )
+        call_command("update_panel_parameter_reference_data", fpath)
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(
+            MEDIA_ROOT=self.media_root, EXPORT_SNAPSHOT_DIR=""
+        )
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root)
+
+    @override_settings(TRACK_PARTITION_VALUES=True)
+    def test_command_without_postgres(self):
+        """Other databases keep the plain tables"""
+
+        if connection.vendor == "postgresql":
+            self.skipTest("Partitioning is supported on PostgreSQL")
+        output = io.StringIO()
+        call_command("ensure_value_partitions", stdout=output)
+        self.assertIn("not partitioned", output.getvalue())
+
+    @unittest.skipUnless(connection.vendor == "postgresql", "PostgreSQL only")
+    @override_settings(TRACK_PARTITION_VALUES=True)
+    def test_partitioned_upload(self):
+        """Uploads write to partitioned tables and values move out of the
+        default partition as partitions are added"""
+
+        _upload(n_patients=1, seed=0)
+        counts = _counts()
+        # A few partitions - ids are not reset between tests
+        partition_size = Result.objects.latest("id").id // 4 + 1
+        with self.settings(TRACK_VALUE_PARTITION_SIZE=partition_size):
+            partition_value_tables(connection)
+            with connection.cursor() as cursor:
+                for table in VALUE_TABLES:
+                    self.assertTrue(is_partitioned(cursor, table))
+            self.assertEqual(_counts(), counts)
+
+            # Results past the last partition go to the default partition
+            # until ensure_value_partitions adds partitions for them
+            _upload(n_patients=4, seed=0)
+            counts = _counts()
+            call_command("ensure_value_partitions", stdout=io.StringIO())
+        self.assertEqual(_counts(), counts)
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT count(*) FROM track_numericvalue_default")
+            self.assertEqual(cursor.fetchone()[0], 0)
+            ranges = partition_ranges(cursor, "track_numericvalue")
+        self.assertEqual(ranges[0][1], 0)
+        for (_, _, upper), (_, lower, _) in zip(ranges, ranges[1:]):
+            self.assertEqual(upper, lower)
+        self.assertGreater(ranges[-1][2], Result.objects.latest("id").id)
+
+        unpartition_value_tables(connection)
+        with connection.cursor() as cursor:
+            self.assertFalse(is_partitioned(cursor, "track_numericvalue"))
+        self.assertEqual(_counts(), counts)
+
+
+@unittest.skipUnless(connection.vendor == "postgresql", "PostgreSQL only")
+class PartitionMigrationTest(TransactionTestCase):
+    """Run the partitioning migration forwards and backwards on tables
+    with data in them"""
+
+    def setUp(self):
+        User.objects.create_user(username="test", password="test")
+        fpath = os.path.join(
+            os.path.dirname(os.path.realpath(__file__)),
+            "test_data",
+            "population_names_20200413.xlsx",
+        )
+        call_command("update_panel_parameter_reference_data", fpath)
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(
+            MEDIA_ROOT=self.media_root, EXPORT_SNAPSHOT_DIR=""
+        )
+        self.settings_override.enable()
+
+    def tearDown(self):
+        # Leave the plain tables and the migration state other tests expect
+        with connection.cursor() as cursor:
+            if is_partitioned(cursor, "track_numericvalue"):
+                self._migrate("0009_uploadtiming")
+        self._migrate("0010_partition_value_tables")
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root)
+
+    @override_settings(TRACK_PARTITION_VALUES=True)
+    def test_migration_round_trip(self):
+        """The migration partitions the tables, ensure_value_partitions
+        keeps adding partitions and migrating back restores plain tables,
+        with all values kept"""
+
+        _upload(n_patients=2, seed=0)
+        counts = _counts()
+        partition_size = Result.objects.latest("id").id // 2 + 1
+        with self.settings(TRACK_VALUE_PARTITION_SIZE=partition_size):
+            self._migrate("0009_uploadtiming")
+            self._migrate("0010_partition_value_tables")
+            with connection.cursor() as cursor:
+                for table in VALUE_TABLES:
+                    self.assertTrue(is_partitioned(cursor, table))
+                    cursor.execute(f"SELECT count(*) FROM {table}_default")
+                    self.assertEqual(cursor.fetchone()[0], 0)
+            self.assertEqual(_counts(), counts)
+
+            # New results past the partitions go to the default partition
+            # until ensure_value_partitions runs
+            _upload(n_patients=6, seed=1)
+            counts = _counts()
+            call_command("ensure_value_partitions", stdout=io.StringIO())
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT count(*) FROM track_numericvalue_default")
+                self.assertEqual(cursor.fetchone()[0], 0)
+                ranges = partition_ranges(cursor, "track_numericvalue")
+            self.assertGreater(ranges[-1][2], Result.objects.latest("id").id)
+            self.assertEqual(_counts(), counts)
+
+        self._migrate("0009_uploadtiming")
+        with connection.cursor() as cursor:
+            for table in VALUE_TABLES:
+                self.assertFalse(is_partitioned(cursor, table))
+        self.assertEqual(_counts(), counts)
+        # Ids keep coming from the same sequence
+        _upload(n_patients=7, seed=2)
+        self.assertGreater(_counts()[0], counts[0])
+
+    def _migrate(self, name):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate([("track", name)])
+
+
+def _upload(n_patients, seed):
+    call_command(
+        "generate_synthetic_data",
+        f"--patients={n_patients}",
+        "--samples-per-patient=2",
+        "--panels=p1",
+        f"--seed={seed}",
+        "--upload=test",
+        stdout=io.StringIO(),
+    )
+
+
+def _counts():
+    return [model.objects.count() for model in [NumericValue, TextValue, DateValue]]
@@ -0,0 +1,107 @@
+import json
+import os
+import pstats
+import shutil
+import tempfile
+from unittest import mock
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.test import TestCase, AsyncClient, Client, override_settings
+from django.urls import reverse
+
+# Test on-demand profiling of requests
+
+
+class ProfilingTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user(
+            username="staff", password="test", is_staff=True
+        )
+        cls.user = User.objects.create_user(username="test", password="test")
+
+    def setUp(self):
+        self.profile_dir = tempfile.mkdtemp()
+        self.settings_override = override_settings(
+            TRACK_PROFILE_DIR=self.profile_dir, API_CACHE_TIMEOUT=0
+        )
+        self.settings_override.enable()
+        self.client = Client()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.profile_dir)
+
+    def test_staff_request_profiled(self):
+        """?profile=1 writes the cProfile stats and SQL log of the request"""
+
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse("get_patients") + "?profile=1")
+        self.assertEqual(response.status_code, 200)
+        name = response["X-Track-Profile"]
+        self.assertIn("GET-get_patients", name)
+
+        path = os.path.join(self.profile_dir, name)
+        stats = pstats.Stats(path + ".prof")
+        self.assertTrue(
+            any(function == "get_patients" for _, _, function in stats.stats)
+        )
+        with open(path + ".sql.json") as f:
+            sql_log = json.load(f)
+        self.assertGreater(sql_log["query_count"], 0)
+        self.assertEqual(sql_log["query_count"], len(sql_log["queries"]))
+        self.assertTrue(any("track_patient" in q["sql"] for q in sql_log["queries"]))
+
+        # Profiles are served to staff only
+        response = self.client.get(
+            reverse("profile", kwargs={"file_name": name + ".sql.json"})
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(b"".join(response.streaming_content)), sql_log)
+        self.client.force_login(self.user)
+        response = self.client.get(
+            reverse("profile", kwargs={"file_name": name + ".sql.json"})
+        )
+        self.assertEqual(response.status_code, 302)
+
+    def test_header_requests_profile(self):
+        """The X-Track-Profile header works as ?profile=1"""
+
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse("get_samples"), HTTP_X_TRACK_PROFILE="1")
+        self.assertIn("X-Track-Profile", response)
+
+    def test_only_staff_profiled(self):
+        """Anonymous and non-staff users cannot profile requests"""
+
+        response = self.client.get(reverse("get_patients") + "?profile=1")
+        self.assertNotIn("X-Track-Profile", response)
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("get_patients") + "?profile=1")
+        self.assertNotIn("X-Track-Profile", response)
+        self.assertEqual(os.listdir(self.profile_dir), [])
+
+    @override_settings(DEBUG=True)
+    def test_asgi_requests_passed_on(self):
+        """Under ASGI requests are served unprofiled, without adapting the
+        middleware"""
+
+        client = AsyncClient()
+        client.force_login(self.staff)
+        with mock.patch("django.core.handlers.base.logger") as handler_logger:
+            response = async_to_sync(client.get)(reverse("get_patients") + "?profile=1")
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("X-Track-Profile", response)
+        self.assertFalse(
+            any(
+                "ProfilingMiddleware" in str(call) for call in handler_logger.mock_calls
+            )
+        )
+
+    @override_settings(TRACK_PROFILING=False)
+    def test_profiling_disabled(self):
+        """Nothing is profiled when profiling is disabled"""
+
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse("get_patients") + "?profile=1")
+        self.assertNotIn("X-Track-Profile", response)
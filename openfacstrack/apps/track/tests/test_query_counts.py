@@ -0,0 +1,152 @@
+import json
+import os
+import shutil
+import tempfile
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.contrib.auth.models import User
+
+from openfacstrack.apps.track.models import (
+    GatingStrategy,
+    Patient,
+    ProcessedSample,
+    Result,
+)
+from openfacstrack.apps.track.synthetic import cohort_files, upload_file
+
+# Test that the number of queries each view runs does not grow with the
+# amount of data, so N+1 query patterns fail the tests
+
+# Every view in views.py and every route in urls.py as (url name, kwargs,
+# query string)
+VIEWS = [
+    ("home", {}, ""),
+    ("upload", {}, ""),
+    ("samples", {}, ""),
+    ("observations", {}, ""),
+    ("observations", {}, "?patient={patient}"),
+    ("panels", {}, ""),
+    ("login", {}, ""),
+    ("export", {}, ""),
+    ("metrics", {}, ""),
+    ("get_patients", {}, ""),
+    ("get_patients", {"pk": "p0001"}, ""),
+    ("get_patients", {}, "?fields=patient_id,patient_metadata"),
+    ("get_samples", {}, ""),
+    ("get_samples", {"pk": "p0001"}, ""),
+    ("get_samples_by_clinical_sample_id", {"pk": "p0001n01"}, ""),
+    ("get_observations", {}, ""),
+    ("get_observations", {"pk": "p0001"}, ""),
+    ("get_observations", {}, "?layout=normalized&parameter=P5_batch"),
+    ("get_observations_by_clinical_sample_id", {"pk": "p0001n01"}, ""),
+    ("get_all_data", {}, ""),
+    ("get_all_data", {"pk": "p0001"}, ""),
+    ("get_all_data", {}, "?layout=normalized"),
+    ("get_all_data_by_clinical_sample_id", {"pk": "p0001n01"}, ""),
+    ("get_changes", {}, ""),
+]
+
+
+@override_settings(
+    API_CACHE_TIMEOUT=0, EXPORT_SNAPSHOT_DIR="", TRACK_SLOW_REQUEST_QUERIES=1000
+)
+class QueryCountTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        # Create gating strategy
+        gating_strategy = GatingStrategy(strategy="manual")
+        gating_strategy.save()
+        cls.gating_strategy = gating_strategy
+
+        # Create user needed for tests
+        user = User.objects.create_user(
+            username="test", email="test@test.com", password="test"
+        )
+        user.save()
+        cls.user = user
+
+        # Get the base directory
+        cls.base_dir = os.path.dirname(os.path.realpath(__file__))
+
+        # Populate reference data table
+        fpath = os.path.join(
+            cls.base_dir, "test_data", "population_names_20200413.xlsx"
+        )
+        call_command("update_panel_parameter_reference_data", fpath)
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.client.login(username="test", password="test")
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root)
+
+    def test_query_counts_do_not_grow_with_data(self):
+        """Each view runs as many queries for a larger cohort"""
+
+        self._upload_cohort(n_patients=2, samples_per_patient=1)
+        small = self._count_queries()
+        self._upload_cohort(n_patients=5, samples_per_patient=2)
+        self.assertGreater(Result.objects.count(), 2 * 2)
+        large = self._count_queries()
+
+        for view, n_queries in small.items():
+            with self.subTest(view=view):
+                self.assertEqual(large[view], n_queries)
+
+    def test_samples_view_lists_first_sample_of_each_patient(self):
+        """The samples page shows the first sample of every patient, with
+        the dates its panels were uploaded"""
+
+        self._upload_cohort(n_patients=3, samples_per_patient=2)
+        response = self.client.get(reverse("samples"))
+        samples = json.loads(response.context["table_json"])
+
+        self.assertEqual(
+            [sample["patient_covid_id"] for sample in samples],
+            ["p0001", "p0002", "p0003"],
+        )
+        for sample in samples:
+            first = (
+                ProcessedSample.objects.filter(patient=sample["patient_id"])
+                .order_by("id")
+                .first()
+            )
+            self.assertEqual(sample["id"], first.id)
+            self.assertIn("P1", sample)
+            self.assertIn("P5", sample)
+
+    def _upload_cohort(self, n_patients, samples_per_patient):
+        """Upload a synthetic cohort with results for two panels"""
+
+        files = cohort_files(
+            n_patients, samples_per_patient, malformed_rate=0.1, panels=["P1", "P5"]
+        )
+        for file_name, contents in files.items():
+            upload_file(file_name, contents, self.user, self.gating_strategy)
+
+    def _count_queries(self):
+        """Return the number of queries each view runs"""
+
+        patient = Patient.objects.get(patient_id="p0001").id
+        counts = {}
+        for url_name, kwargs, query_string in VIEWS:
+            url = reverse(url_name, kwargs=kwargs) + query_string.format(
+                patient=patient
+            )
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            # alldata/<clinical sample id> looks the id up as a patient
+            # id, so 404s, but still counts
+            self.assertLess(response.status_code, 500, url)
+            counts[url] = len(queries)
+        return counts
@@ -0,0 +1,70 @@
+import gzip
+import json
+import unittest
+from django.core.cache import cache
+from django.test import TestCase, Client
+from django.urls import reverse
+
+from openfacstrack.apps.track.renderers import msgpack
+from openfacstrack.apps.track.tests.base import UploadTestMixin
+
+# Test the REST API output formats and response compression
+
+
+class RendererTest(UploadTestMixin, TestCase):
+    uploaded_files_pattern = "test_panel*.csv"
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.setUpReferenceData()
+
+        cls.upload_panel_results()
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+
+    def test_ndjson(self):
+        """Newline-delimited JSON has one result per line"""
+
+        expected = self.client.get(reverse("get_observations")).json()
+        for kwargs in [
+            {"data": {"format": "ndjson"}},
+            {"HTTP_ACCEPT": "application/x-ndjson"},
+        ]:
+            response = self.client.get(reverse("get_observations"), **kwargs)
+            self.assertEqual(response["Content-Type"], "application/x-ndjson")
+            lines = response.content.decode("utf-8").splitlines()
+            self.assertEqual([json.loads(line) for line in lines], expected)
+
+    @unittest.skipIf(msgpack is None, "msgpack is not installed")
+    def test_msgpack(self):
+        """MessagePack output decodes to the same data as JSON"""
+
+        expected = self.client.get(reverse("get_observations")).json()
+        response = self.client.get(
+            reverse("get_observations"), HTTP_ACCEPT="application/msgpack"
+        )
+        self.assertEqual(response["Content-Type"], "application/msgpack")
+        self.assertEqual(msgpack.unpackb(response.content), expected)
+
+    def test_gzip_compression(self):
+        """Responses are compressed for clients accepting gzip"""
+
+        response = self.client.get(reverse("get_observations"))
+        self.assertNotIn("Content-Encoding", response)
+        compressed = self.client.get(
+            reverse("get_observations"), HTTP_ACCEPT_ENCODING="gzip"
+        )
+        self.assertEqual(compressed["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", compressed["Vary"])
+        self.assertLess(len(compressed.content), len(response.content))
+        self.assertEqual(gzip.decompress(compressed.content), response.content)
+
+    def test_pages_not_compressed(self):
+        """HTML pages, which carry CSRF tokens, are never compressed"""
+
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("samples"), HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("Content-Encoding", response)
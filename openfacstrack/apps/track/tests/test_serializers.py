@@ -0,0 +1,132 @@
+import json
+from django.core.cache import cache
+from django.test import TestCase, Client, override_settings
+from django.urls import reverse
+
+from rest_framework.renderers import JSONRenderer
+
+from openfacstrack.apps.track.models import Patient, Result
+from openfacstrack.apps.track.serializers import (
+    AllDataSerializer,
+    ObservationSerializer,
+    PatientSerializer,
+)
+from openfacstrack.apps.track.tests.base import UploadTestMixin
+
+# Test the fast serialization path gives the same output as the standard one
+
+
+class FastSerializerTest(UploadTestMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.setUpReferenceData()
+
+        cls.upload_patients()
+        cls.upload_panel_results()
+
+        # Results loaded without an upload record leave out uploaded_file
+        Result.objects.filter(pk=Result.objects.first().pk).update(uploaded_file=None)
+
+    def test_observations_identical(self):
+        """Fast and standard observation serializers give identical output"""
+
+        querysets = [
+            Result.objects.all(),
+            list(Result.objects.filter(processed_sample__patient__patient_id="p033")),
+        ]
+        for results in querysets:
+            fast = self._render(ObservationSerializer(results, many=True))
+            with override_settings(TRACK_FAST_SERIALIZERS=False):
+                standard = self._render(ObservationSerializer(results, many=True))
+            self.assertEqual(fast, standard)
+            self.assertGreater(len(json.loads(fast)), 0)
+
+    def test_all_data_identical(self):
+        """Nested observations are serialized identically too"""
+
+        patients = Patient.objects.all()
+        fast = self._render(AllDataSerializer(patients, many=True))
+        with override_settings(TRACK_FAST_SERIALIZERS=False):
+            standard = self._render(AllDataSerializer(patients, many=True))
+        self.assertEqual(fast, standard)
+
+    def test_fast_path_query_count(self):
+        """Results and their values are read in a fixed number of queries"""
+
+        with self.assertNumQueries(4):
+            ObservationSerializer(Result.objects.all(), many=True).data
+
+    def test_normalized_layout(self):
+        """Normalized values expand to the same observations"""
+
+        cache.clear()
+        expected = Client().get(reverse("get_observations")).json()
+        response = Client().get(reverse("get_observations"), {"layout": "normalized"})
+        normalized = response.json()
+        parameters = normalized["parameters"]
+        self.assertGreater(len(parameters), 0)
+        for parameter in parameters.values():
+            self.assertEqual(set(parameter), {"public_name", "data_type", "unit"})
+
+        for result in normalized["data"]:
+            result["numeric_values"] = [
+                {
+                    "parameter": parameters[str(parameter_id)]["public_name"],
+                    "parameter_type": parameters[str(parameter_id)]["data_type"],
+                    "value": value,
+                }
+                for parameter_id, value in result["numeric_values"]
+            ]
+            for field_name in ["text_values", "date_values"]:
+                result[field_name] = [
+                    {
+                        "parameter": parameters[str(parameter_id)]["public_name"],
+                        "value": value,
+                    }
+                    for parameter_id, value in result[field_name]
+                ]
+        self.assertEqual(normalized["data"], expected)
+        self.assertLess(len(response.content), len(json.dumps(expected)))
+
+    def test_sparse_fields(self):
+        """Only the requested fields and value types are returned"""
+
+        cache.clear()
+        response = Client().get(
+            reverse("get_observations"),
+            {"fields": "panel,numeric_values,date_values", "include": "numeric"},
+        )
+        for result in response.json():
+            self.assertEqual(list(result), ["panel", "numeric_values"])
+
+        response = Client().get(reverse("get_patients"), {"fields": "patient_id"})
+        self.assertEqual(
+            response.json(),
+            [{"patient_id": "p005"}, {"patient_id": "p025"}, {"patient_id": "p033"}],
+        )
+
+        response = Client().get(reverse("get_all_data"), {"include": "text"})
+        for patient in response.json():
+            for sample in patient["samples"]:
+                for result in sample["results"]:
+                    self.assertNotIn("numeric_values", result)
+                    self.assertIn("text_values", result)
+
+        response = Client().get(reverse("get_patients"), {"fields": "name"})
+        self.assertEqual(response.status_code, 400)
+        response = Client().get(reverse("get_observations"), {"include": "float"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_sparse_fields_not_queried(self):
+        """Unrequested values are never loaded from the database"""
+
+        context = {"fields": ["panel", "numeric_values"], "include": ["numeric"]}
+        with self.assertNumQueries(2):
+            ObservationSerializer(Result.objects.all(), many=True, context=context).data
+
+        context = {"fields": ["patient_id"]}
+        with self.assertNumQueries(1):
+            PatientSerializer(Patient.objects.all(), many=True, context=context).data
+
+    def _render(self, serializer):
+        return JSONRenderer().render(serializer.data)
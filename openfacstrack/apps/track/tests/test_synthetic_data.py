@@ -0,0 +1,128 @@
+import io
+import os
+import shutil
+import tempfile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase, override_settings
+from django.contrib.auth.models import User
+
+from openfacstrack.apps.track.models import (
+    Patient,
+    PatientMetadata,
+    Result,
+    NumericValue,
+    ValidationEntry,
+)
+
+# Test the generate_synthetic_data command
+
+
+class GenerateSyntheticDataTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        # Create user needed for tests
+        user = User.objects.create_user(
+            username="test", email="test@test.com", password="test"
+        )
+        user.save()
+        cls.user = user
+
+        # Get the base directory
+        cls.base_dir = os.path.dirname(os.path.realpath(__file__))
+
+        # Populate reference data table
+        fpath = os.path.join(
+            cls.base_dir, "test_data", "population_names_20200413.xlsx"
+        )
+        call_command("update_panel_parameter_reference_data", fpath)
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(
+            MEDIA_ROOT=self.media_root, EXPORT_SNAPSHOT_DIR=""
+        )
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root)
+
+    def test_cohort_uploaded(self):
+        """Generated files upload, with malformed cells reported"""
+
+        call_command(
+            "generate_synthetic_data",
+            "--patients=3",
+            "--samples-per-patient=2",
+            "--panels=p5",
+            "--derived-parameters=10",
+            "--malformed-rate=0.2",
+            "--upload=test",
+            stdout=io.StringIO(),
+        )
+        self.assertEqual(Patient.objects.count(), 3)
+        self.assertEqual(PatientMetadata.objects.count(), 3 * 7)
+        self.assertEqual(Result.objects.count(), 6)
+        self.assertGreater(NumericValue.objects.count(), 6 * 10)
+        self.assertTrue(
+            ValidationEntry.objects.filter(value__contains="not a number").exists()
+        )
+        self.assertEqual(
+            NumericValue.objects.filter(parameter__unit="Derived frequency")
+            .values("parameter")
+            .distinct()
+            .count(),
+            10,
+        )
+
+    def test_rerun_skipped(self):
+        """Rerunning with the same seed reports the uploads as skipped
+        rather than the timings of the previous run"""
+
+        arguments = [
+            "generate_synthetic_data",
+            "--patients=2",
+            "--samples-per-patient=1",
+            "--panels=p1",
+            "--upload=test",
+        ]
+        call_command(*arguments, stdout=io.StringIO())
+        n_results = Result.objects.count()
+
+        output = io.StringIO()
+        call_command(*arguments, stdout=output)
+        self.assertEqual(output.getvalue().count("Skipped"), 2)
+        self.assertNotIn("Uploaded", output.getvalue())
+        self.assertEqual(Result.objects.count(), n_results)
+
+        output = io.StringIO()
+        call_command(*arguments, "--seed=1", stdout=output)
+        self.assertNotIn("Skipped", output.getvalue())
+
+    def test_files_written(self):
+        """One patient data file and one results file per panel are written"""
+
+        output_dir = os.path.join(self.media_root, "synthetic")
+        call_command(
+            "generate_synthetic_data",
+            "--patients=2",
+            f"--output-dir={output_dir}",
+            stdout=io.StringIO(),
+        )
+        self.assertEqual(len(os.listdir(output_dir)), 8)
+        with open(os.path.join(output_dir, "synthetic_panel_P1.csv")) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(len(lines), 1 + 2 * 2)
+        self.assertTrue(lines[0].startswith("batch,filename,"))
+        self.assertEqual(Result.objects.count(), 0)
+
+    def test_invalid_arguments(self):
+        """Nothing is generated without a destination or with a bad rate"""
+
+        with self.assertRaises(CommandError):
+            call_command("generate_synthetic_data")
+        with self.assertRaises(CommandError):
+            call_command(
+                "generate_synthetic_data", "--upload=test", "--malformed-rate=2"
+            )
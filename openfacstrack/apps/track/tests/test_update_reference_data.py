@@ -1,7 +1,11 @@
 import os
+import tempfile
+from io import StringIO
+from unittest import mock
 
+import pandas as pd
 from django.core.management import call_command
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.contrib.auth.models import User
 
 from openfacstrack.apps.track.models import Parameter, Panel
@@ -126,6 +130,75 @@ class UpdateReferenceDataTest(TestCase):
         self._test_all_parameters_loaded(self._get_additional_parameters())
         self.test_all_pseudo_parameters_created()
 
+    def test_rerun_leaves_unchanged_parameters_untouched(self):
+        """Parameters that are not changed by a rerun keep their modified timestamp"""
+
+        modified_before = dict(Parameter.objects.values_list("id", "modified"))
+        fpath = os.path.join(self.base_dir, "test_data", "test_reference_data.xlsx")
+        out = StringIO()
+        call_command("update_panel_parameter_reference_data", fpath, stdout=out)
+
+        self.assertEqual(
+            dict(Parameter.objects.values_list("id", "modified")), modified_before
+        )
+        self.assertIn("Parameters: 0 created, 0 updated, 4 unchanged", out.getvalue())
+
+    def test_dry_run_saves_nothing(self):
+        """A dry run reports the changes but does not save them"""
+
+        fpath = os.path.join(
+            self.base_dir, "test_data", "test_reference_data_overwrite.xlsx"
+        )
+        out = StringIO()
+        call_command(
+            "update_panel_parameter_reference_data", fpath, dry_run=True, stdout=out
+        )
+
+        self.assertIn("Dry run", out.getvalue())
+        self.assertIn("Panels: 2 created", out.getvalue())
+        self.assertEqual(Panel.objects.count(), 3)
+        self.assertEqual(Parameter.objects.count(), 19)
+
+    def test_rerun_uses_cached_snapshot(self):
+        """A second run on the same file does not parse the spreadsheet again"""
+
+        fpath = os.path.join(self.base_dir, "test_data", "test_reference_data.xlsx")
+        with tempfile.TemporaryDirectory() as cache_dir:
+            with override_settings(REFERENCE_DATA_CACHE_DIR=cache_dir):
+                call_command("update_panel_parameter_reference_data", fpath)
+                self.assertEqual(len(os.listdir(cache_dir)), 1)
+                self.assertTrue(os.listdir(cache_dir)[0].endswith(".json"))
+                parameters = list(
+                    Parameter.objects.order_by("gating_hierarchy").values()
+                )
+
+                with mock.patch("pandas.read_excel", wraps=pd.read_excel) as read_excel:
+                    call_command(
+                        "update_panel_parameter_reference_data", fpath, dry_run=True
+                    )
+                    read_excel.assert_not_called()
+                    call_command("update_panel_parameter_reference_data", fpath)
+                    read_excel.assert_not_called()
+                    # The snapshot gives the same parameters as the file
+                    self.assertEqual(
+                        list(Parameter.objects.order_by("gating_hierarchy").values()),
+                        parameters,
+                    )
+
+                    call_command(
+                        "update_panel_parameter_reference_data", fpath, no_cache=True
+                    )
+                    read_excel.assert_called_once()
+
+                    # Frames parsed by another engine are cached separately
+                    call_command(
+                        "update_panel_parameter_reference_data",
+                        fpath,
+                        engine="openpyxl",
+                    )
+                    self.assertEqual(read_excel.call_count, 2)
+                self.assertEqual(len(os.listdir(cache_dir)), 2)
+
     def _test_all_parameters_loaded(self, expected_parameters):
         """Private function to do actual test"""
         for gating_hierarchy, expected_parameter in expected_parameters.items():
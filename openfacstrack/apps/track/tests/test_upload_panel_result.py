@@ -1,22 +1,24 @@
 import os
 from django.core.management import call_command
-from django.test import TestCase
+from django.test import TestCase, Client, override_settings
+from django.urls import reverse
 from django.contrib.auth.models import User
 
 from django.core.files.uploadedfile import SimpleUploadedFile
 
+from openfacstrack.apps.track.metrics import clear_metrics, render_metrics
 from openfacstrack.apps.track.utils import ClinicalSampleFile
 from openfacstrack.apps.track.models import (
     GatingStrategy,
     Patient,
     ProcessedSample,
     Result,
-    DataProcessing,
     Parameter,
     NumericValue,
     TextValue,
     DateValue,
     UploadedFile,
+    UploadTiming,
 )
 
 # Test functionality associated with uploading panel results
@@ -323,6 +325,331 @@ class UploadPanelResultTest(TestCase):
 
         # ToDo check values
 
+    def test_reupload_updates_values(self):
+        """Uploading the same file again updates values rather than duplicating them"""
+
+        fname = "test_panel_data_complete.csv"
+        for i in range(2):
+            clinical_sample_file = ClinicalSampleFile(
+                file_name=fname,
+                file_contents=self._get_uploaded_file(fname),
+                user=self.user,
+                gating_strategy=self.gating_strategy,
+            )
+            clinical_sample_file.upload()
+
+        self.assertEqual(Result.objects.count(), 3)
+        self.assertEqual(NumericValue.objects.count(), 9)
+        self.assertEqual(DateValue.objects.count(), 2)
+        self.assertEqual(TextValue.objects.count(), 1)
+
+        # Values as given in test_panel_data_complete.csv
+        count_parameter = (
+            "Cells_5/Time_5/Live_5/Live_cells_5/CD3p_5/No_Doublets_5/ab_5/"
+            + "Foxp3n_5/CD8p_5/CD8_CD45RAn_CCR7n_5 | Count"
+        )
+        expected_values = {
+            "20200327p5_p005n01_020.fcs": {"P5_batch": 1, count_parameter: 3128},
+            "20200407p5_p033n01_003.fcs": {"P5_batch": 6, count_parameter: 7244},
+            "20200410p5_p033n01_002.fcs": {"P5_batch": 9},
+        }
+        for fcs_file_name, values in expected_values.items():
+            result = Result.objects.get(data_processing__fcs_file_name=fcs_file_name)
+            for gating_hierarchy, value in values.items():
+                numeric_value = NumericValue.objects.get(
+                    result=result, parameter__gating_hierarchy=gating_hierarchy
+                )
+                self.assertEqual(numeric_value.value, value)
+
+        text_value = TextValue.objects.get()
+        self.assertEqual(text_value.value, "Test comments xxx")
+        self.assertEqual(text_value.parameter.gating_hierarchy, "P5_comments")
+
+    def test_reupload_in_diff_mode_only_writes_changes(self):
+        """A corrected file uploaded in diff mode only writes changed values"""
+
+        fname = "test_panel_data_complete.csv"
+        clinical_sample_file = ClinicalSampleFile(
+            file_name=fname,
+            file_contents=self._get_uploaded_file(fname),
+            user=self.user,
+            gating_strategy=self.gating_strategy,
+        )
+        clinical_sample_file.upload()
+        modified_before = dict(NumericValue.objects.values_list("id", "modified"))
+
+        # Change the count of the first row and remove the batch of the last
+        fpath = os.path.join(self.base_dir, "test_data", fname)
+        with open(fpath, "rb") as infile:
+            contents = infile.read()
+        contents = contents.replace(
+            b"1,20200327p5_p005n01_020.fcs,3128", b"1,20200327p5_p005n01_020.fcs,3129"
+        )
+        contents = contents.replace(
+            b"9,20200410p5_p033n01_002.fcs", b",20200410p5_p033n01_002.fcs"
+        )
+        corrected_fname = "test_panel_data_corrected.csv"
+        clinical_sample_file = ClinicalSampleFile(
+            file_name=corrected_fname,
+            file_contents=SimpleUploadedFile(
+                corrected_fname, contents, content_type="text/csv"
+            ),
+            user=self.user,
+            gating_strategy=self.gating_strategy,
+        )
+        upload_report = clinical_sample_file.upload(diff=True)
+
+        changes = upload_report["changes"]
+        self.assertEqual(
+            changes["NumericValue"],
+            {"inserted": 0, "updated": 1, "deleted": 1, "unchanged": 7},
+        )
+        self.assertEqual(
+            changes["DateValue"],
+            {"inserted": 0, "updated": 0, "deleted": 0, "unchanged": 2},
+        )
+        self.assertEqual(NumericValue.objects.count(), 8)
+
+        # Only the changed value has a new modified timestamp
+        updated = NumericValue.objects.get(value=3129)
+        self.assertNotEqual(updated.modified, modified_before[updated.id])
+        for numeric_value in NumericValue.objects.exclude(id=updated.id):
+            self.assertEqual(numeric_value.modified, modified_before[numeric_value.id])
+
+        # Only results with changed values point to the corrected file
+        self.assertEqual(
+            Result.objects.filter(uploaded_file__name=corrected_fname).count(), 2
+        )
+
+    def test_diff_mode_keeps_values_of_invalid_cells(self):
+        """A cell that fails validation in diff mode keeps the stored value,
+        as in normal mode, rather than deleting it"""
+
+        fname = "test_panel_data_complete.csv"
+        clinical_sample_file = ClinicalSampleFile(
+            file_name=fname,
+            file_contents=self._get_uploaded_file(fname),
+            user=self.user,
+            gating_strategy=self.gating_strategy,
+        )
+        clinical_sample_file.upload()
+        dates_before = list(DateValue.objects.order_by("id").values("id", "value"))
+
+        # One malformed date leaves the whole Date column unparsed, and a
+        # malformed count
+        fpath = os.path.join(self.base_dir, "test_data", fname)
+        with open(fpath, "rb") as infile:
+            contents = infile.read()
+        contents = contents.replace(b",20200410,", b",notadate,")
+        contents = contents.replace(
+            b"1,20200327p5_p005n01_020.fcs,3128", b"1,20200327p5_p005n01_020.fcs,x"
+        )
+        corrected_fname = "test_panel_data_malformed.csv"
+        clinical_sample_file = ClinicalSampleFile(
+            file_name=corrected_fname,
+            file_contents=SimpleUploadedFile(
+                corrected_fname, contents, content_type="text/csv"
+            ),
+            user=self.user,
+            gating_strategy=self.gating_strategy,
+        )
+        upload_report = clinical_sample_file.upload(diff=True)
+
+        changes = upload_report["changes"]
+        self.assertEqual(
+            changes["DateValue"],
+            {"inserted": 0, "updated": 0, "deleted": 0, "unchanged": 2},
+        )
+        self.assertEqual(
+            changes["NumericValue"],
+            {"inserted": 0, "updated": 0, "deleted": 0, "unchanged": 9},
+        )
+        self.assertEqual(
+            list(DateValue.objects.order_by("id").values("id", "value")), dates_before
+        )
+        self.assertEqual(NumericValue.objects.count(), 9)
+        self.assertTrue(NumericValue.objects.filter(value=3128).exists())
+
+    @override_settings(TRACK_SLOW_REQUEST_QUERIES=1000)
+    def test_diff_upload_through_upload_page(self):
+        """Diff mode is chosen on the upload page and kept on confirmation"""
+
+        fname = "test_panel_data_complete.csv"
+        client = Client()
+        client.force_login(self.user)
+        response = client.post(
+            reverse("upload"), {"observationsFile": self._get_uploaded_file(fname)}
+        )
+        client.post(
+            reverse("upload"), {"file_id": response.context["form"]["file_id"].value()}
+        )
+        modified_before = dict(NumericValue.objects.values_list("id", "modified"))
+
+        fpath = os.path.join(self.base_dir, "test_data", fname)
+        with open(fpath, "rb") as infile:
+            contents = infile.read().replace(
+                b"1,20200327p5_p005n01_020.fcs,3128",
+                b"1,20200327p5_p005n01_020.fcs,3129",
+            )
+        corrected_file = SimpleUploadedFile(
+            "test_panel_data_corrected.csv", contents, content_type="text/csv"
+        )
+        response = client.post(
+            reverse("upload"), {"observationsFile": corrected_file, "diff": "on"}
+        )
+        # The dry run reports what would change
+        self.assertEqual(
+            response.context["model_report"]["changes"]["NumericValue"],
+            {"inserted": 0, "updated": 1, "deleted": 0, "unchanged": 8},
+        )
+        form = response.context["form"]
+        self.assertTrue(form["diff"].value())
+
+        response = client.post(
+            reverse("upload"), {"file_id": form["file_id"].value(), "diff": "on"}
+        )
+        self.assertEqual(response.context["changes"]["NumericValue"]["updated"], 1)
+        self.assertContains(response, "Values compared with those already stored")
+        updated = NumericValue.objects.get(value=3129)
+        for numeric_value in NumericValue.objects.exclude(id=updated.id):
+            self.assertEqual(numeric_value.modified, modified_before[numeric_value.id])
+
+    def test_duplicate_upload_reuses_earlier_upload(self):
+        """Uploading identical contents again reuses the earlier UploadedFile"""
+
+        fname = "test_panel_data_fcs_file_name_nan.csv"
+        clinical_sample_file = ClinicalSampleFile(
+            file_name=fname,
+            file_contents=self._get_uploaded_file(fname),
+            user=self.user,
+            gating_strategy=self.gating_strategy,
+        )
+        self.assertFalse(clinical_sample_file.duplicate)
+        validation_report = clinical_sample_file.validate()
+        upload_report = clinical_sample_file.upload()
+        self.assertTrue(clinical_sample_file.upload_file.committed)
+        self.assertEqual(len(clinical_sample_file.upload_file.content_hash), 64)
+
+        n_numeric_values = NumericValue.objects.count()
+        duplicate_file = ClinicalSampleFile(
+            file_name="test_panel_data_renamed.csv",
+            file_contents=self._get_uploaded_file(fname),
+            user=self.user,
+            gating_strategy=self.gating_strategy,
+        )
+        self.assertTrue(duplicate_file.duplicate)
+        self.assertEqual(duplicate_file.upload_file, clinical_sample_file.upload_file)
+        self.assertEqual(UploadedFile.objects.count(), 1)
+
+        # Earlier outcome is reported without running the pipeline again
+        self.assertEqual(
+            [entry.key for entry in duplicate_file.validate()],
+            [entry.key for entry in validation_report],
+        )
+        duplicate_report = duplicate_file.upload(dry_run=True)
+        self.assertEqual(
+            [entry.key for entry in duplicate_report["validation"]],
+            [entry.key for entry in upload_report["validation"]],
+        )
+        self.assertEqual(
+            duplicate_report["rows_with_issues"], upload_report["rows_with_issues"]
+        )
+        duplicate_file.upload()
+        self.assertEqual(NumericValue.objects.count(), n_numeric_values)
+
+    def test_reverting_upload_is_not_a_duplicate(self):
+        """Uploading an earlier file again after a correction is applied"""
+
+        fname = "test_panel_data_complete.csv"
+        original_file = ClinicalSampleFile(
+            file_name=fname,
+            file_contents=self._get_uploaded_file(fname),
+            user=self.user,
+            gating_strategy=self.gating_strategy,
+        )
+        original_file.upload()
+
+        fpath = os.path.join(self.base_dir, "test_data", fname)
+        with open(fpath, "rb") as infile:
+            contents = infile.read().replace(
+                b"1,20200327p5_p005n01_020.fcs,3128",
+                b"1,20200327p5_p005n01_020.fcs,3129",
+            )
+        ClinicalSampleFile(
+            file_name="test_panel_data_corrected.csv",
+            file_contents=SimpleUploadedFile(
+                "test_panel_data_corrected.csv", contents, content_type="text/csv"
+            ),
+            user=self.user,
+            gating_strategy=self.gating_strategy,
+        ).upload()
+        self.assertTrue(NumericValue.objects.filter(value=3129).exists())
+
+        reverted_file = ClinicalSampleFile(
+            file_name=fname,
+            file_contents=self._get_uploaded_file(fname),
+            user=self.user,
+            gating_strategy=self.gating_strategy,
+        )
+        self.assertFalse(reverted_file.duplicate)
+        reverted_file.upload()
+        self.assertFalse(NumericValue.objects.filter(value=3129).exists())
+        self.assertTrue(NumericValue.objects.filter(value=3128).exists())
+
+        # Uploading the latest file again is a duplicate, but not under
+        # another gating strategy
+        for gating_strategy, duplicate in [
+            (self.gating_strategy, True),
+            (GatingStrategy.objects.create(strategy="manual"), False),
+        ]:
+            repeated_file = ClinicalSampleFile(
+                file_name=fname,
+                file_contents=self._get_uploaded_file(fname),
+                user=self.user,
+                gating_strategy=gating_strategy,
+            )
+            self.assertEqual(repeated_file.duplicate, duplicate)
+
+    def test_upload_stage_timings_recorded(self):
+        """Each upload run stores its stage timings and throughput"""
+
+        clear_metrics()
+        fname = "test_panel_data_complete.csv"
+        clinical_sample_file = ClinicalSampleFile(
+            file_name=fname,
+            file_contents=self._get_uploaded_file(fname),
+            user=self.user,
+            gating_strategy=self.gating_strategy,
+        )
+        clinical_sample_file.validate()
+        clinical_sample_file.upload(dry_run=True)
+        clinical_sample_file.upload()
+
+        # One row per run, even though the file was validated separately
+        self.assertEqual(UploadTiming.objects.count(), 2)
+        dry_run, timing = clinical_sample_file.upload_file.timings.order_by("id")
+        self.assertTrue(dry_run.dry_run)
+        self.assertFalse(timing.dry_run)
+        self.assertGreater(dry_run.parse, 0)
+        self.assertGreater(dry_run.header_validation, 0)
+        # The file is only parsed once
+        self.assertEqual(timing.parse, 0)
+        for stage in ["sample_resolution", "value_writes", "commit"]:
+            self.assertGreater(getattr(timing, stage), 0)
+        self.assertEqual(timing.rows, 3)
+        self.assertEqual(timing.cells, 12)
+        self.assertGreater(timing.cells_per_second, 0)
+
+        metrics = render_metrics()
+        self.assertIn(
+            'track_uploads_total{content_type="PANEL_RESULTS",dry_run="false"} 1',
+            metrics,
+        )
+        self.assertIn(
+            'track_upload_cells_total{content_type="PANEL_RESULTS",dry_run="true"} 12',
+            metrics,
+        )
+
     def _get_uploaded_file(self, fname):
         """Return django object representing an uploaded file"""
 
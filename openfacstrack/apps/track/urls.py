@@ -1,10 +1,17 @@
 """
 track app URL Configuration
 """
+from django.conf import settings
 from django.conf.urls import url
 from django.urls import path, include
 from . import views
 
+# Read-heavy views are served by their async versions under ASGI
+if settings.TRACK_ASYNC_VIEWS:
+    from . import async_views as read_views
+else:
+    read_views = views
+
 urlpatterns = [
     path("", views.index, name="home"),
     path("home/", views.home, name="home"),
@@ -13,7 +20,9 @@ urlpatterns = [
     path("observations/", views.observations_view, name="observations"),
     path("panels/", views.panels_view, name="panels"),
     path("login/", views.login, name="login"),
-    path("export/", views.export_view, name="export"),
+    path("export/", read_views.export_view, name="export"),
+    path("metrics/", views.metrics_view, name="metrics"),
+    path("profiles/<str:file_name>", views.profile_view, name="profile"),
     url(r"^oidc/", include("mozilla_django_oidc.urls")),
     url(
         r"^api/v1/patients/(?P<pk>[Pp][0-9]+)?$",
@@ -28,20 +37,23 @@ urlpatterns = [
     ),
     url(
         r"^api/v1/observations/(?P<pk>[Pp][0-9]+)?$",
-        views.get_observations,
+        read_views.get_observations,
         name="get_observations",
     ),
     url(
         r"^api/v1/observations/(?P<pk>[Pp][0-9]+n[0-9]+)$",
-        views.get_observations,
+        read_views.get_observations,
         name="get_observations_by_clinical_sample_id",
     ),
     url(
-        r"^api/v1/alldata/(?P<pk>[Pp][0-9]+)?$", views.get_all_data, name="get_all_data"
+        r"^api/v1/alldata/(?P<pk>[Pp][0-9]+)?$",
+        read_views.get_all_data,
+        name="get_all_data",
     ),
     url(
         r"^api/v1/alldata/(?P<pk>[Pp][0-9]+n[0-9]+)$",
-        views.get_all_data,
+        read_views.get_all_data,
         name="get_all_data_by_clinical_sample_id",
     ),
+    url(r"^api/v1/changes/$", views.get_changes, name="get_changes"),
 ]
@@ -1,12 +1,16 @@
 import os
-import numbers
 import base64
+import contextlib
+import hashlib
+import logging
+import time
 
 from django.contrib.auth.models import User
 from django.db import transaction
+from django.utils import timezone
 import io
 import pandas as pd
-import numpy as np
+from pandas.api.types import is_datetime64_any_dtype
 
 from openfacstrack.apps.track.models import (
     PanelMetadata,
@@ -22,9 +26,16 @@ from openfacstrack.apps.track.models import (
     TextValue,
     DateValue,
     UploadedFile,
+    UploadTiming,
     ValidationEntry,
     GatingStrategy,
 )
+from openfacstrack.apps.track.caching import bump_generation
+from openfacstrack.apps.track.export import schedule_export_snapshot
+from openfacstrack.apps.track.metrics import record_upload
+from openfacstrack.apps.track.staging import merge_values, sync_values
+
+logger = logging.getLogger(__name__)
 
 
 class ClinicalSampleFile:
@@ -59,15 +70,26 @@ class ClinicalSampleFile:
         -------
         None
         """
+        self.timer = UploadStageTimer()
+
+        # An upload with the same contents as the latest committed one
+        # reuses that UploadedFile (and its stored file and results)
+        self.duplicate = False
+        if not uploaded_file:
+            content_hash = hash_file_contents(file_contents)
+            uploaded_file = find_duplicate_upload(
+                content_hash, "PANEL_RESULTS", gating_strategy
+            )
+            self.duplicate = uploaded_file is not None
         if uploaded_file:
             self.upload_file = uploaded_file
             file_name = uploaded_file.name
             file_contents = uploaded_file.content
-            # print(file_contents)
         self.content = file_contents
         self.file_name = file_name
         self.gating_strategy = gating_strategy
-        self.df = pd.read_csv(self.content, parse_dates=["Date"])
+        with self.timer.stage("parse"):
+            self.df = pd.read_csv(self.content, parse_dates=["Date"])
 
         # List of columns always expected
         # ToDo: Find out if any of these columns are 'required' - if so
@@ -111,18 +133,19 @@ class ClinicalSampleFile:
         # added to the Parameter table before upload
         self.unregistered_derived_parameters = []
         self.unregistered_parameters = []
-        for parameter_column in self.parameter_columns:
-            try:
-                parameter_object = Parameter.objects.get(
-                    gating_hierarchy=parameter_column
-                )
-            except Parameter.DoesNotExist:
-                if parameter_column.endswith("Count_back") or parameter_column.endswith(
-                    "freq"
-                ):
-                    self.unregistered_derived_parameters.append(parameter_column)
-                else:
-                    self.unregistered_parameters.append(parameter_column)
+        with self.timer.stage("parameter_resolution"):
+            for parameter_column in self.parameter_columns:
+                try:
+                    parameter_object = Parameter.objects.get(
+                        gating_hierarchy=parameter_column
+                    )
+                except Parameter.DoesNotExist:
+                    if parameter_column.endswith(
+                        "Count_back"
+                    ) or parameter_column.endswith("freq"):
+                        self.unregistered_derived_parameters.append(parameter_column)
+                    else:
+                        self.unregistered_parameters.append(parameter_column)
         self.parameter_columns = [
             column
             for column in self.parameter_columns
@@ -166,6 +189,7 @@ class ClinicalSampleFile:
                 content=self.content,
                 notes="",
                 content_type="PANEL_RESULTS",
+                content_hash=content_hash,
             )
             self.upload_file.save()
 
@@ -185,58 +209,24 @@ class ClinicalSampleFile:
             Empty list is returned if there are no errors
         """
 
-        # Start validation writing errors into dictionary/or json string?
-        validation_errors = []
-
-        # Check we have the required columns needed for upload to proceed.
-        required_columns_missing = []
-        for required_column in self.required_columns:
-            if required_column not in self.df.columns:
-                required_columns_missing.append(required_column)
-        if len(required_columns_missing) > 0:
-            error = ValidationEntry(
-                subject_file=self.upload_file,
-                key="required_columns_missing",
-                value=required_columns_missing,
-                entry_type="FATAL",
-                validation_type="SYNTAX",
-            )
-            error.save()
-            validation_errors.append(error)
-            self.upload_file.valid_syntax = False
-            self.upload_file.save()
+        with self.timer.stage("header_validation"):
+            # Contents already validated when first uploaded
+            if self.duplicate:
+                return prior_validation_entries(self.upload_file, "SYNTAX")
 
-        # Check we have the expected number of columns.
-        static_columns_missing = []
-        for static_column in self.static_columns:
-            if static_column not in self.df.columns:
-                static_columns_missing.append(static_column)
-        if len(static_columns_missing) > 0:
-            error = ValidationEntry(
-                subject_file=self.upload_file,
-                key="static_columns_missing",
-                value=static_columns_missing,
-                entry_type="ERROR",
-                validation_type="SYNTAX",
-            )
-            error.save()
-            validation_errors.append(error)
-            self.upload_file.valid_syntax = False
-            self.upload_file.save()
+            # Start validation writing errors into dictionary/or json string?
+            validation_errors = []
 
-        # Check that all the info is for the same panel
-        # It is dangerous to proceed otherwise as we will
-        # mainly because of the parameters we dynamically
-        # compose from the panel name.
-        if "Panel" in self.df.columns:
-            panels_in_data = self.df["Panel"].unique().tolist()
-            n_unique_panels_in_data = len(panels_in_data)
-            if n_unique_panels_in_data != 1:
+            # Check we have the required columns needed for upload to proceed.
+            required_columns_missing = []
+            for required_column in self.required_columns:
+                if required_column not in self.df.columns:
+                    required_columns_missing.append(required_column)
+            if len(required_columns_missing) > 0:
                 error = ValidationEntry(
                     subject_file=self.upload_file,
-                    key="unique_panel_error",
-                    value=f"Expected 1 unique value for panels in each record"
-                    + f". Got {n_unique_panels_in_data}: {panels_in_data}",
+                    key="required_columns_missing",
+                    value=required_columns_missing,
                     entry_type="FATAL",
                     validation_type="SYNTAX",
                 )
@@ -245,64 +235,108 @@ class ClinicalSampleFile:
                 self.upload_file.valid_syntax = False
                 self.upload_file.save()
 
-            # Check if the panel(s) are present in the Panel table
-            panels_in_data_pk = []
-            unknown_panels = []
-            for panel in panels_in_data:
-                try:
-                    panels_in_data_pk.append(Panel.objects.get(name=panel.upper()).id)
-                except Panel.DoesNotExist as e:
-                    unknown_panels.append(panel)
-            if len(unknown_panels) > 0:
+            # Check we have the expected number of columns.
+            static_columns_missing = []
+            for static_column in self.static_columns:
+                if static_column not in self.df.columns:
+                    static_columns_missing.append(static_column)
+            if len(static_columns_missing) > 0:
                 error = ValidationEntry(
                     subject_file=self.upload_file,
-                    key="unknown_panel_error",
-                    value=f"The following panels are not in Panel table: {unknown_panels}",
+                    key="static_columns_missing",
+                    value=static_columns_missing,
+                    entry_type="ERROR",
+                    validation_type="SYNTAX",
+                )
+                error.save()
+                validation_errors.append(error)
+                self.upload_file.valid_syntax = False
+                self.upload_file.save()
+
+            # Check that all the info is for the same panel
+            # It is dangerous to proceed otherwise as we will
+            # mainly because of the parameters we dynamically
+            # compose from the panel name.
+            if "Panel" in self.df.columns:
+                panels_in_data = self.df["Panel"].unique().tolist()
+                n_unique_panels_in_data = len(panels_in_data)
+                if n_unique_panels_in_data != 1:
+                    error = ValidationEntry(
+                        subject_file=self.upload_file,
+                        key="unique_panel_error",
+                        value=f"Expected 1 unique value for panels in each record"
+                        + f". Got {n_unique_panels_in_data}: {panels_in_data}",
+                        entry_type="FATAL",
+                        validation_type="SYNTAX",
+                    )
+                    error.save()
+                    validation_errors.append(error)
+                    self.upload_file.valid_syntax = False
+                    self.upload_file.save()
+
+                # Check if the panel(s) are present in the Panel table
+                panels_in_data_pk = []
+                unknown_panels = []
+                for panel in panels_in_data:
+                    try:
+                        panels_in_data_pk.append(
+                            Panel.objects.get(name=panel.upper()).id
+                        )
+                    except Panel.DoesNotExist as e:
+                        unknown_panels.append(panel)
+                if len(unknown_panels) > 0:
+                    error = ValidationEntry(
+                        subject_file=self.upload_file,
+                        key="unknown_panel_error",
+                        value=f"The following panels are not in Panel table: {unknown_panels}",
+                        entry_type="WARN",
+                        validation_type="SYNTAX",
+                    )
+                    error.save()
+                    validation_errors.append(error)
+
+            else:
+                # ToDo: Can we continue without unique panels?
+                panels_in_data = []
+                panels_in_data_pk = []
+
+            if len(self.unregistered_parameters) > 0:
+                error = ValidationEntry(
+                    subject_file=self.upload_file,
+                    key="unregistered_parameters",
+                    value=self.unregistered_parameters,
                     entry_type="WARN",
                     validation_type="SYNTAX",
                 )
                 error.save()
                 validation_errors.append(error)
 
-        else:
-            # ToDo: Can we continue without unique panels?
-            panels_in_data = []
-            panels_in_data_pk = []
-
-        if len(self.unregistered_parameters) > 0:
-            error = ValidationEntry(
-                subject_file=self.upload_file,
-                key="unregistered_parameters",
-                value=self.unregistered_parameters,
-                entry_type="WARN",
-                validation_type="SYNTAX",
-            )
-            error.save()
-            validation_errors.append(error)
-
-        if len(self.unregistered_derived_parameters) > 0:
-            error = ValidationEntry(
-                subject_file=self.upload_file,
-                key="unregistered_derived_parameters - will be added during upload",
-                value=self.unregistered_derived_parameters,
-                entry_type="INFO",
-                validation_type="SYNTAX",
-            )
-            error.save()
-            validation_errors.append(error)
+            if len(self.unregistered_derived_parameters) > 0:
+                error = ValidationEntry(
+                    subject_file=self.upload_file,
+                    key="unregistered_derived_parameters - will be added during upload",
+                    value=self.unregistered_derived_parameters,
+                    entry_type="INFO",
+                    validation_type="SYNTAX",
+                )
+                error.save()
+                validation_errors.append(error)
 
-        # Check all fields needed for processed_sample table present
+            # Check all fields needed for processed_sample table present
 
-        # Check all clinical samples present in processed_sample table
+            # Check all clinical samples present in processed_sample table
 
-        # Enter values into processed_sample, processed_sample,
-        # numeric_value and text_parameter
+            # Enter values into processed_sample, processed_sample,
+            # numeric_value and text_parameter
 
-        # Print out list of validation errors
-        # print("Validation errors:")
+        logger.debug(
+            "Validated %s: %d validation entries",
+            self.file_name,
+            len(validation_errors),
+        )
         return validation_errors
 
-    def upload(self, dry_run=False):
+    def upload(self, dry_run=False, diff=False):
         """Upload file to respective tables
 
         Upload data in clinical sample results for panel into the database.
@@ -334,6 +368,10 @@ class ClinicalSampleFile:
         ----------
         dry_run : boolean
             Indicates it's going to attempt to do the upload without committing the changes.
+        diff : boolean
+            Compare the values in the file with those already stored for the
+            same results and only write values that were added, changed or
+            removed. Unchanged values (and results) are left untouched.
 
         Returns
         -------
@@ -346,219 +384,334 @@ class ClinicalSampleFile:
                                 descriptions with row in sheet where issue
                                 occured. Empty dict is returned if there 
                                 are no issues
+                changes : dict - only in diff mode. Keys are the value
+                          tables, values are the number of values
+                          inserted, updated, deleted and unchanged
         """
 
+        # Contents already uploaded or dry run - report the earlier outcome
+        if (self.duplicate and dry_run) or (self.upload_file.committed and not dry_run):
+            return prior_upload_report(self.upload_file, self.nrows, "validation")
+
         # Assume all checks done - will stop and terminate upload if
         # any errors encountered
         upload_issues = []
         rows_with_issues = set()
 
         with transaction.atomic():
-            # Ensure all sample numbers are in processed_sample table
-            # and respective records for patients exist
-            sample_ids = self.df[self.sc_clinical_sample].unique().tolist()
-            patient_ids = [str(s_id).split("n")[0] for s_id in sample_ids]
-            processed_sample_pks = {}
-            for patient_id, sample_id in zip(patient_ids, sample_ids):
-                patient = Patient.objects.get_or_create(patient_id=patient_id)[0]
-                processed_sample = ProcessedSample.objects.get_or_create(
-                    clinical_sample_id=sample_id, patient=patient
-                )[0]
-                processed_sample_pks[sample_id] = processed_sample.pk
-
-            # Get the panel(s) pks
-            panels_pk = {}
-            for panel in self.panels:
-                panels_pk[panel] = Panel.objects.get(name=panel.upper()).id
-
-            # Store first panel primary key for use later
-            panel_pk = panels_pk[self.panels[0]]
-
-            # Append any unregistered derived parameters to parameter table
-            for parameter_to_add in self.unregistered_derived_parameters:
-                parameter, created = Parameter.objects.get_or_create(
-                    gating_hierarchy=parameter_to_add, panel_id=panel_pk
-                )
-                parameter.internal_name = parameter_to_add
-                parameter.public_name = parameter_to_add
-                parameter.is_reference_parameter = False
-                if parameter_to_add.endswith("freq"):
-                    parameter.unit = "Derived frequency"
-                else:
-                    parameter.unit = "Derived count"
-                parameter.data_type = "PanelNumeric"
-                parameter.description = parameter.unit
-                parameter.save()
-
-                self.parameter_columns.append(parameter_to_add)
-
-            # Get parameter_ids for NumericParameters
-            parameters_pk = {}
-            for parameter in self.parameter_columns:
-                parameters_pk[parameter] = Parameter.objects.get(
-                    gating_hierarchy=parameter
-                ).id
-
-            # Ditto for pseudo parameters (date, text, numeric)
-            pseudo_parameters_pk = {}
-            for column, parameter in self.pseudo_parameters_numeric:
-                pseudo_parameters_pk[parameter] = Parameter.objects.get(
-                    gating_hierarchy=parameter
-                ).id
-
-            for column, parameter in self.pseudo_parameters_date:
-                pseudo_parameters_pk[parameter] = Parameter.objects.get(
-                    gating_hierarchy=parameter
-                ).id
-
-            for column, parameter in self.pseudo_parameters_text:
-                pseudo_parameters_pk[parameter] = Parameter.objects.get(
-                    gating_hierarchy=parameter
-                ).id
-
-            # Store details in relevant tables
-            for index, row in self.df.iterrows():
-
-                # Only proceed if sample_id is valid
-                sample_id = str(row[self.sc_clinical_sample])
-                if not sample_id.upper().startswith("P") or len(sample_id) < 4:
-                    validation_entry = ValidationEntry(
-                        subject_file=self.upload_file,
-                        key=f"row:{index} field:Clinical_sample",
-                        value=f"Value ({sample_id}) not a valid "
-                        + "clinical sample id. Expected pxxxnxx. "
-                        + "All entries for this row not loaded.",
-                        entry_type="WARN",
-                        validation_type="MODEL",
+            with self.timer.stage("sample_resolution"):
+                # Ensure all sample numbers are in processed_sample table
+                # and respective records for patients exist
+                sample_ids = self.df[self.sc_clinical_sample].unique().tolist()
+                patient_ids = [str(s_id).split("n")[0] for s_id in sample_ids]
+                processed_sample_pks = {}
+                for patient_id, sample_id in zip(patient_ids, sample_ids):
+                    patient = Patient.objects.get_or_create(patient_id=patient_id)[0]
+                    processed_sample = ProcessedSample.objects.get_or_create(
+                        clinical_sample_id=sample_id, patient=patient
+                    )[0]
+                    processed_sample_pks[sample_id] = processed_sample.pk
+
+            with self.timer.stage("parameter_resolution"):
+                # Get the panel(s) pks
+                panels_pk = {}
+                for panel in self.panels:
+                    panels_pk[panel] = Panel.objects.get(name=panel.upper()).id
+
+                # Store first panel primary key for use later
+                panel_pk = panels_pk[self.panels[0]]
+
+                # Append any unregistered derived parameters to parameter table
+                for parameter_to_add in self.unregistered_derived_parameters:
+                    parameter, created = Parameter.objects.get_or_create(
+                        gating_hierarchy=parameter_to_add, panel_id=panel_pk
                     )
-                    upload_issues.append(validation_entry)
-                    rows_with_issues.add(index)
-                    continue
+                    parameter.internal_name = parameter_to_add
+                    parameter.public_name = parameter_to_add
+                    parameter.is_reference_parameter = False
+                    if parameter_to_add.endswith("freq"):
+                        parameter.unit = "Derived frequency"
+                    else:
+                        parameter.unit = "Derived count"
+                    parameter.data_type = "PanelNumeric"
+                    parameter.description = parameter.unit
+                    parameter.save()
+
+                    self.parameter_columns.append(parameter_to_add)
+
+                # Get parameter_ids for NumericParameters
+                parameters_pk = {}
+                for parameter in self.parameter_columns:
+                    parameters_pk[parameter] = Parameter.objects.get(
+                        gating_hierarchy=parameter
+                    ).id
+
+                # Ditto for pseudo parameters (date, text, numeric)
+                pseudo_parameters_pk = {}
+                for column, parameter in self.pseudo_parameters_numeric:
+                    pseudo_parameters_pk[parameter] = Parameter.objects.get(
+                        gating_hierarchy=parameter
+                    ).id
 
-                # Data processing details
-                fcs_file_name = row[self.sc_filename]
-                if type(fcs_file_name) == str and fcs_file_name.find(sample_id) >= 0:
-                    data_processing, created = DataProcessing.objects.get_or_create(
-                        fcs_file_name=fcs_file_name, panel_id=panels_pk[row["Panel"]]
-                    )
-                else:
-                    validation_entry = ValidationEntry(
-                        subject_file=self.upload_file,
-                        key=f"row:{index} field:{self.sc_filename}",
-                        value=f"Value {fcs_file_name} does not contain the"
-                        + f" sample ID ({sample_id}) - row not loaded",
-                        entry_type="WARN",
-                        validation_type="MODEL",
-                    )
-                    upload_issues.append(validation_entry)
-                    rows_with_issues.add(index)
-                    continue
+                for column, parameter in self.pseudo_parameters_date:
+                    pseudo_parameters_pk[parameter] = Parameter.objects.get(
+                        gating_hierarchy=parameter
+                    ).id
 
-                # Create an entry in the results table
-                result = Result.objects.get_or_create(
-                    processed_sample_id=processed_sample_pks[sample_id],
-                    gating_strategy=self.gating_strategy,
-                    panel_id=panel_pk,
-                    data_processing=data_processing,
-                )[0]
-                result.uploaded_file = self.upload_file
-                result.save()
-
-                # Store data for parameters
-                for parameter, parameter_pk in parameters_pk.items():
-                    if isinstance(row[parameter], numbers.Number) and not np.isnan(
-                        row[parameter]
-                    ):
-                        numeric_value, created = NumericValue.objects.get_or_create(
-                            result_id=result.id, parameter_id=parameters_pk[parameter]
-                        )
-                        numeric_value.value = row[parameter]
-                        numeric_value.save()
-                    else:
+                for column, parameter in self.pseudo_parameters_text:
+                    pseudo_parameters_pk[parameter] = Parameter.objects.get(
+                        gating_hierarchy=parameter
+                    ).id
+
+            with self.timer.stage("sample_resolution"):
+                # Resolve the Result for each row. Values are collected column
+                # by column below, so this is the only loop over rows.
+                result_ids = {}
+                row_issues = []
+                for index, row in self.df.iterrows():
+
+                    # Only proceed if sample_id is valid
+                    sample_id = str(row[self.sc_clinical_sample])
+                    if not sample_id.upper().startswith("P") or len(sample_id) < 4:
                         validation_entry = ValidationEntry(
                             subject_file=self.upload_file,
-                            key=f"row:{index} parameter:{parameter}",
-                            value=f"Value ({row[parameter]}) not a "
-                            + "number - not uploaded to NumericValue"
-                            + " table",
+                            key=f"row:{index} field:Clinical_sample",
+                            value=f"Value ({sample_id}) not a valid "
+                            + "clinical sample id. Expected pxxxnxx. "
+                            + "All entries for this row not loaded.",
                             entry_type="WARN",
                             validation_type="MODEL",
                         )
-                        upload_issues.append(validation_entry)
-                        rows_with_issues.add(index)
-
-                # Store numeric pseudo parameters
-                for column, parameter in self.pseudo_parameters_numeric:
-                    value = row[column]
-                    if isinstance(value, numbers.Number) and not np.isnan(value):
-                        numeric_value, created = NumericValue.objects.get_or_create(
-                            result_id=result.id,
-                            parameter_id=pseudo_parameters_pk[parameter],
+                        row_issues.append((index, validation_entry))
+                        continue
+
+                    # Data processing details
+                    fcs_file_name = row[self.sc_filename]
+                    if (
+                        type(fcs_file_name) == str
+                        and fcs_file_name.find(sample_id) >= 0
+                    ):
+                        data_processing, created = DataProcessing.objects.get_or_create(
+                            fcs_file_name=fcs_file_name,
+                            panel_id=panels_pk[row["Panel"]],
                         )
-                        numeric_value.value = value
-                        numeric_value.save()
                     else:
                         validation_entry = ValidationEntry(
                             subject_file=self.upload_file,
-                            key=f"row:{index} parameter:{parameter}",
-                            value=f"Value ({value}) not a "
-                            + "number - not uploaded to NumericValue"
-                            + " table",
+                            key=f"row:{index} field:{self.sc_filename}",
+                            value=f"Value {fcs_file_name} does not contain the"
+                            + f" sample ID ({sample_id}) - row not loaded",
                             entry_type="WARN",
                             validation_type="MODEL",
                         )
-                        upload_issues.append(validation_entry)
-                        rows_with_issues.add(index)
+                        row_issues.append((index, validation_entry))
+                        continue
+
+                    # Create an entry in the results table
+                    result = Result.objects.get_or_create(
+                        processed_sample_id=processed_sample_pks[sample_id],
+                        gating_strategy=self.gating_strategy,
+                        panel_id=panel_pk,
+                        data_processing=data_processing,
+                        defaults={"uploaded_file": self.upload_file},
+                    )[0]
+                    # In diff mode existing results are only updated below if
+                    # any of their values changed
+                    if not diff:
+                        result.uploaded_file = self.upload_file
+                        result.save()
+                    result_ids[index] = result.id
+
+            with self.timer.stage("value_writes"):
+                # Convert the loadable rows to long form values per value table
+                result_ids = pd.Series(result_ids, dtype="int64")
+                rows = self.df.loc[result_ids.index]
+                numeric_columns = [
+                    (parameter, parameter, parameter_pk)
+                    for parameter, parameter_pk in parameters_pk.items()
+                ] + [
+                    (column, parameter, pseudo_parameters_pk[parameter])
+                    for column, parameter in self.pseudo_parameters_numeric
+                ]
+                date_columns = [
+                    (column, parameter, pseudo_parameters_pk[parameter])
+                    for column, parameter in self.pseudo_parameters_date
+                ]
+                text_columns = [
+                    (column, parameter, pseudo_parameters_pk[parameter])
+                    for column, parameter in self.pseudo_parameters_text
+                ]
+                (
+                    numeric_values,
+                    numeric_invalid,
+                    numeric_issues,
+                ) = self._long_form_values(rows, result_ids, numeric_columns, "numeric")
+                date_values, date_invalid, date_issues = self._long_form_values(
+                    rows, result_ids, date_columns, "date"
+                )
+                text_values, text_invalid, text_issues = self._long_form_values(
+                    rows, result_ids, text_columns, "text"
+                )
 
-                # Stdate pseudo parameters
-                for column, parameter in self.pseudo_parameters_date:
-                    value = row[column]
-                    if isinstance(value, pd.Timestamp) and not pd.isnull(value):
-                        date_value, created = DateValue.objects.get_or_create(
-                            result_id=result.id,
-                            parameter_id=pseudo_parameters_pk[parameter],
-                        )
-                        date_value.value = value
-                        date_value.save()
-                    else:
-                        validation_entry = ValidationEntry(
-                            subject_file=self.upload_file,
-                            key=f"row:{index} parameter:{parameter}",
-                            value=f"Value ({value}) not a "
-                            + "Date - not uploaded to DateValue"
-                            + " table",
-                            entry_type="WARN",
-                            validation_type="MODEL",
+                # Set based writes of all values
+                if diff:
+                    changes = {}
+                    changed_result_ids = set()
+                    for model, values, invalid, columns in [
+                        (
+                            NumericValue,
+                            numeric_values,
+                            numeric_invalid,
+                            numeric_columns,
+                        ),
+                        (DateValue, date_values, date_invalid, date_columns),
+                        (TextValue, text_values, text_invalid, text_columns),
+                    ]:
+                        summary, result_ids_changed = sync_values(
+                            model,
+                            values,
+                            result_ids.unique().tolist(),
+                            [
+                                parameter_pk
+                                for column, parameter, parameter_pk in columns
+                            ],
+                            invalid,
                         )
-                        upload_issues.append(validation_entry)
-                        rows_with_issues.add(index)
+                        changes[model.__name__] = summary
+                        changed_result_ids |= result_ids_changed
+                    Result.objects.filter(id__in=changed_result_ids).update(
+                        uploaded_file=self.upload_file, modified=timezone.now()
+                    )
+                else:
+                    merge_values(NumericValue, numeric_values)
+                    merge_values(DateValue, date_values)
+                    merge_values(TextValue, text_values)
 
-                # Store text pseudo parameters
-                for column, parameter in self.pseudo_parameters_text:
-                    value = str(row[column]).strip()
-                    if len(value) > 0 and value != "nan":
-                        text_value, created = TextValue.objects.get_or_create(
-                            result_id=result.id,
-                            parameter_id=pseudo_parameters_pk[parameter],
-                        )
-                        text_value.value = value
-                        text_value.save()
+            # Report issues in the order of the rows they occurred in
+            issues = row_issues + numeric_issues + date_issues + text_issues
+            issues.sort(key=lambda issue: issue[0])
+            upload_issues = [validation_entry for index, validation_entry in issues]
+            rows_with_issues = set([index for index, validation_entry in issues])
 
             upload_report = {
                 "rows_processed": self.nrows,
                 "rows_with_issues": len(rows_with_issues),
                 "validation": upload_issues,
             }
+            if diff:
+                upload_report["changes"] = changes
             if dry_run:
                 transaction.set_rollback(True)
-        if upload_issues:
-            for issue in upload_issues:
-                issue.save()
-        else:
-            self.upload_file.valid_model = True
+            commit_start = time.perf_counter()
+        self.timer.add("commit", time.perf_counter() - commit_start)
+        with self.timer.stage("validation_entry_writes"):
+            if upload_issues:
+                ValidationEntry.objects.bulk_create(upload_issues)
+            else:
+                self.upload_file.valid_model = True
+        with self.timer.stage("commit"):
+            if not dry_run:
+                self.upload_file.committed = True
             self.upload_file.save()
+            if not dry_run:
+                bump_generation()
+        if not dry_run:
+            schedule_export_snapshot()
+        self.timer.save(
+            self.upload_file,
+            dry_run,
+            rows=self.nrows,
+            cells=len(numeric_values) + len(date_values) + len(text_values),
+        )
         return upload_report
 
+    def _long_form_values(self, rows, result_ids, columns, value_type):
+        """Convert columns of the data frame to long form values
+
+        Parameters
+        ----------
+        rows : DataFrame
+            rows of the file that have a Result
+        result_ids : Series
+            primary key of the Result for each row (same index as rows)
+        columns : list
+            tuples of (column name, parameter name, parameter primary key)
+        value_type : string
+            one of 'numeric', 'date' or 'text'
+
+        Returns
+        -------
+        values : DataFrame
+            columns result_id, parameter_id and value for all valid cells
+        invalid : DataFrame
+            columns result_id and parameter_id of the cells that are not
+            empty but failed validation
+        issues : list
+            tuples of (row index, ValidationEntry) for invalid cells
+        """
+
+        frames = []
+        invalid_frames = []
+        issues = []
+        for column, parameter, parameter_pk in columns:
+            raw = rows[column]
+            if value_type == "numeric":
+                values = pd.to_numeric(raw, errors="coerce")
+                valid = values.notna()
+            elif value_type == "date":
+                if is_datetime64_any_dtype(raw):
+                    values = raw
+                else:
+                    values = pd.Series(pd.NaT, index=raw.index)
+                valid = values.notna()
+                values = values.dt.date
+            else:
+                values = raw.astype(str).str.strip()
+                valid = (values.str.len() > 0) & (values != "nan")
+
+            frames.append(
+                pd.DataFrame(
+                    {
+                        "result_id": result_ids[valid],
+                        "parameter_id": parameter_pk,
+                        "value": values[valid],
+                    }
+                )
+            )
+
+            # Text values that are empty are skipped silently
+            if value_type == "text":
+                continue
+            invalid = ~valid & raw.notna()
+            invalid_frames.append(
+                pd.DataFrame(
+                    {"result_id": result_ids[invalid], "parameter_id": parameter_pk}
+                )
+            )
+            table = "NumericValue" if value_type == "numeric" else "DateValue"
+            description = "number" if value_type == "numeric" else "Date"
+            for index in raw.index[~valid]:
+                validation_entry = ValidationEntry(
+                    subject_file=self.upload_file,
+                    key=f"row:{index} parameter:{parameter}",
+                    value=f"Value ({raw[index]}) not a "
+                    + f"{description} - not uploaded to {table}"
+                    + " table",
+                    entry_type="WARN",
+                    validation_type="MODEL",
+                )
+                issues.append((index, validation_entry))
+
+        if frames:
+            values = pd.concat(frames, ignore_index=True)
+        else:
+            values = pd.DataFrame(columns=["result_id", "parameter_id", "value"])
+        if invalid_frames:
+            invalid = pd.concat(invalid_frames, ignore_index=True)
+        else:
+            invalid = pd.DataFrame(columns=["result_id", "parameter_id"])
+        return values, invalid, issues
+
 
 class PatientFile:
     """Uploads a file with anonymised patient details."""
@@ -570,13 +723,20 @@ class PatientFile:
         uploaded_file: UploadedFile = None,
         user: User = None,
     ):
+        self.timer = UploadStageTimer()
+        self.duplicate = False
+        if not uploaded_file:
+            content_hash = hash_file_contents(file_contents)
+            uploaded_file = find_duplicate_upload(content_hash, "PATIENT_DATA")
+            self.duplicate = uploaded_file is not None
         if uploaded_file:
             self.upload_file = uploaded_file
             file_name = uploaded_file.name
             file_contents = uploaded_file.content
         self.content = file_contents
         self.file_name = file_name
-        self.df = pd.read_csv(self.content)
+        with self.timer.stage("parse"):
+            self.df = pd.read_csv(self.content)
         self.nrows = len(self.df)
 
         # Default uploaded file
@@ -589,36 +749,44 @@ class PatientFile:
                 content=self.content,
                 notes="",
                 content_type="PATIENT_DATA",
+                content_hash=content_hash,
             )
             self.upload_file.save()
 
         self.patient_ids = self.df["patient"].unique().tolist()
 
     def validate(self):
-        return []
+        with self.timer.stage("header_validation"):
+            return []
 
     def upload(self, dry_run=False):
         """Upload data to relevant tables"""
 
+        # Contents already uploaded or dry run - report the earlier outcome
+        if (self.duplicate and dry_run) or (self.upload_file.committed and not dry_run):
+            return prior_upload_report(self.upload_file, self.nrows, "upload_issues")
+
         upload_issues = []
         rows_with_issues = []
+        n_values = 0
 
         with transaction.atomic():
 
             # Create metadata dict entries if necessary
-            columns = self.df.columns.tolist()
-            columns.remove("patient")
-            metadata_dicts = {}
-            for column in columns:
-                column_lc = column.lower()
-                metadata_dict, created = PatientMetadataDict.objects.get_or_create(
-                    name=column_lc
-                )
-                if created:
-                    metadata_dict.description = f"{column}"
-                    metadata_dict.notes = "Dynamically added"
-                    metadata_dict.save()
-                metadata_dicts[column] = metadata_dict
+            with self.timer.stage("parameter_resolution"):
+                columns = self.df.columns.tolist()
+                columns.remove("patient")
+                metadata_dicts = {}
+                for column in columns:
+                    column_lc = column.lower()
+                    metadata_dict, created = PatientMetadataDict.objects.get_or_create(
+                        name=column_lc
+                    )
+                    if created:
+                        metadata_dict.description = f"{column}"
+                        metadata_dict.notes = "Dynamically added"
+                        metadata_dict.save()
+                    metadata_dicts[column] = metadata_dict
 
             # Enter details for all patients
             for index, row in self.df.iterrows():
@@ -636,29 +804,42 @@ class PatientFile:
                     upload_issues.append(validation_entry)
                     rows_with_issues.append(index)
                     continue
-                patient = Patient.objects.get_or_create(patient_id=patient_id)[0]
+                with self.timer.stage("sample_resolution"):
+                    patient = Patient.objects.get_or_create(patient_id=patient_id)[0]
 
                 # Store metadata associated with patient
-                for column, metadata_dict in metadata_dicts.items():
-                    value = str(row[column]).strip()
-                    if len(value) > 0 and value != "nan":
-                        patient_metadata = PatientMetadata.objects.get_or_create(
-                            patient=patient, metadata_key=metadata_dict
-                        )[0]
-                        patient_metadata.metadata_value = value
-                        patient_metadata.save()
-
-            if upload_issues:
-                for issue in upload_issues:
-                    issue.save()
-            else:
-                self.upload_file.valid_model = True
+                with self.timer.stage("value_writes"):
+                    for column, metadata_dict in metadata_dicts.items():
+                        value = str(row[column]).strip()
+                        if len(value) > 0 and value != "nan":
+                            patient_metadata = PatientMetadata.objects.get_or_create(
+                                patient=patient, metadata_key=metadata_dict
+                            )[0]
+                            patient_metadata.metadata_value = value
+                            patient_metadata.save()
+                            n_values += 1
+
+            with self.timer.stage("validation_entry_writes"):
+                if upload_issues:
+                    for issue in upload_issues:
+                        issue.save()
+                else:
+                    self.upload_file.valid_model = True
 
             if dry_run:
                 transaction.set_rollback(True)
             else:
                 # Put this here as I think uploaded file is also saved to disk. Can this be rolled back?
+                self.upload_file.committed = True
                 self.upload_file.save()
+            commit_start = time.perf_counter()
+        self.timer.add("commit", time.perf_counter() - commit_start)
+
+        if not dry_run:
+            with self.timer.stage("commit"):
+                bump_generation()
+            schedule_export_snapshot()
+        self.timer.save(self.upload_file, dry_run, rows=self.nrows, cells=n_values)
 
         upload_report = {
             "rows_processed": self.nrows,
@@ -666,3 +847,138 @@ class PatientFile:
             "upload_issues": upload_issues,
         }
         return upload_report
+
+
+class UploadStageTimer:
+    """Accumulates the time spent in each stage of an upload
+
+    The stages are those of UploadTiming. Call save() at the end of each
+    run of upload() to store and log the timings.
+    """
+
+    def __init__(self):
+        self.seconds = dict.fromkeys(UploadTiming.STAGES, 0.0)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Context manager adding the time spent in its block to stage name"""
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        self.seconds[name] += seconds
+
+    def save(self, upload_file, dry_run, rows, cells):
+        """Store the timings of an upload run and start timing afresh
+
+        Parameters
+        ----------
+        upload_file : UploadedFile
+            the file that was uploaded
+        dry_run : boolean
+            whether the run was a dry run
+        rows : int
+            number of rows in the file
+        cells : int
+            number of values written
+
+        Returns
+        -------
+        timing : UploadTiming
+            the stored timings
+        """
+
+        timing = UploadTiming.objects.create(
+            uploaded_file=upload_file,
+            dry_run=dry_run,
+            rows=rows,
+            cells=cells,
+            **self.seconds,
+        )
+        self.seconds = dict.fromkeys(UploadTiming.STAGES, 0.0)
+
+        logger.info(
+            "Uploaded %s%s: %d rows, %d values in %.3fs "
+            + "(%.0f rows/s, %.0f values/s) - %s",
+            upload_file.name,
+            " (dry run)" if dry_run else "",
+            rows,
+            cells,
+            timing.total,
+            timing.rows_per_second,
+            timing.cells_per_second,
+            ", ".join(
+                f"{stage} {getattr(timing, stage):.3f}s"
+                for stage in UploadTiming.STAGES
+            ),
+        )
+        record_upload(upload_file.content_type, timing)
+        return timing
+
+
+def hash_file_contents(file_contents):
+    """Return the SHA-256 hex digest of an uploaded file
+
+    The contents are read in chunks so large files are never held in
+    memory twice. The file is rewound afterwards so it can still be parsed.
+    """
+
+    sha256 = hashlib.sha256()
+    for chunk in file_contents.chunks():
+        sha256.update(chunk)
+    file_contents.seek(0)
+    return sha256.hexdigest()
+
+
+def find_duplicate_upload(content_hash, content_type, gating_strategy=None):
+    """Return the UploadedFile an upload would only repeat, or None
+
+    That is the latest committed upload of the content type - for panel
+    results, the latest whose results are stored under gating_strategy -
+    if it has the same contents. An earlier file uploaded again, e.g. to
+    revert a correction, is not a duplicate and is uploaded as usual.
+    """
+
+    uploaded_files = UploadedFile.objects.filter(
+        content_type=content_type, committed=True
+    )
+    if gating_strategy is not None:
+        uploaded_files = uploaded_files.filter(
+            results__gating_strategy=gating_strategy
+        ).distinct()
+    latest = uploaded_files.order_by("-created", "-id").first()
+    if latest is not None and latest.content_hash == content_hash:
+        return latest
+    return None
+
+
+def prior_validation_entries(upload_file, validation_type):
+    """Return the distinct validation entries stored for an uploaded file"""
+
+    validation_entries = []
+    seen = set()
+    for validation_entry in ValidationEntry.objects.filter(
+        subject_file=upload_file, validation_type=validation_type
+    ).order_by("id"):
+        if (validation_entry.key, validation_entry.value) not in seen:
+            seen.add((validation_entry.key, validation_entry.value))
+            validation_entries.append(validation_entry)
+    return validation_entries
+
+
+def prior_upload_report(upload_file, nrows, issues_key):
+    """Rebuild the upload report of an earlier run from its stored entries"""
+
+    upload_issues = prior_validation_entries(upload_file, "MODEL")
+    rows_with_issues = set(
+        [validation_entry.key.split(" ")[0] for validation_entry in upload_issues]
+    )
+    return {
+        "rows_processed": nrows,
+        "rows_with_issues": len(rows_with_issues),
+        issues_key: upload_issues,
+    }
@@ -1,15 +1,43 @@
+import os
+
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
 from django.contrib.postgres.aggregates import ArrayAgg
 from django.core.serializers.json import DjangoJSONEncoder
-from django.db.models import F
+from django.db.models import F, Min
 from django.shortcuts import render, get_object_or_404, get_list_or_404
-from django.http import HttpResponseRedirect, HttpResponse
+from django.http import (
+    HttpResponseRedirect,
+    HttpResponse,
+    HttpResponseForbidden,
+    FileResponse,
+    Http404,
+)
 
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, renderer_classes
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from rest_framework import status
 
+from openfacstrack.apps.track.caching import cache_api_response, conditional_response
+from openfacstrack.apps.track.export import (
+    current_snapshot_path,
+    export_json,
+    schedule_export_snapshot,
+)
+from openfacstrack.apps.track.changes import (
+    DEFAULT_PAGE_SIZE,
+    MAX_PAGE_SIZE,
+    get_changes as get_changes_page,
+)
+from openfacstrack.apps.track.filters import (
+    filter_results,
+    parse_datetime_param,
+    selected_parameters,
+)
 from openfacstrack.apps.track.forms import ConfirmFileForm
+from openfacstrack.apps.track.metrics import render_metrics
 from openfacstrack.apps.track.models import (
     Panel,
     ProcessedSample,
@@ -23,16 +51,22 @@ from openfacstrack.apps.track.models import (
     Patient,
     PatientMetadata,
 )
+from openfacstrack.apps.track.renderers import API_RENDERER_CLASSES
 from openfacstrack.apps.track.serializers import (
     PatientSerializer,
     ProcessedSampleSerializer,
     ObservationSerializer,
     AllDataSerializer,
+    response_data,
+    serializer_context,
+    sparse_queryset,
 )
 
+import hmac
 import json
+import logging
 
-from openfacstrack.apps.track.utils import ClinicalSampleFile, PatientFile
+logger = logging.getLogger(__name__)
 
 
 def index(request):
@@ -45,6 +79,10 @@ def home(request):
 
 @login_required(login_url="/track/login/")
 def upload(request):
+    # Imported here, as the upload classes import pandas, so that processes
+    # only pay for importing it when they handle an upload
+    from openfacstrack.apps.track.utils import ClinicalSampleFile, PatientFile
+
     if request.method == "POST":
         file_type = None
         if request.FILES.get("observationsFile"):
@@ -54,9 +92,9 @@ def upload(request):
         if file_type:
             gating_strategy = GatingStrategy.objects.get_or_create(strategy="manual")[0]
             gating_strategy.save()
-            print(f"Gating strategy id = {gating_strategy.id}")
             file_name = request.FILES[file_type].name
             file_contents = request.FILES.get(file_type)
+            diff = file_type == "observationsFile" and bool(request.POST.get("diff"))
             if file_type == "observationsFile":
                 uploaded_file = ClinicalSampleFile(
                     file_name,
@@ -89,12 +127,17 @@ def upload(request):
                 validation_report = {}
             upload_report = {}
             if not uploaded_file.upload_file.valid_syntax:
-                print("Validation errors, aborting upload:")
-                print(validation_errors)
+                logger.info(
+                    "Validation errors in %s, aborting upload: %s",
+                    file_name,
+                    validation_errors,
+                )
             else:
-                print("trying upload")
                 try:
-                    upload_report = uploaded_file.upload(dry_run=True)
+                    if diff:
+                        upload_report = uploaded_file.upload(dry_run=True, diff=True)
+                    else:
+                        upload_report = uploaded_file.upload(dry_run=True)
                     upload_errors = {
                         "info": [
                             error
@@ -114,10 +157,10 @@ def upload(request):
                     }
                     upload_report["validation"] = upload_errors
                 except Exception as e:
-                    print("upload failed")
+                    logger.exception("Dry run upload of %s failed", file_name)
                     upload_report["status"] = "failed"
             confirm_file_form = ConfirmFileForm(
-                initial={"file_id": uploaded_file.upload_file.id}
+                initial={"file_id": uploaded_file.upload_file.id, "diff": diff}
             )
             return render(
                 request,
@@ -131,22 +174,33 @@ def upload(request):
             )
         elif ConfirmFileForm(request.POST).data.get("file_id"):
             gating_strategy = GatingStrategy.objects.get_or_create(strategy="manual")[0]
+            confirm_file_form = ConfirmFileForm(request.POST)
+            confirm_file_form.is_valid()
             uploaded_file = UploadedFile.objects.get(
-                pk=ConfirmFileForm(request.POST).data.get("file_id")
+                pk=confirm_file_form.data.get("file_id")
             )
+            upload_report = {}
             if uploaded_file.content_type == "PANEL_RESULTS":
                 uploaded_file = ClinicalSampleFile(
                     user=request.user,
                     uploaded_file=uploaded_file,
                     gating_strategy=gating_strategy,
                 )
+                uploaded_file.validate()
+                upload_report = uploaded_file.upload(
+                    diff=confirm_file_form.cleaned_data.get("diff", False)
+                )
             else:
                 uploaded_file = PatientFile(
                     user=request.user, uploaded_file=uploaded_file
                 )
-            uploaded_file.validate()
-            uploaded_file.upload()
-            return render(request, "track/upload.html", {"upload_status": "success"})
+                uploaded_file.validate()
+                uploaded_file.upload()
+            return render(
+                request,
+                "track/upload.html",
+                {"upload_status": "success", "changes": upload_report.get("changes")},
+            )
     return render(request, "track/upload.html")
 
 
@@ -158,19 +212,31 @@ def panels_view(request):
 
 @login_required(login_url="/track/login/")
 def samples_view(request):
-    samples = (
-        ProcessedSample.objects.all()
+    # The first sample of each patient, picked in the database. GROUP BY
+    # rather than DISTINCT ON, which only PostgreSQL supports.
+    first_samples = (
+        ProcessedSample.objects.values("patient")
+        .annotate(first_id=Min("id"))
+        .values("first_id")
+    )
+    samples = list(
+        ProcessedSample.objects.filter(id__in=first_samples)
         .annotate(patient_covid_id=F("patient__patient_id"))
-        .distinct("patient_covid_id")
         .order_by("patient_covid_id")
         .values()
     )
-    for sample in samples:
-        panels_by_sample = Result.objects.filter(processed_sample=sample["id"]).values(
-            "panel__name", "created"
-        )
-        for panel in panels_by_sample:
-            sample[panel["panel__name"]] = panel["created"]
+
+    # Dates the panels of all these samples were uploaded, in one query
+    samples_by_id = {sample["id"]: sample for sample in samples}
+    panels_by_sample = (
+        Result.objects.filter(processed_sample__in=list(samples_by_id))
+        .order_by("id")
+        .values("processed_sample", "panel__name", "created")
+    )
+    for panel in panels_by_sample:
+        samples_by_id[panel["processed_sample"]][panel["panel__name"]] = panel[
+            "created"
+        ]
     panel_names = [
         panel["name"] for panel in Panel.objects.values("name").order_by("name")
     ]
@@ -196,7 +262,7 @@ def observations_view(request):
     else:
         patient_id = request.GET.get("patient")
         numeric = (
-            NumericValue.objects.all()
+            NumericValue.objects.select_related("parameter")
             .annotate(patient_id=F("result__processed_sample__patient__id"))
             .annotate(panel_name=F("result__panel__name"))
             .filter(patient_id=patient_id)
@@ -212,118 +278,171 @@ def observations_view(request):
         )
 
 
+@conditional_response(vary=["Accept-Encoding"])
 def export_view(request):
-    patients = list(Patient.objects.all().values("id", "patient_id"))
-    for patient in patients:
-        patient_id = patient["id"]
-        patient_metadata = (
-            PatientMetadata.objects.filter(patient=patient_id)
-            .annotate(column_name=F("metadata_key__name"))
-            .all()
-            .values()
-        )
-        for metadata_item in list(patient_metadata):
-            patient[metadata_item["column_name"]] = metadata_item["metadata_value"]
+    """Serve the latest export snapshot, building the export if there is none"""
+
+    response = None
+    compressed = False
+    if settings.EXPORT_SNAPSHOT_ACCEL_REDIRECT:
+        # Let nginx send the file. Always pointed at the uncompressed
+        # snapshot - nginx drops Content-Encoding on internal redirects, and
+        # sends the .gz next to it itself to clients accepting gzip
+        # (gzip_static in docker/nginx/nginx.conf).
+        snapshot = current_snapshot_path()
+        if snapshot is not None:
+            response = HttpResponse(content_type="application/json")
+            response["X-Accel-Redirect"] = settings.EXPORT_SNAPSHOT_ACCEL_REDIRECT + (
+                os.path.basename(snapshot)
+            )
+    else:
+        compressed = "gzip" in request.META.get("HTTP_ACCEPT_ENCODING", "")
+        snapshot = current_snapshot_path(compressed) if compressed else None
+        if snapshot is None:
+            compressed = False
+            snapshot = current_snapshot_path()
+    if response is None and snapshot is not None:
+        try:
+            response = FileResponse(
+                open(snapshot, "rb"), content_type="application/json"
+            )
+        except FileNotFoundError:
+            # Removed since it was found, as newer data has been committed
+            pass
+    if response is None:
+        compressed = False
+        schedule_export_snapshot()
+        response = HttpResponse(export_json(), content_type="application/json")
+    if compressed:
+        response["Content-Encoding"] = "gzip"
+    return response
 
-        patient["samples"] = list(
-            ProcessedSample.objects.filter(patient=patient_id).values()
-        )
 
-        for sample in patient["samples"]:
-            sample_id = sample["id"]
-            sample_results = (
-                Result.objects.filter(processed_sample=sample_id)
-                .annotate(panel_name=F("panel__name"))
-                .annotate(gating_strategy_name=F("gating_strategy__strategy"))
-                .values()
-            )
-            sample["panels"] = list(sample_results)
-            for result in sample["panels"]:
-                result_id = result["id"]
-                result["observations"] = list(
-                    NumericValue.objects.filter(result=result_id)
-                    .annotate(parameter_name=F("parameter__public_name"))
-                    .values()
-                )
-                result["observations"] += list(
-                    TextValue.objects.filter(result=result_id)
-                    .annotate(parameter_name=F("parameter__public_name"))
-                    .values()
-                )
-                result["observations"] += list(
-                    DateValue.objects.filter(result=result_id)
-                    .annotate(parameter_name=F("parameter__public_name"))
-                    .values()
-                )
+def login(request):
+    return render(request, "track/login.html")
+
 
+def metrics_view(request):
+    """Serve request metrics in the Prometheus text format to staff users,
+    to scrapers sending TRACK_METRICS_TOKEN as a bearer token and to the
+    addresses in TRACK_METRICS_ALLOWED_IPS"""
+
+    token = settings.TRACK_METRICS_TOKEN
+    authorization = request.META.get("HTTP_AUTHORIZATION", "")
+    if not (
+        request.user.is_staff
+        or (token and hmac.compare_digest(authorization, f"Bearer {token}"))
+        or request.META.get("REMOTE_ADDR") in settings.TRACK_METRICS_ALLOWED_IPS
+    ):
+        return HttpResponseForbidden()
     return HttpResponse(
-        json.dumps(patients, indent=1, cls=DjangoJSONEncoder),
-        content_type="application/json",
+        render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8"
     )
 
 
-def login(request):
-    return render(request, "track/login.html")
+@staff_member_required(login_url="/track/login/")
+def profile_view(request, file_name):
+    """Serve a file of a request or upload profile (see profiling.py)"""
+
+    path = os.path.join(settings.TRACK_PROFILE_DIR, os.path.basename(file_name))
+    if not file_name.endswith((".prof", ".sql.json")) or not os.path.exists(path):
+        raise Http404("No such profile")
+    return FileResponse(open(path, "rb"), as_attachment=True)
 
 
 @api_view(
     ["GET",]
 )
+@renderer_classes(API_RENDERER_CLASSES)
+@conditional_response
+@cache_api_response
 def get_patients(request, pk=None):
-    """Get details of all patients or specified patient"""
+    """Get details of all patients or specified patient
+
+    ?fields= selects the fields returned.
+    """
 
+    context = serializer_context(request)
+    patients = sparse_queryset(Patient.objects.all(), PatientSerializer, context)
     if pk is None:
-        patients = Patient.objects.all()
-        serializer = PatientSerializer(patients, many=True)
-        return Response(serializer.data)
+        serializer = PatientSerializer(patients, many=True, context=context)
+        return Response(response_data(request, serializer))
     else:
-        patient = get_object_or_404(Patient, patient_id=pk)
-        serializer = PatientSerializer(patient)
-        return Response(serializer.data)
+        patient = get_object_or_404(patients, patient_id=pk)
+        serializer = PatientSerializer(patient, context=context)
+        return Response(response_data(request, serializer))
 
 
 @api_view(
     ["GET",]
 )
+@renderer_classes(API_RENDERER_CLASSES)
+@conditional_response
+@cache_api_response
 def get_samples(request, pk=None):
-    """Get details of all samples (excluding results) or specified sample"""
+    """Get details of all samples (excluding results) or specified sample
+
+    ?fields= selects the fields returned.
+    """
 
+    context = serializer_context(request)
+    samples = sparse_queryset(
+        ProcessedSample.objects.all(), ProcessedSampleSerializer, context
+    )
     if pk is None:
-        samples = ProcessedSample.objects.all()
-        serializer = ProcessedSampleSerializer(samples, many=True)
+        serializer = ProcessedSampleSerializer(samples, many=True, context=context)
     elif pk.find("n") >= 0:
-        sample = get_object_or_404(ProcessedSample, clinical_sample_id=pk)
-        serializer = ProcessedSampleSerializer(sample)
+        sample = get_object_or_404(samples, clinical_sample_id=pk)
+        serializer = ProcessedSampleSerializer(sample, context=context)
 
     else:
-        samples = get_list_or_404(ProcessedSample, patient__patient_id=pk)
-        serializer = ProcessedSampleSerializer(samples, many=True)
-    return Response(serializer.data)
+        samples = get_list_or_404(samples, patient__patient_id=pk)
+        serializer = ProcessedSampleSerializer(samples, many=True, context=context)
+    return Response(response_data(request, serializer))
 
 
 @api_view(
     ["GET",]
 )
+@renderer_classes(API_RENDERER_CLASSES)
+@conditional_response
+@cache_api_response
 def get_observations(request, pk=None):
-    """Get all results or specific results by patient_id or clinical_sample_id"""
-
+    """Get all results or specific results by patient_id or clinical_sample_id
+
+    ?fields= selects the fields returned and ?include= the value types
+    (numeric, text and/or date). With ?layout=normalized values are given
+    as [parameter id, value] pairs and the parameters are listed once.
+    Results can be filtered by panel, parameter, processing date, upload,
+    gating strategy and modification time - see filters.py.
+    """
+
+    context = serializer_context(request)
+    context["value_parameters"] = selected_parameters(request.query_params)
+    results = filter_results(Result.objects.all(), request.query_params)
     if pk is None:
-        results = Result.objects.all()
-        serializer = ObservationSerializer(results, many=True)
+        serializer = ObservationSerializer(results, many=True, context=context)
     elif pk.find("n") >= 0:
-        results = get_list_or_404(Result, processed_sample__clinical_sample_id=pk)
-        serializer = ObservationSerializer(results, many=True)
+        results = get_list_or_404(results, processed_sample__clinical_sample_id=pk)
+        serializer = ObservationSerializer(results, many=True, context=context)
     else:
-        results = get_list_or_404(Result, processed_sample__patient__patient_id=pk)
-        serializer = ObservationSerializer(results, many=True)
-    return Response(serializer.data)
+        results = get_list_or_404(results, processed_sample__patient__patient_id=pk)
+        serializer = ObservationSerializer(results, many=True, context=context)
+    return Response(response_data(request, serializer, context["normalized"]))
 
 
 @api_view(
     ["GET",]
 )
+@renderer_classes(API_RENDERER_CLASSES)
+@conditional_response
+@cache_api_response
 def get_all_data(request, pk=None):
-    """Get all patient, sample and results"""
+    """Get all patient, sample and results
+
+    Supports ?fields=, ?include= and ?layout=normalized like
+    get_observations, with ?fields= selecting patient fields.
+    """
 
     # if pk is None:
     #    results = Result.objects.all()
@@ -335,10 +454,46 @@ def get_all_data(request, pk=None):
     #    results = get_list_or_404(Result, processed_sample__patient__patient_id=pk)
     #    serializer = AllDataSerializer(results, many=True)
 
+    context = serializer_context(request)
+    patients = sparse_queryset(Patient.objects.all(), AllDataSerializer, context)
     if pk is None:
-        patients = Patient.objects.all()
-        serializer = AllDataSerializer(patients, many=True)
+        serializer = AllDataSerializer(patients, many=True, context=context)
+        # Results of all samples are serialized together
+        context["results"] = Result.objects.filter(
+            processed_sample__patient__in=patients.values("pk")
+        )
     else:
-        patients = get_object_or_404(Patient, patient_id=pk)
-        serializer = AllDataSerializer(patients)
-    return Response(serializer.data)
+        patients = get_object_or_404(patients, patient_id=pk)
+        serializer = AllDataSerializer(patients, context=context)
+        context["results"] = Result.objects.filter(processed_sample__patient=patients)
+    return Response(response_data(request, serializer, context["normalized"]))
+
+
+@api_view(
+    ["GET",]
+)
+@renderer_classes(API_RENDERER_CLASSES)
+def get_changes(request):
+    """Get the rows changed since a time or since the previous page
+
+    ?since= (ISO 8601 date/time) starts the feed at that time and ?cursor=
+    continues from the next_cursor of an earlier page. ?limit= sets the
+    page size. Not cached, as pages change when held back changes become
+    due (see changes.py).
+    """
+
+    try:
+        limit = int(request.query_params.get("limit", DEFAULT_PAGE_SIZE))
+    except ValueError:
+        limit = 0
+    if not 0 < limit <= MAX_PAGE_SIZE:
+        raise ValidationError(
+            {"limit": [f"Must be a whole number from 1 to {MAX_PAGE_SIZE}"]}
+        )
+
+    page = get_changes_page(
+        since=parse_datetime_param(request.query_params, "since"),
+        cursor=request.query_params.get("cursor"),
+        limit=limit,
+    )
+    return Response(page)
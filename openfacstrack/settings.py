@@ -32,6 +32,9 @@ ALLOWED_HOSTS = os.environ.get("DJANGO_ALLOWED_HOSTS", "").split(" ")
 
 # Application definition
 
+# Runs the tests with the file caches in temporary directories
+TEST_RUNNER = "openfacstrack.test_runner.TrackTestRunner"
+
 INSTALLED_APPS = [
     "django.contrib.auth",
     "mozilla_django_oidc",
@@ -45,7 +48,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "openfacstrack.apps.track.middleware.MetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
+    "openfacstrack.apps.track.middleware.CompressionMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -53,6 +58,7 @@ MIDDLEWARE = [
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
     "mozilla_django_oidc.middleware.SessionRefresh",
+    "openfacstrack.apps.track.middleware.ProfilingMiddleware",
 ]
 
 AUTHENTICATION_BACKENDS = (
@@ -92,9 +98,120 @@ DATABASES = {
         "PASSWORD": os.environ.get("SQL_PASSWORD", "password"),
         "HOST": os.environ.get("SQL_HOST", "localhost"),
         "PORT": os.environ.get("SQL_PORT", "5432"),
+        # Keep connections open between requests for this many seconds
+        # (0 closes them after every request)
+        "CONN_MAX_AGE": int(os.environ.get("SQL_CONN_MAX_AGE", 60)),
+        # Check a persistent connection still works before reusing it
+        "CONN_HEALTH_CHECKS": os.environ.get("SQL_CONN_HEALTH_CHECKS", "1") == "1",
+        # Needed behind a transaction pooler such as pgbouncer
+        "DISABLE_SERVER_SIDE_CURSORS": os.environ.get(
+            "SQL_DISABLE_SERVER_SIDE_CURSORS", "0"
+        )
+        == "1",
+    }
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/3.0/topics/cache/
+# Local memory by default. When running several worker processes use a
+# shared backend (e.g. django.core.cache.backends.filebased.FileBasedCache)
+# so that invalidation after an upload reaches every worker.
+
+CACHES = {
+    "default": {
+        "BACKEND": os.environ.get(
+            "CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"
+        ),
+        "LOCATION": os.environ.get("CACHE_LOCATION", "openfacstrack"),
+        "OPTIONS": {"MAX_ENTRIES": int(os.environ.get("CACHE_MAX_ENTRIES", 1000))},
     }
 }
 
+# Seconds to keep cached API responses. Responses are invalidated when
+# data is uploaded, so this only bounds memory use. 0 disables caching.
+API_CACHE_TIMEOUT = int(os.environ.get("API_CACHE_TIMEOUT", 3600))
+
+
+# Serialize observations from values_list() rows instead of model
+# instances - same output, far less CPU per value
+TRACK_FAST_SERIALIZERS = bool(int(os.environ.get("TRACK_FAST_SERIALIZERS", 1)))
+
+
+# Days deleted rows are listed in the change feed before the deletion log
+# is pruned (manage.py prune_deletion_log)
+DELETION_LOG_RETENTION_DAYS = int(os.environ.get("DELETION_LOG_RETENTION_DAYS", 90))
+# Changes are held back from the change feed for this long, so rows written
+# by an upload that has not committed yet are not paged past. Must be
+# longer than the longest upload transaction.
+CHANGE_FEED_LAG_SECONDS = int(os.environ.get("CHANGE_FEED_LAG_SECONDS", 300))
+
+
+# Precomputed export snapshots, regenerated after each committed upload.
+# Set EXPORT_SNAPSHOT_ACCEL_REDIRECT to the internal nginx location of
+# EXPORT_SNAPSHOT_DIR to let nginx send the files.
+EXPORT_SNAPSHOT_DIR = os.environ.get(
+    "EXPORT_SNAPSHOT_DIR", os.path.join(BASE_DIR, "cache", "exports")
+)
+EXPORT_SNAPSHOT_BACKGROUND = True
+EXPORT_SNAPSHOT_ACCEL_REDIRECT = os.environ.get("EXPORT_SNAPSHOT_ACCEL_REDIRECT", "")
+
+
+# Route the observation, all data and export endpoints to their async
+# versions. Only worth enabling when served under ASGI - under WSGI each
+# request would start an event loop of its own.
+TRACK_ASYNC_VIEWS = bool(int(os.environ.get("TRACK_ASYNC_VIEWS", 0)))
+
+
+# Per view request metrics, served at /track/metrics/ for Prometheus.
+# Requests over either threshold are logged as warnings.
+TRACK_METRICS = bool(int(os.environ.get("TRACK_METRICS", 1)))
+TRACK_SLOW_REQUEST_SECONDS = float(os.environ.get("TRACK_SLOW_REQUEST_SECONDS", 2))
+TRACK_SLOW_REQUEST_QUERIES = int(os.environ.get("TRACK_SLOW_REQUEST_QUERIES", 50))
+# Each process writes its counters here for the metrics view to add up.
+# Must not be shared between hosts or containers.
+TRACK_METRICS_DIR = os.environ.get(
+    "TRACK_METRICS_DIR", os.path.join(BASE_DIR, "cache", "metrics")
+)
+# Besides logged in staff users, the metrics can be fetched with this
+# token (e.g. by the Prometheus server) as "Authorization: Bearer <token>"
+TRACK_METRICS_TOKEN = os.environ.get("TRACK_METRICS_TOKEN", "")
+# Addresses allowed to fetch the metrics without a token, separated by
+# spaces. Behind nginx every request comes from the proxy's address, so
+# only list addresses that reach the app server directly.
+TRACK_METRICS_ALLOWED_IPS = os.environ.get("TRACK_METRICS_ALLOWED_IPS", "").split()
+
+# Range partition the value tables by result id on PostgreSQL (see
+# apps/track/partitioning.py). Applied by migrations and by manage.py
+# ensure_value_partitions, which also adds partitions as results grow -
+# run it on a schedule, as new results go to the DEFAULT partition until
+# it adds theirs.
+TRACK_PARTITION_VALUES = bool(int(os.environ.get("TRACK_PARTITION_VALUES", 0)))
+TRACK_VALUE_PARTITION_SIZE = int(os.environ.get("TRACK_VALUE_PARTITION_SIZE", 100000))
+
+# Let staff users profile requests with ?profile=1 or the X-Track-Profile
+# header (under WSGI only). Profiles (cProfile stats and SQL log) are
+# written here.
+TRACK_PROFILING = bool(int(os.environ.get("TRACK_PROFILING", 1)))
+TRACK_PROFILE_DIR = os.environ.get(
+    "TRACK_PROFILE_DIR", os.path.join(BASE_DIR, "cache", "profiles")
+)
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "formatters": {
+        "verbose": {"format": "%(asctime)s %(levelname)s %(name)s %(message)s"}
+    },
+    "handlers": {"console": {"class": "logging.StreamHandler", "formatter": "verbose"}},
+    "loggers": {
+        "openfacstrack": {
+            "handlers": ["console"],
+            "level": os.environ.get("TRACK_LOG_LEVEL", "INFO"),
+        }
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
@@ -155,6 +272,12 @@ USE_TZ = True
 STATIC_URL = "/static/"
 STATIC_ROOT = os.path.join(BASE_DIR, "static/")
 
+# Parsed snapshots of reference data spreadsheets (keyed on file hash,
+# reader engine and pandas version)
+REFERENCE_DATA_CACHE_DIR = os.environ.get(
+    "REFERENCE_DATA_CACHE_DIR", os.path.join(BASE_DIR, "cache", "reference_data")
+)
+
 # Settings for Django Rest Framework
 REST_FRAMEWORK = {
     # Use Django's standard `django.contrib.auth` permissions,
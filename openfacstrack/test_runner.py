@@ -0,0 +1,48 @@
+"""
+Test runner for the project.
+"""
+
+import logging
+import os
+import shutil
+import tempfile
+
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+from openfacstrack.apps.track.metrics import clear_metrics
+
+
+class TrackTestRunner(DiscoverRunner):
+    """Run the tests with the file caches (parsed reference data, export
+    snapshots, profiles, metrics) in a temporary directory rather than in
+    the repository's cache/ directory
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.cache_dir = tempfile.mkdtemp()
+        directories = {
+            "REFERENCE_DATA_CACHE_DIR": "reference_data",
+            "EXPORT_SNAPSHOT_DIR": "exports",
+            "TRACK_PROFILE_DIR": "profiles",
+            "TRACK_METRICS_DIR": "metrics",
+        }
+        for name, directory in directories.items():
+            directories[name] = os.path.join(self.cache_dir, directory)
+            os.makedirs(directories[name])
+        self.cache_settings = override_settings(**directories)
+        self.cache_settings.enable()
+
+        # Keep the per upload timings and other INFO messages out of the
+        # test output
+        if "TRACK_LOG_LEVEL" not in os.environ:
+            logging.getLogger("openfacstrack").setLevel(logging.WARNING)
+
+    def teardown_test_environment(self, **kwargs):
+        # Nothing left for the metrics to write at exit, after the
+        # temporary directory is gone
+        clear_metrics()
+        self.cache_settings.disable()
+        shutil.rmtree(self.cache_dir)
+        super().teardown_test_environment(**kwargs)